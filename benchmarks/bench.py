@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from importlib import metadata
+from typing import Any, Awaitable, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wiremongo import AsyncCursor, FindOneMock, WireMongo  # noqa: E402
+from wiremongo import tools  # noqa: E402
+
+DATABASE, COLLECTION = "bench_db", "bench_collection"
+
+
+def _best(repeat: int, run: Callable[[], float]) -> float:
+    """Smallest of repeated measurements in seconds, the least disturbed by the rest of the system"""
+    return min(run() for _ in range(repeat))
+
+
+async def _best_async(repeat: int, run: Callable[[], Awaitable[float]]) -> float:
+    return min([await run() for _ in range(repeat)])
+
+
+def _timed(function: Callable[[], Any]) -> float:
+    gc.collect()
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def _mocks(count: int, shape: str) -> list[FindOneMock]:
+    """Mocks with equality-only queries the exact index resolves, or nested queries every call scans"""
+    query = (lambda i: {"_id": i}) if shape == "exact" else (lambda i: {"profile": {"id": i}})
+    return [
+        FindOneMock().with_database(DATABASE).with_collection(COLLECTION).with_query(query(i)).returns({"_id": i})
+        for i in range(count)
+    ]
+
+
+async def bench_dispatch(counts: list[int], repeat: int, lean: bool) -> list[dict]:
+    """Per call latency of a find_one matching the last registered mock"""
+    results = []
+    for count in counts:
+        entry = {"mocks": count}
+        for shape in ("exact", "scan"):
+            wiremongo = WireMongo(lean=lean)
+            wiremongo.mock(*_mocks(count, shape)).build()
+            collection = wiremongo.client[DATABASE][COLLECTION]
+            query = {"_id": count - 1} if shape == "exact" else {"profile": {"id": count - 1}}
+            calls = 1000 if shape == "exact" else max(10, min(1000, 1_000_000 // count))
+
+            async def run() -> float:
+                gc.collect()
+                started = time.perf_counter()
+                for _ in range(calls):
+                    await collection.find_one(query)
+                return (time.perf_counter() - started) / calls
+
+            await collection.find_one(query)
+            entry[f"{shape}_us"] = round(await _best_async(repeat, run) * 1e6, 3)
+            wiremongo.reset()
+        results.append(entry)
+    return results
+
+
+def bench_build_and_reset(counts: list[int], repeat: int, lean: bool) -> tuple[list[dict], list[dict]]:
+    """Time of building all mocks at once, and of resetting the built instance"""
+    builds, resets = [], []
+    for count in counts:
+        mocks = _mocks(count, "exact")
+        build_times, reset_times = [], []
+        for _ in range(repeat):
+            wiremongo = WireMongo(lean=lean)
+            build_times.append(_timed(lambda: wiremongo.mock(*mocks).build()))
+            reset_times.append(_timed(wiremongo.reset))
+        builds.append({"mocks": count, "seconds": round(min(build_times), 6)})
+        resets.append({"mocks": count, "seconds": round(min(reset_times), 6)})
+    return builds, resets
+
+
+async def bench_read_filemappings(files: int, repeat: int) -> dict:
+    """Load time of a directory of JSON mappings, cold, from the in-process cache and from a bundle"""
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(files):
+            with open(os.path.join(directory, f"mapping_{i:06d}.json"), "w") as file:
+                json.dump({
+                    "cmd": "find_one", "with_database": DATABASE, "with_collection": COLLECTION,
+                    "with_query": {"_id": i}, "returns": {"_id": i, "name": f"user-{i}"},
+                }, file)
+        bundle = os.path.join(directory, "mappings.bundle")
+
+        async def load(cold: bool, **kwargs) -> float:
+            if cold:
+                tools._mapping_cache.clear()
+            gc.collect()
+            started = time.perf_counter()
+            await tools.read_filemappings(WireMongo(), mappings_dir=directory, **kwargs)
+            return time.perf_counter() - started
+
+        cold = await _best_async(repeat, lambda: load(True))
+        cached = await _best_async(repeat, lambda: load(False))
+        tools.compile_mappings(directory, bundle)
+        bundled = await _best_async(repeat, lambda: load(False, bundle=bundle))
+        tools._mapping_cache.clear()
+    return {"files": files, "cold_seconds": round(cold, 6), "cached_seconds": round(cached, 6), "bundle_seconds": round(bundled, 6)}
+
+
+async def bench_cursor(documents: int, repeat: int) -> dict:
+    """Documents per second iterating AsyncCursor, unbatched, in batches and with sort and limit"""
+    source = [{"_id": i, "rank": (i * 7919) % documents} for i in range(documents)]
+
+    async def iterate(batch_size: int = 0) -> float:
+        gc.collect()
+        started = time.perf_counter()
+        async for _ in AsyncCursor(source, batch_size):
+            pass
+        return time.perf_counter() - started
+
+    async def top() -> float:
+        gc.collect()
+        started = time.perf_counter()
+        await AsyncCursor(source).sort("rank", -1).limit(100).to_list()
+        return time.perf_counter() - started
+
+    return {
+        "documents": documents,
+        "iterate_docs_per_second": round(documents / await _best_async(repeat, iterate)),
+        "batched_docs_per_second": round(documents / await _best_async(repeat, lambda: iterate(101))),
+        "sort_limit_docs_per_second": round(documents / await _best_async(repeat, top)),
+    }
+
+
+def _version() -> str | None:
+    try:
+        return metadata.version("wiremongo")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+async def run(arguments: argparse.Namespace) -> dict:
+    builds, resets = bench_build_and_reset(arguments.mocks, arguments.repeat, arguments.lean)
+    return {
+        "wiremongo": _version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "lean": arguments.lean,
+        "repeat": arguments.repeat,
+        "dispatch": await bench_dispatch(arguments.mocks, arguments.repeat, arguments.lean),
+        "build": builds,
+        "reset": resets,
+        "read_filemappings": await bench_read_filemappings(arguments.files, arguments.repeat),
+        "cursor": await bench_cursor(arguments.documents, arguments.repeat),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure wiremongo's own overhead and print the results as JSON")
+    parser.add_argument("--mocks", type=int, nargs="+", default=[10, 100, 1_000, 10_000, 100_000], help="mock counts to measure dispatch, build and reset with")
+    parser.add_argument("--files", type=int, default=1_000, help="number of mapping files read_filemappings loads")
+    parser.add_argument("--documents", type=int, default=100_000, help="number of documents iterated by cursors")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of every measurement, the best one is reported")
+    parser.add_argument("--lean", action="store_true", help="measure WireMongo(lean=True) instead of the default mode")
+    parser.add_argument("--output", help="also write the results to this file")
+    arguments = parser.parse_args()
+    results = asyncio.run(run(arguments))
+    report = json.dumps(results, indent=2)
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            file.write(report + "\n")
+    print(report)
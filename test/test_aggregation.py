@@ -0,0 +1,101 @@
+import pytest
+
+from wiremongo import WireMongo, AggregateMock, MockClient
+from wiremongo.aggregation import run_pipeline
+
+
+ORDERS = [
+    {"_id": 1, "customer": "a", "status": "paid", "total": 30, "items": ["pen", "ink"]},
+    {"_id": 2, "customer": "b", "status": "paid", "total": 20, "items": ["pad"]},
+    {"_id": 3, "customer": "a", "status": "open", "total": 5, "items": []},
+    {"_id": 4, "customer": "c", "status": "paid", "total": 45.5, "items": ["pen"]},
+]
+
+
+def test_run_pipeline_stages():
+    """Test the supported stages against in-memory documents"""
+    pipeline = [
+        {"$match": {"status": "paid"}},
+        {"$group": {"_id": "$customer", "revenue": {"$sum": "$total"}, "orders": {"$sum": 1}, "largest": {"$max": "$total"}}},
+        {"$sort": {"revenue": -1}},
+    ]
+    assert list(run_pipeline(ORDERS, pipeline)) == [
+        {"_id": "c", "revenue": 45.5, "orders": 1, "largest": 45.5},
+        {"_id": "a", "revenue": 30, "orders": 1, "largest": 30},
+        {"_id": "b", "revenue": 20, "orders": 1, "largest": 20},
+    ]
+
+    pipeline = [{"$unwind": "$items"}, {"$group": {"_id": "$items", "customers": {"$addToSet": "$customer"}}}, {"$sort": {"_id": 1}}]
+    assert list(run_pipeline(ORDERS, pipeline)) == [
+        {"_id": "ink", "customers": ["a"]}, {"_id": "pad", "customers": ["b"]}, {"_id": "pen", "customers": ["a", "c"]},
+    ]
+
+    pipeline = [
+        {"$project": {"_id": 0, "customer": 1, "label": {"$concat": ["$customer", "-", "$status"]}, "large": {"$gte": ["$total", 25]}}},
+        {"$skip": 1},
+        {"$limit": 2},
+    ]
+    assert list(run_pipeline(ORDERS, pipeline)) == [
+        {"customer": "b", "label": "b-paid", "large": False}, {"customer": "a", "label": "a-open", "large": False},
+    ]
+
+    assert list(run_pipeline(ORDERS, [{"$match": {"total": {"$gt": 10}}}, {"$count": "orders"}])) == [{"orders": 3}]
+    assert list(run_pipeline(ORDERS, [{"$match": {"total": {"$gt": 100}}}, {"$count": "orders"}])) == []
+    assert list(run_pipeline(ORDERS, [{"$sort": {"total": 1}}, {"$limit": 2}, {"$project": {"total": 1}}])) == [
+        {"_id": 3, "total": 5}, {"_id": 2, "total": 20},
+    ]
+
+
+def test_run_pipeline_lookup():
+    """Test joining another collection with $lookup"""
+    customers = [{"_id": "a", "name": "Ann"}, {"_id": "b", "name": "Bob"}]
+    pipeline = [{"$match": {"_id": {"$in": [1, 4]}}}, {"$lookup": {"from": "customers", "localField": "customer", "foreignField": "_id", "as": "customer"}}]
+    results = list(run_pipeline(ORDERS, pipeline, lambda name: customers))
+    assert [result["customer"] for result in results] == [[{"_id": "a", "name": "Ann"}], []]
+
+
+def test_run_pipeline_streams_documents():
+    """Test that $match and $limit stop pulling documents once the limit is reached"""
+    produced = []
+
+    def documents():
+        for i in range(1_000_000):
+            produced.append(i)
+            yield {"n": i}
+
+    results = run_pipeline(documents(), [{"$match": {"n": {"$mod": [2, 0]}}}, {"$limit": 3}, {"$project": {"_id": 0, "n": 1}}])
+    assert list(results) == [{"n": 0}, {"n": 2}, {"n": 4}]
+    assert len(produced) == 5
+
+
+@pytest.mark.asyncio
+async def test_aggregate_mock_executes_pipelines():
+    """Test that an AggregateMock with documents runs the called pipeline"""
+    wiremongo = WireMongo()
+    wiremongo.mock(
+        AggregateMock().with_database("testdb").with_collection("orders").with_documents(ORDERS)
+    ).build()
+    collection = wiremongo.client["testdb"]["orders"]
+
+    cursor = await collection.aggregate([{"$match": {"customer": "a"}}, {"$project": {"total": 1}}])
+    assert await cursor.to_list() == [{"_id": 1, "total": 30}, {"_id": 3, "total": 5}]
+    cursor = await collection.aggregate([{"$group": {"_id": None, "average": {"$avg": "$total"}}}])
+    assert await cursor.to_list() == [{"_id": None, "average": 25.125}]
+    assert ORDERS[0]["items"] == ["pen", "ink"]
+
+
+@pytest.mark.asyncio
+async def test_stateful_collection_aggregate():
+    """Test aggregating the documents of a stateful collection"""
+    database = MockClient(stateful=True)["testdb"]
+    await database["orders"].insert_many([dict(order) for order in ORDERS])
+    await database["customers"].insert_many([{"_id": "a", "name": "Ann"}, {"_id": "c", "name": "Cid"}])
+    await database["orders"].create_index("status")
+
+    cursor = await database["orders"].aggregate([
+        {"$match": {"status": "paid"}},
+        {"$lookup": {"from": "customers", "localField": "customer", "foreignField": "_id", "as": "customer"}},
+        {"$unwind": "$customer"},
+        {"$project": {"_id": 0, "name": "$customer.name", "total": 1}},
+    ])
+    assert await cursor.to_list() == [{"total": 30, "name": "Ann"}, {"total": 45.5, "name": "Cid"}]
@@ -1,6 +1,6 @@
 import pytest
 import pytest_asyncio
-from wiremongo import WireMongo, FindOneAndUpdateMock
+from wiremongo import WireMongo, FindOneAndUpdateMock, FindMock
 
 
 @pytest_asyncio.fixture
@@ -69,4 +69,16 @@ async def test_collection_drop_indexes_operation(wiremongo: WireMongo):
     # Test that the mock works
     collection = wiremongo.client["testdb"]["users"]
     result = await collection.drop_indexes()
-    assert result == {"nIndexesWas": 3}
\ No newline at end of file
+    assert result == {"nIndexesWas": 3}
+
+
+@pytest.mark.asyncio
+async def test_find_supports_cursor_modifiers(wiremongo: WireMongo):
+    """Test paginating a mocked find result"""
+    wiremongo.mock(
+        FindMock().with_database("testdb").with_collection("users").with_query({}).returns([{"_id": i} for i in range(100)])
+    ).build()
+
+    collection = wiremongo.client["testdb"]["users"]
+    page = await collection.find({}).sort("_id", -1).skip(10).limit(5).to_list()
+    assert page == [{"_id": i} for i in range(89, 84, -1)]
@@ -109,4 +109,169 @@ async def test_aggregate_mock_returns_cursor_with_none_result():
     
     cursor = await mock.get_result()
     results = await cursor.to_list()
-    assert results == []
\ No newline at end of file
+    assert results == []
+
+@pytest.mark.asyncio
+async def test_async_cursor_pulls_from_generators_lazily():
+    """Test that AsyncCursor only consumes as many documents from a generator as requested"""
+    produced = []
+
+    def documents():
+        for i in range(1_000_000):
+            produced.append(i)
+            yield {"n": i}
+
+    cursor = AsyncCursor(documents())
+    assert cursor.results is None
+    assert await cursor.to_list(2) == [{"n": 0}, {"n": 1}]
+    assert await cursor.__anext__() == {"n": 2}
+    assert len(produced) == 3
+
+
+@pytest.mark.asyncio
+async def test_async_cursor_pulls_from_async_iterables():
+    """Test that AsyncCursor supports async generators"""
+    async def documents():
+        for i in range(3):
+            yield {"n": i}
+
+    cursor = AsyncCursor(documents())
+    results = [doc async for doc in cursor]
+    assert results == [{"n": 0}, {"n": 1}, {"n": 2}]
+
+
+@pytest.mark.asyncio
+async def test_async_cursor_to_list_consumes_the_cursor():
+    """Test that to_list continues where iteration stopped"""
+    cursor = AsyncCursor([{"a": 1}, {"b": 2}, {"c": 3}])
+
+    assert await cursor.__anext__() == {"a": 1}
+    assert await cursor.to_list(1) == [{"b": 2}]
+    assert await cursor.to_list() == [{"c": 3}]
+    assert await cursor.to_list() == []
+
+
+@pytest.mark.asyncio
+async def test_find_mock_calls_result_factory_per_cursor():
+    """Test that a generator factory gives every cursor a fresh stream"""
+    def documents():
+        yield from ({"n": i} for i in range(3))
+
+    mock = FindMock().returns(documents)
+
+    assert await mock.get_result().to_list() == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert await mock.get_result().to_list(1) == [{"n": 0}]
+
+    aggregate_mock = AggregateMock().returns(documents)
+    cursor = await aggregate_mock.get_result()
+    assert await cursor.to_list() == [{"n": 0}, {"n": 1}, {"n": 2}]
+
+
+@pytest.mark.asyncio
+async def test_async_cursor_modifiers():
+    """Test chaining sort, skip, limit and projection on a cursor"""
+    documents = [{"_id": i, "name": f"user{i}", "age": (i * 7) % 10} for i in range(10)]
+
+    cursor = AsyncCursor(documents).sort([("age", -1), ("_id", 1)]).skip(1).limit(3).projection({"age": 1})
+    assert await cursor.to_list() == [{"_id": 4, "age": 8}, {"_id": 1, "age": 7}, {"_id": 8, "age": 6}]
+
+    cursor = AsyncCursor(documents).sort("age").limit(-2).projection({"_id": 0, "name": 0})
+    assert [doc async for doc in cursor] == [{"age": 0}, {"age": 1}]
+
+    assert await AsyncCursor(documents).limit(0).batch_size(4).to_list() == documents
+
+
+@pytest.mark.asyncio
+async def test_async_cursor_limit_short_circuits():
+    """Test that limit stops pulling from a generator and sort with limit keeps only the top documents"""
+    produced = []
+
+    def documents():
+        for i in range(1_000_000):
+            produced.append(i)
+            yield {"n": i}
+
+    cursor = AsyncCursor(documents()).skip(2).limit(3)
+    assert await cursor.to_list() == [{"n": 2}, {"n": 3}, {"n": 4}]
+    assert len(produced) == 5
+
+    async def shuffled():
+        for i in range(1000):
+            yield {"n": (i * 389) % 1000}
+
+    cursor = AsyncCursor(shuffled()).sort("n", -1).limit(3)
+    assert await cursor.to_list() == [{"n": 999}, {"n": 998}, {"n": 997}]
+
+
+@pytest.mark.asyncio
+async def test_async_cursor_sorts_mixed_types():
+    """Test that sort orders values by BSON type first, missing fields sorting like null"""
+    documents = [{"v": "a"}, {"v": 2}, {}, {"v": None}, {"v": 1.5}, {"v": True}, {"v": {"x": 1}}]
+    cursor = AsyncCursor(documents).sort("v")
+    assert await cursor.to_list() == [{}, {"v": None}, {"v": 1.5}, {"v": 2}, {"v": "a"}, {"v": {"x": 1}}, {"v": True}]
+
+
+@pytest.mark.asyncio
+async def test_async_cursor_rejects_modifiers_after_iteration():
+    """Test that modifiers cannot be applied once the cursor was iterated"""
+    from pymongo.errors import InvalidOperation
+
+    cursor = AsyncCursor([{"a": 1}, {"a": 2}])
+    await cursor.__anext__()
+    with pytest.raises(InvalidOperation):
+        cursor.limit(1)
+    with pytest.raises(ValueError):
+        AsyncCursor([]).skip(-1)
+
+
+
+@pytest.mark.asyncio
+async def test_async_cursor_fetches_in_batches():
+    """Test that a batched cursor fetches a whole batch from the source at a time"""
+    produced = []
+
+    def documents():
+        for i in range(10):
+            produced.append(i)
+            yield {"n": i}
+
+    cursor = AsyncCursor(documents(), batch_size=4)
+    assert await cursor.__anext__() == {"n": 0}
+    assert len(produced) == 4
+    assert await cursor.to_list(4) == [{"n": 1}, {"n": 2}, {"n": 3}, {"n": 4}]
+    assert len(produced) == 8
+    assert len(await cursor.to_list()) == 5
+
+
+@pytest.mark.asyncio
+async def test_async_cursor_batch_latency():
+    """Test that every batch awaits the configured latency and yields to the event loop"""
+    import asyncio
+    import time
+
+    start = time.perf_counter()
+    cursor = AsyncCursor([{"n": i} for i in range(6)], batch_size=2, latency=0.02)
+    assert len(await cursor.to_list()) == 6
+    assert time.perf_counter() - start >= 0.06
+
+    events = []
+
+    async def consume(name):
+        async for document in AsyncCursor([{"n": i} for i in range(3)], batch_size=1, latency=0):
+            events.append((name, document["n"]))
+
+    await asyncio.gather(consume("a"), consume("b"))
+    assert events == [("a", 0), ("b", 0), ("a", 1), ("b", 1), ("a", 2), ("b", 2)]
+
+
+@pytest.mark.asyncio
+async def test_mocks_return_batched_cursors():
+    """Test with_batches on find and aggregate mocks"""
+    find_mock = FindMock().returns([{"n": i} for i in range(5)]).with_batches(2, latency=0)
+    cursor = find_mock.get_result()
+    assert cursor._batch_size == 2
+    assert await cursor.sort("n", -1).limit(3).to_list() == [{"n": 4}, {"n": 3}, {"n": 2}]
+
+    aggregate_mock = AggregateMock().returns([{"n": 1}]).with_batches(10)
+    cursor = await aggregate_mock.get_result()
+    assert await cursor.to_list() == [{"n": 1}]
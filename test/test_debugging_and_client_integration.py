@@ -12,7 +12,7 @@ from wiremongo import (
     WireMongo, FindMock, FindOneMock, InsertOneMock, InsertManyMock,
     UpdateOneMock, UpdateManyMock, DeleteOneMock, DeleteManyMock,
     CountDocumentsMock, AggregateMock, DistinctMock, BulkWriteMock,
-    CreateIndexMock, FindOneAndUpdateMock, MockAsyncMongoClient, MockClient
+    CreateIndexMock, FindOneAndUpdateMock, MockAsyncMongoClient, MockClient, NoMatchingMockError
 )
 
 
@@ -212,6 +212,28 @@ def test_can_debug_why_mock_matching_fails(wiremongo: WireMongo):
     assert result2["total_candidates"] == 0
 
 
+def test_find_candidates_ranks_near_misses(wiremongo: WireMongo):
+    """Test that find_candidates includes catch-alls and ranks candidates by matching query fields"""
+    wiremongo.mock(
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "Jane", "age": 25}),
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "John", "age": 31}),
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "John", "age": 30, "role": "admin"}),
+        FindOneMock().with_query({"tenant": 1}),
+    )
+
+    result = wiremongo.find_candidates("testdb", "users", "find_one", {"name": "John", "age": 30}, top_k=2)
+    assert result["total_candidates"] == 4
+    best, second = result["candidates"]
+    assert (best["matches"], best["selected"], best["score"]) == (True, True, 2)
+    assert best["diff"]["role"] == {"expected": "admin", "actual": None, "status": "missing"}
+    assert (second["matches"], second["score"]) == (False, 1)
+    assert second["diff"]["age"] == {"expected": 31, "actual": 30, "status": "mismatch"}
+
+    catch_all = wiremongo.find_candidates("testdb", "users", "find_one", {"name": "John", "age": 30})["candidates"][-1]
+    assert catch_all["catch_all"] and catch_all["score"] == 0
+    assert catch_all["diff"]["name"]["status"] == "unexpected"
+
+
 @pytest.mark.asyncio
 async def test_wiremongo_accepts_async_mock_client():
     """Test that WireMongo can be initialized with AsyncMock client"""
@@ -468,3 +490,61 @@ async def test_find_catch_all_mock_matches_any_database():
     assert results[0] == {"result": "ok"}
     
     wiremongo.reset()
+
+
+@pytest.mark.asyncio
+async def test_stats_count_hits_and_fallthroughs():
+    """Test that stats() reports per mock hits, fall-through calls and timings per operation"""
+    wiremongo = WireMongo(stateful=True, collect_stats=True)
+    john = FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "John"}).returns({"name": "John"})
+    adults = FindOneMock().with_database("testdb").with_collection("users").with_query({"age": {"$gte": 18}}).returns({"adult": True})
+    wiremongo.mock(john, adults).build()
+    users = wiremongo.client["testdb"]["users"]
+
+    for _ in range(3):
+        await users.find_one({"name": "John"})
+    await users.find_one({"age": 30})
+    assert await users.find_one({"name": "Jane"}) is None
+    await users.insert_one({"name": "Jane"})
+
+    stats = wiremongo.stats()["testdb"]["users"]
+    assert (stats["find_one"]["calls"], stats["find_one"]["hits"], stats["find_one"]["fallthroughs"]) == (5, 4, 1)
+    assert stats["find_one"]["mocks"] == [{"mock": repr(john), "hits": 3}, {"mock": repr(adults), "hits": 1}]
+    assert stats["find_one"]["match_seconds"]["total"] > 0
+    assert stats["find_one"]["match_seconds"]["p50"] <= stats["find_one"]["match_seconds"]["p99"]
+    assert stats["find_one"]["respond_seconds"]["p90"] is not None
+    assert (stats["insert_one"]["calls"], stats["insert_one"]["fallthroughs"]) == (1, 1)
+    assert stats["insert_one"]["respond_seconds"]["total"] == 0.0
+
+    wiremongo.reset_stats()
+    assert wiremongo.stats() == {}
+    await users.find_one({"name": "John"})
+    assert wiremongo.stats()["testdb"]["users"]["find_one"]["calls"] == 1
+
+    with pytest.raises(ValueError):
+        WireMongo().stats()
+
+
+@pytest.mark.asyncio
+async def test_no_matching_mock_error_lists_nearest_candidates():
+    """Test that a miss keeps all candidates but only formats the nearest ones, once it is printed"""
+    wiremongo = WireMongo()
+    wiremongo.mock(*(
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"name": f"user-{i}", "tenant": i % 7})
+        for i in range(5_000)
+    ))
+    wiremongo.mock(FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "John", "tenant": 3, "plan": "pro"}))
+    wiremongo.build()
+
+    with pytest.raises(NoMatchingMockError) as exc_info:
+        await wiremongo.client["testdb"]["users"].find_one({"name": "John", "tenant": 4, "plan": "pro"})
+    error = exc_info.value
+    assert isinstance(error, AssertionError)
+    assert error._message is None
+    assert len(error.candidates) == 5_001
+
+    message = str(error)
+    assert message.startswith("No matching mock found for find_one: args=({'name': 'John', 'tenant': 4, 'plan': 'pro'},)")
+    assert message.endswith("and 4991 more, see NoMatchingMockError.candidates")
+    assert error.nearest(1)[0].query == {"name": "John", "tenant": 3, "plan": "pro"}
+    assert len(message) < 2_000
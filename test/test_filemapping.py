@@ -107,3 +107,23 @@ def test_from_filemapping_list_args_create_index():
         "user_id": 1,
         "name": 1
     }
+
+
+def test_mock_classes_registry_covers_every_mock_class():
+    """Test that every cmd resolves to the mock class for its operation"""
+    from wiremongo import MOCK_CLASSES
+
+    for cmd, cls in MOCK_CLASSES.items():
+        assert cls().operation == cmd
+        assert isinstance(from_filemapping({"cmd": cmd}), cls)
+
+
+def test_builder_table_is_resolved_once_per_class():
+    """Test that builder methods are looked up once and inherited ones are only called once"""
+    from wiremongo import MongoMock, _builders
+
+    builders = _builders(FindOneMock, "with_query")
+    assert builders == (FindOneMock.with_query,)
+    assert _builders(FindOneMock, "with_query") is builders
+    assert _builders(FindOneMock, "returns") == (MongoMock.returns,)
+    assert _builders(FindOneMock, "with_unknown") == ()
@@ -0,0 +1,96 @@
+import pytest
+from unittest.mock import Mock
+
+from wiremongo import WireMongo, MockClient, FindMock, FindOneMock, AggregateMock, InsertOneMock, CallRecord
+
+
+@pytest.fixture
+def wiremongo():
+    wire = WireMongo(lean=True)
+    yield wire
+    wire.reset()
+
+
+@pytest.mark.asyncio
+async def test_lean_mode_installs_plain_functions(wiremongo: WireMongo):
+    """Test that lean mode dispatches without AsyncMock wrappers"""
+    wiremongo.mock(
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "John"}).returns({"name": "John"}),
+        FindMock().with_database("testdb").with_collection("users").with_query({}).returns([{"name": "John"}]),
+        AggregateMock().with_database("testdb").with_collection("users").with_pipeline([]).returns([{"count": 1}])
+    )
+    wiremongo.build()
+    collection = wiremongo.client["testdb"]["users"]
+
+    for operation in ("find_one", "find", "aggregate", "insert_one"):
+        assert not isinstance(getattr(collection, operation), Mock)
+
+    assert await collection.find_one({"name": "John"}) == {"name": "John"}
+    assert await collection.find({}).to_list() == [{"name": "John"}]
+    assert await (await collection.aggregate([])).to_list() == [{"count": 1}]
+    with pytest.raises(AssertionError):
+        await collection.insert_one({"name": "John"})
+
+
+def test_lean_mock_client_has_no_mock_operations():
+    """Test that a lean MockClient creates plain coroutine operations"""
+    client = MockClient(lean=True)
+    collection = client["testdb"]["users"]
+
+    assert not isinstance(client.close, Mock)
+    assert not isinstance(client["testdb"].command, Mock)
+    assert not isinstance(collection.find_one, Mock)
+
+
+@pytest.mark.asyncio
+async def test_lean_mode_records_calls_on_demand(wiremongo: WireMongo):
+    """Test that call records are only kept once requested and support assert_called* checks"""
+    wiremongo.mock(
+        InsertOneMock().with_database("testdb").with_collection("users").returns({"inserted_id": 1})
+    )
+    wiremongo.build()
+    collection = wiremongo.client["testdb"]["users"]
+
+    await collection.insert_one({"name": "John"})
+    record = wiremongo.calls("testdb", "users", "insert_one")
+    assert isinstance(record, CallRecord)
+    record.assert_not_called()
+
+    await collection.insert_one({"name": "Jane"}, bypass_document_validation=True)
+    record.assert_called_once_with({"name": "Jane"}, bypass_document_validation=True)
+    with pytest.raises(AssertionError):
+        record.assert_called_with({"name": "John"})
+
+    await collection.insert_one({"name": "Jack"})
+    assert record.call_count == 2
+    record.assert_any_call({"name": "Jane"}, bypass_document_validation=True)
+    with pytest.raises(AssertionError):
+        record.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_lean_mode_records_all_calls_when_enabled():
+    """Test that record_calls keeps call records from the start"""
+    wiremongo = WireMongo(lean=True, record_calls=True)
+    wiremongo.mock(FindMock().with_database("testdb").with_collection("users").returns([]))
+    wiremongo.build()
+
+    await wiremongo.client["testdb"]["users"].find({"age": 30}).to_list()
+    wiremongo.calls("testdb", "users", "find").assert_called_once_with({"age": 30})
+
+    wiremongo.reset()
+    with pytest.raises(AssertionError):
+        await wiremongo.client["testdb"]["users"].find_one({"age": 30})
+    wiremongo.calls("testdb", "users", "find_one").assert_called_once_with({"age": 30})
+
+
+def test_call_records_require_lean_mode():
+    """Test that calls() points to the AsyncMocks outside lean mode"""
+    with pytest.raises(ValueError):
+        WireMongo().calls("testdb", "users", "find_one")
+
+
+def test_record_calls_requires_lean_mode():
+    """Test that record_calls is rejected instead of ignored outside lean mode"""
+    with pytest.raises(ValueError):
+        WireMongo(record_calls=True)
@@ -88,4 +88,39 @@ async def test_mock_database_async_operations():
     
     assert cmd_result == {"ok": 1}
     assert create_result == {"name": "new_coll"}
-    assert drop_result == {"dropped": "old_coll"}
\ No newline at end of file
+    assert drop_result == {"dropped": "old_coll"}
+
+@pytest.mark.asyncio
+async def test_mock_collection_creates_operations_on_first_access():
+    """Test that MockCollection only creates operation mocks when they are used"""
+    collection = MockCollection(name="users")
+    assert "find_one" not in collection._mock_children
+
+    find_one = collection.find_one
+    assert collection.find_one is find_one
+    with pytest.raises(AssertionError, match="No matching mock found for find_one"):
+        await collection.find_one({})
+    with pytest.raises(AssertionError, match="No matching mock found for find"):
+        collection.find({})
+
+
+def test_mock_collection_keeps_assigned_operations():
+    """Test that assigned operations are not replaced by lazily created defaults"""
+    from unittest.mock import AsyncMock
+
+    collection = MockCollection(name="users")
+    replacement = AsyncMock(return_value={"name": "John"})
+    collection.find_one = replacement
+    assert collection.find_one is replacement
+
+
+@pytest.mark.asyncio
+async def test_mock_database_creates_operations_on_first_access():
+    """Test that MockDatabase only creates operation mocks when they are used"""
+    db = MockDatabase(name="test_db")
+    assert "command" not in vars(db)
+
+    assert await db.command("ping") is None
+    db.command.assert_called_once_with("ping")
+    with pytest.raises(AttributeError):
+        db.unknown_operation
@@ -135,4 +135,147 @@ async def test_no_cross_contamination(wiremongo: WireMongo):
     
     result = await wiremongo.client["testdb"]["users"].find_one({"name": "John"})
     assert result["correct"] == "result"
-    assert "wrong" not in result
\ No newline at end of file
+    assert "wrong" not in result
+
+def test_registry_indexes_mocks_by_database_collection_and_operation(wiremongo: WireMongo):
+    """Test that registered mocks are bucketed per call target, with catch-alls kept separately"""
+    specific = FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "John"})
+    other = FindOneMock().with_database("testdb").with_collection("orders").with_query({"name": "John"})
+    catch_all = FindOneMock().with_query({"name": "John"})
+
+    wiremongo.mock(specific, other, catch_all)
+
+    assert wiremongo._candidates("testdb", "users", "find_one") == [specific, catch_all]
+    assert wiremongo._candidates("testdb", "orders", "find_one") == [other, catch_all]
+    assert wiremongo._candidates("testdb", "users", "insert_one") == []
+
+    wiremongo.reset()
+    assert wiremongo._candidates("testdb", "users", "find_one") == []
+
+
+@pytest.mark.asyncio
+async def test_catch_all_mock_is_used_as_fallback(wiremongo: WireMongo):
+    """Test that catch-all mocks are consulted when no specific mock matches"""
+    wiremongo.mock(
+        FindOneMock()
+        .with_database("testdb")
+        .with_collection("users")
+        .with_query({"name": "John"})
+        .returns({"source": "specific"}),
+        FindOneMock()
+        .with_query({"name": "Jane"})
+        .returns({"source": "catch_all"})
+    )
+    wiremongo.build()
+
+    result = await wiremongo.client["testdb"]["users"].find_one({"name": "Jane"})
+    assert result["source"] == "catch_all"
+
+
+def test_candidates_are_kept_in_priority_order(wiremongo: WireMongo):
+    """Test that buckets are ordered by priority, then specific before catch-all, then registration order"""
+    low = FindOneMock().with_database("testdb").with_collection("users").priority(1)
+    first = FindOneMock().with_database("testdb").with_collection("users").priority(5)
+    second = FindOneMock().with_database("testdb").with_collection("users").priority(5)
+    catch_all_tie = FindOneMock().priority(5)
+    catch_all_high = FindOneMock().priority(9)
+
+    wiremongo.mock(low, first, catch_all_tie, second, catch_all_high)
+
+    assert wiremongo._candidates("testdb", "users", "find_one") == [catch_all_high, first, second, catch_all_tie, low]
+
+
+def test_priority_changes_after_registration_reorder_dispatch(wiremongo: WireMongo):
+    """Test that changing the priority of a registered mock moves it in dispatch order for every query shape"""
+    first = FindOneMock().with_database("testdb").with_collection("users").with_query({"a": 1})
+    second = FindOneMock().with_database("testdb").with_collection("users").with_query({"a": 1})
+    nested_first = FindOneMock().with_database("testdb").with_collection("users").with_query({"a": {"b": 1}})
+    nested_second = FindOneMock().with_database("testdb").with_collection("users").with_query({"a": {"b": 1}})
+    wiremongo.mock(first, second, nested_first, nested_second)
+    assert wiremongo._select("testdb", "users", "find_one", ({"a": 1},), {}) is first
+    baseline = wiremongo.snapshot()
+
+    second.priority(5)
+    nested_second.priority(5)
+    assert wiremongo._select("testdb", "users", "find_one", ({"a": 1},), {}) is second
+    assert wiremongo._select("testdb", "users", "find_one", ({"a": {"b": 1}},), {}) is nested_second
+
+    wiremongo.restore(baseline)
+    assert wiremongo._select("testdb", "users", "find_one", ({"a": 1},), {}) is second
+    assert wiremongo._select("testdb", "users", "find_one", ({"a": {"b": 1}},), {}) is nested_second
+    second.priority(0)
+    assert wiremongo._select("testdb", "users", "find_one", ({"a": 1},), {}) is first
+
+
+@pytest.mark.asyncio
+async def test_dispatch_stops_at_first_matching_mock(wiremongo: WireMongo):
+    """Test that lower priority mocks are never compared once a higher priority mock matched"""
+    low = FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "John"}).returns({"priority": "low"})
+    high = FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "John"}).priority(1).returns({"priority": "high"})
+    compared = []
+    original_matches = low.matches
+    low.matches = lambda *args, **kwargs: compared.append(args) or original_matches(*args, **kwargs)
+
+    wiremongo.mock(low, high)
+    wiremongo.build()
+
+    result = await wiremongo.client["testdb"]["users"].find_one({"name": "John"})
+    assert result["priority"] == "high"
+    assert compared == []
+
+
+def test_exact_match_index_agrees_with_linear_scan(wiremongo: WireMongo):
+    """Test that the hash fast path always picks the mock a linear scan would pick"""
+    import random
+    from bson import ObjectId
+
+    rng = random.Random(42)
+    ids = [ObjectId() for _ in range(5)]
+    values = ids + ["a", "b", 1, 1.0, True, None]
+    shapes = [("_id",), ("_id",), ("_id",), ("_id", "name"), ("name",)]
+
+    def random_query():
+        if rng.random() < 0.1:
+            return {"_id": {"$in": ids[:2]}}
+        return {field: rng.choice(values) for field in rng.choice(shapes)}
+
+    def linear_scan(document):
+        return next((m for m in wiremongo._candidates("testdb", "users", "find_one") if m.matches(document)), None)
+
+    registered = []
+    for _ in range(30):
+        batch = []
+        for _ in range(rng.randint(1, 5)):
+            mock = FindOneMock().with_query(random_query()).priority(rng.randint(0, 2))
+            if rng.random() < 0.9:
+                mock.with_database("testdb").with_collection("users")
+            batch.append(mock)
+        wiremongo.mock(*batch)
+        registered.extend(batch)
+        if rng.random() < 0.3:
+            rng.choice(registered).priority(rng.randint(0, 2))
+        for _ in range(20):
+            document = random_query()
+            assert wiremongo._select("testdb", "users", "find_one", (document,), {}) is linear_scan(document)
+
+
+@pytest.mark.asyncio
+async def test_exact_match_index_resolves_object_id_lookups(wiremongo: WireMongo):
+    """Test that equality-only lookups on ObjectIds resolve through the hash index"""
+    from bson import ObjectId
+
+    ids = [ObjectId() for _ in range(100)]
+    wiremongo.mock(*[
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"_id": oid}).returns({"_id": oid})
+        for oid in ids
+    ])
+    wiremongo.build()
+
+    target = ids[73]
+    result = await wiremongo.client["testdb"]["users"].find_one({"_id": ObjectId(str(target))})
+    assert result == {"_id": target}
+    assert wiremongo._exact[("testdb", "users", "find_one")].size == 100
+
+    # a string never matches an ObjectId, neither through the index nor the fallback scan
+    with pytest.raises(AssertionError):
+        await wiremongo.client["testdb"]["users"].find_one({"_id": str(target)})
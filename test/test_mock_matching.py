@@ -139,4 +139,131 @@ def test_mongo_mock_error_handling():
     
     with pytest.raises(Exception) as exc_info:
         mock.get_result()
-    assert "Custom duplicate key message" in str(exc_info.value)
\ No newline at end of file
+    assert "Custom duplicate key message" in str(exc_info.value)
+
+def test_compiled_matcher_agrees_with_compare_values():
+    """Test that compiled query matchers give the same answers as _compare_values"""
+    from bson import ObjectId
+    from wiremongo import _compile_matcher
+
+    oid = ObjectId()
+    mock = MongoMock("test")
+    expected_values = [
+        {"_id": oid, "name": "John", "address": {"city": "Vienna", "zip": "1010"}},
+        {"name": "John", "tags": ["a", "b"]},
+        oid,
+        "plain",
+    ]
+    actual_values = [
+        {"_id": ObjectId(str(oid)), "name": "John"},
+        {"_id": ObjectId(), "name": "John"},
+        {"_id": str(oid), "name": "John"},
+        {"_id": oid},
+        {"address": {"city": "Vienna"}},
+        {"address": {"city": "Graz"}},
+        {"address": "Vienna"},
+        {"name": "John", "tags": ["a", "b"]},
+        {"name": "John", "tags": ["a"]},
+        {"unknown": 1},
+        {},
+        ObjectId(str(oid)),
+        str(oid),
+        "plain",
+        None,
+    ]
+    for expected in expected_values:
+        matcher = _compile_matcher(expected)
+        for actual in actual_values:
+            assert matcher(actual) is mock._compare_values(actual, expected), (actual, expected)
+
+
+def test_mongo_mock_recompiles_when_query_changes():
+    """Test that assigning a new query invalidates the compiled matcher"""
+    mock = MongoMock("test")
+    mock.query = {"name": "John"}
+    assert mock.matches({"name": "John"}) is True
+
+    mock.query = {"name": "Jane"}
+    assert mock.matches({"name": "John"}) is False
+    assert mock.matches({"name": "Jane"}) is True
+
+
+def test_mongo_mock_matches_documents_selected_by_operators():
+    """Test that mock queries using operators match the documents they select"""
+    mock = MongoMock("test")
+    mock.query = {"age": {"$gt": 30}, "tags": {"$in": ["admin"]}}
+
+    assert mock.matches({"age": {"$gt": 30}, "tags": {"$in": ["admin"]}}) is True
+    assert mock.matches({"age": 35, "tags": ["admin", "dev"]}) is True
+    assert mock.matches({"age": 25, "tags": ["admin"]}) is False
+    assert mock.matches({"age": {"$gt": 40}, "tags": ["admin"]}) is False
+
+    mock.query = ({"status": {"$ne": "deleted"}}, {"$set": {"seen": True}})
+    assert mock.matches({"status": "active"}, {"$set": {"seen": True}}) is True
+    assert mock.matches({"status": "deleted"}, {"$set": {"seen": True}}) is False
+
+
+
+def test_operator_matches_contain_fields_like_literal_matches():
+    """Test that operator queries reject extra document fields and ignore query fields the document lacks"""
+    mock = MongoMock("test")
+    mock.query = {"age": 40}
+    assert mock.matches({"age": 40, "name": "x"}) is False
+    mock.query = {"age": 40, "name": "x"}
+    assert mock.matches({"age": 40}) is True
+
+    mock.query = {"age": {"$gte": 18}}
+    assert mock.matches({"age": 40, "name": "x"}) is False
+    assert mock.matches({"age": 40, "_id": 1}) is True
+    mock.query = {"age": {"$gte": 18}, "name": "x"}
+    assert mock.matches({"age": 40}) is True
+    assert mock.matches({"age": 10}) is False
+    assert mock.matches({"age": 40, "name": "y"}) is False
+
+    mock.query = {"profile.age": {"$gte": 18}, "$or": [{"role": "admin"}, {"role": "owner"}]}
+    assert mock.matches({"profile": {"age": 40}, "role": "owner"}) is True
+    assert mock.matches({"profile": {"age": 40}, "role": "guest"}) is False
+    assert mock.matches({"profile": {"age": 40}, "role": "owner", "name": "x"}) is False
+
+@pytest.mark.asyncio
+async def test_literal_and_operator_matches_dispatch_in_registration_order():
+    """Test that literal and operator matches of the same priority are tried in registration order"""
+    from wiremongo import WireMongo, FindOneMock
+
+    wiremongo = WireMongo()
+    wiremongo.mock(
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"age": 30}).returns("thirty"),
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"age": {"$gte": 18}}).returns("adult"),
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"age": 40}).returns("forty"),
+    ).build()
+    collection = wiremongo.client["testdb"]["users"]
+
+    assert await collection.find_one({"age": 30}) == "thirty"
+    assert await collection.find_one({"age": 40}) == "adult"
+    with pytest.raises(AssertionError):
+        await collection.find_one({"age": 10})
+
+
+@pytest.mark.asyncio
+async def test_operator_and_literal_matches_dispatch_by_priority():
+    """Test that priorities decide between a literal and an operator match"""
+    from wiremongo import WireMongo, FindOneMock
+
+    wiremongo = WireMongo()
+    adult = FindOneMock().with_database("testdb").with_collection("users").with_query({"age": {"$gte": 18}}).returns("adult").priority(5)
+    thirty = FindOneMock().with_database("testdb").with_collection("users").with_query({"age": 30}).returns("thirty")
+    catch_all = FindOneMock().with_query({"age": {"$lt": 18}}).returns("minor").priority(10)
+    young = FindOneMock().with_database("testdb").with_collection("users").with_query({"age": 10}).returns("ten")
+    wiremongo.mock(thirty, adult, young, catch_all).build()
+    collection = wiremongo.client["testdb"]["users"]
+
+    assert await collection.find_one({"age": 30}) == "adult"
+    assert await collection.find_one({"age": 10}) == "minor"
+    thirty.priority(7)
+    assert await collection.find_one({"age": 30}) == "thirty"
+    assert await collection.find_one({"age": 31}) == "adult"
+
+    report = wiremongo.find_candidates("testdb", "users", "find_one", {"age": 30})
+    assert [(c["priority"], c["matches"], c["selected"]) for c in report["candidates"]] == [
+        (7, True, True), (5, True, False), (10, False, False), (0, False, False),
+    ]
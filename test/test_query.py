@@ -0,0 +1,85 @@
+import re
+
+import pytest
+from bson import ObjectId
+
+from wiremongo.query import compile_filter
+
+
+DOCUMENTS = [
+    {"_id": 1, "name": "John", "age": 30, "tags": ["admin", "dev"], "address": {"city": "Vienna", "zip": "1010"}},
+    {"_id": 2, "name": "jane", "age": 25, "tags": ["dev"], "scores": [{"subject": "math", "score": 90}, {"subject": "art", "score": 60}]},
+    {"_id": 3, "name": "Joe", "age": None, "tags": [], "scores": [{"subject": "math", "score": 40}]},
+    {"_id": 4, "name": "Anna", "age": "31", "active": True},
+    {"_id": 5, "name": "Max", "age": 41.5, "active": 1, "address": {"city": "Graz"}},
+]
+
+
+def select(filter):
+    predicate = compile_filter(filter)
+    return [document["_id"] for document in DOCUMENTS if predicate(document)]
+
+
+@pytest.mark.parametrize("filter, expected", [
+    ({}, [1, 2, 3, 4, 5]),
+    ({"age": {"$gt": 28}}, [1, 5]),
+    ({"age": {"$gte": 25, "$lt": 31}}, [1, 2]),
+    ({"age": {"$lte": "4"}}, [4]),
+    ({"age": None}, [3]),
+    ({"age": {"$ne": None}}, [1, 2, 4, 5]),
+    ({"age": {"$in": [25, "31"]}}, [2, 4]),
+    ({"age": {"$nin": [25, "31", None]}}, [1, 5]),
+    ({"active": True}, [4]),
+    ({"active": {"$exists": False}}, [1, 2, 3]),
+    ({"age": {"$type": "string"}}, [4]),
+    ({"age": {"$type": ["double", "null"]}}, [3, 5]),
+    ({"tags": "dev"}, [1, 2]),
+    ({"tags": {"$size": 0}}, [3]),
+    ({"tags": {"$all": ["dev", "admin"]}}, [1]),
+    ({"tags": ["dev"]}, [2]),
+    ({"address.city": "Vienna"}, [1]),
+    ({"address.zip": {"$exists": True}}, [1]),
+    ({"scores.subject": "art"}, [2]),
+    ({"scores.0.score": {"$gte": 90}}, [2]),
+    ({"scores": {"$elemMatch": {"subject": "math", "score": {"$gt": 50}}}}, [2]),
+    ({"scores.score": {"$elemMatch": {"$lt": 50}}}, []),
+    ({"name": {"$regex": "^j", "$options": "i"}}, [1, 2, 3]),
+    ({"name": re.compile("^J")}, [1, 3]),
+    ({"name": {"$not": re.compile("^J")}}, [2, 4, 5]),
+    ({"age": {"$not": {"$gt": 28}}}, [2, 3, 4]),
+    ({"age": {"$mod": [5, 0]}}, [1, 2]),
+    ({"$or": [{"age": 25}, {"address.city": "Graz"}]}, [2, 5]),
+    ({"$and": [{"tags": "dev"}, {"age": {"$gt": 26}}]}, [1]),
+    ({"$nor": [{"tags": "dev"}, {"active": True}]}, [3, 5]),
+])
+def test_compile_filter(filter, expected):
+    """Test evaluating query operators against documents"""
+    assert select(filter) == expected
+
+
+def test_compile_filter_caches_templates_by_shape():
+    """Test that filters differing only in their values share one compiled shape and bind their own values"""
+    from wiremongo import query
+
+    query._filter_cache.clear()
+    compile_filter({"_id": ObjectId("507f1f77bcf86cd799439011"), "age": {"$gt": 1}})
+    for i in range(100):
+        compile_filter({"_id": i, "age": {"$gt": i}})
+    assert len(query._filter_cache) == 1
+
+    assert select({"age": 1}) == [] and select({"active": True}) == [4] and select({"active": 1}) == [5]
+    assert select({"scores": {"$elemMatch": {"subject": "art", "score": {"$gt": 50}}}}) == [2]
+    assert select({"scores": {"$elemMatch": {"subject": "math", "score": {"$gt": 50}}}}) == [2]
+    assert select({"scores": {"$elemMatch": {"subject": "math", "score": {"$gt": 10}}}}) == [2, 3]
+    assert select({"name": {"$not": {"$regex": "^j", "$options": "i"}}}) == [4, 5]
+    assert select({"name": {"$not": {"$regex": "^A", "$options": ""}}}) == [1, 2, 3, 5]
+    assert select({"$or": [{"age": 25}, {"age": {"$gt": 40}}]}) == [2, 5]
+    assert select({"$or": [{"age": 30}, {"age": {"$gt": 100}}]}) == [1]
+
+
+def test_compile_filter_rejects_unsupported_operators():
+    """Test that unsupported operators are reported instead of compared literally"""
+    with pytest.raises(NotImplementedError):
+        compile_filter({"location": {"$near": [0, 0]}})
+    with pytest.raises(NotImplementedError):
+        compile_filter({"$where": "this.age > 1"})
@@ -0,0 +1,345 @@
+import pytest
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertOneResult, UpdateResult
+
+from wiremongo import WireMongo, MockClient, FindOneMock
+
+
+@pytest.fixture
+def wiremongo():
+    wire = WireMongo(stateful=True)
+    yield wire
+    wire.reset()
+
+
+@pytest.mark.asyncio
+async def test_stateful_collection_crud():
+    """Test inserting, finding, updating and deleting documents in a stateful collection"""
+    collection = MockClient(stateful=True)["testdb"]["users"]
+
+    document = {"name": "John", "age": 30}
+    result = await collection.insert_one(document)
+    assert isinstance(result, InsertOneResult)
+    assert isinstance(result.inserted_id, ObjectId)
+    assert document["_id"] == result.inserted_id
+
+    await collection.insert_many([{"_id": 2, "name": "Jane", "age": 25, "tags": ["admin"]}, {"_id": 3, "name": "Joe", "age": 30}])
+    assert await collection.count_documents({}) == 3
+    assert await collection.count_documents({"age": 30}) == 2
+    assert await collection.find_one({"tags": "admin"}) == {"_id": 2, "name": "Jane", "age": 25, "tags": ["admin"]}
+    assert await collection.find_one(3) == {"_id": 3, "name": "Joe", "age": 30}
+    assert sorted(await collection.distinct("age")) == [25, 30]
+
+    names = [doc["name"] async for doc in collection.find({"age": 30}, {"name": 1}, sort=[("name", -1)])]
+    assert names == ["John", "Joe"]
+
+    result = await collection.update_many({"age": 30}, {"$set": {"age": 31, "address.city": "Vienna"}})
+    assert isinstance(result, UpdateResult)
+    assert (result.matched_count, result.modified_count) == (2, 2)
+    assert await collection.find_one({"address.city": "Vienna", "_id": 3}, {"_id": 0, "address": 1}) == {"address": {"city": "Vienna"}}
+
+    result = await collection.update_one({"name": "Nobody"}, {"$set": {"age": 1}}, upsert=True)
+    assert result.matched_count == 0 and result.upserted_id is not None
+    assert await collection.find_one({"_id": result.upserted_id}) == {"_id": result.upserted_id, "name": "Nobody", "age": 1}
+
+    result = await collection.delete_many({"age": 31})
+    assert isinstance(result, DeleteResult)
+    assert result.deleted_count == 2
+    assert await collection.count_documents({}) == 2
+
+
+@pytest.mark.asyncio
+async def test_stateful_collection_copies_documents():
+    """Test that callers never share documents with the store"""
+    collection = MockClient(stateful=True)["testdb"]["users"]
+    document = {"_id": 1, "tags": ["a"]}
+    await collection.insert_one(document)
+    document["tags"].append("b")
+
+    found = await collection.find_one({"_id": 1})
+    assert found == {"_id": 1, "tags": ["a"]}
+    found["tags"].append("c")
+    assert await collection.find({}).to_list() == [{"_id": 1, "tags": ["a"]}]
+
+
+@pytest.mark.asyncio
+async def test_stateful_collection_update_operators():
+    """Test applying update operators and upserts to stored documents"""
+    collection = MockClient(stateful=True)["testdb"]["users"]
+    await collection.insert_many([
+        {"_id": 1, "name": "John", "visits": 1, "tags": ["a"], "scores": [5, 1]},
+        {"_id": 2, "name": "Jane", "visits": 2, "tags": ["b"], "legacy": True},
+    ])
+
+    result = await collection.update_many({}, {"$inc": {"visits": 1}, "$addToSet": {"tags": "a"}, "$unset": {"legacy": ""}})
+    assert (result.matched_count, result.modified_count) == (2, 2)
+    result = await collection.update_one({"_id": 1}, {"$addToSet": {"tags": "a"}})
+    assert (result.matched_count, result.modified_count) == (1, 0)
+    await collection.update_one({"_id": 1}, {"$push": {"scores": {"$each": [9, 3], "$sort": -1, "$slice": 3}}, "$setOnInsert": {"created": True}})
+    assert await collection.find({}).to_list() == [
+        {"_id": 1, "name": "John", "visits": 2, "tags": ["a"], "scores": [9, 5, 3]},
+        {"_id": 2, "name": "Jane", "visits": 3, "tags": ["b", "a"]},
+    ]
+
+    result = await collection.update_one({"name": "Joe", "visits": {"$gt": 1}}, {"$inc": {"visits": 1}, "$setOnInsert": {"created": True}}, upsert=True)
+    assert (result.matched_count, result.modified_count) == (0, 0)
+    assert await collection.find_one(result.upserted_id, {"_id": 0}) == {"name": "Joe", "visits": 1, "created": True}
+
+    with pytest.raises(WriteError) as error:
+        await collection.update_one({"_id": 1}, {"$inc": {"name": 1}})
+    assert error.value.code == 14
+    with pytest.raises(WriteError):
+        await collection.update_one({"_id": 1}, {"$set": {"_id": 5}})
+    with pytest.raises(ValueError):
+        await collection.update_one({"_id": 1}, {"name": "replaced"})
+
+
+@pytest.mark.asyncio
+async def test_stateful_failed_update_changes_nothing():
+    """Test that an update failing on one operator leaves the document as it was"""
+    collection = MockClient(stateful=True)["testdb"]["users"]
+    await collection.insert_one({"_id": 1, "name": "x", "a": 0, "tags": ["t"], "old": 1})
+
+    with pytest.raises(WriteError):
+        await collection.update_one({"_id": 1}, {"$set": {"a": 5, "new": 1}, "$push": {"tags": "u"}, "$unset": {"old": ""}, "$inc": {"name": 1}})
+    assert await collection.find_one(1) == {"_id": 1, "name": "x", "a": 0, "tags": ["t"], "old": 1}
+    assert list((await collection.find_one(1)).keys()) == ["_id", "name", "a", "tags", "old"]
+
+    with pytest.raises(BulkWriteError):
+        await collection.bulk_write([UpdateOne({"_id": 1}, {"$set": {"a": 7}, "$inc": {"name": 1}}), UpdateOne({"_id": 1}, {"$set": {"b": 1}})], ordered=False)
+    assert await collection.find_one(1) == {"_id": 1, "name": "x", "a": 0, "tags": ["t"], "old": 1, "b": 1}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("update, error", [
+    ({"$set": {"b": 5, "tags.$": 9}}, NotImplementedError),
+    ({"$set": {"b": 5, "tags.$[]": 9}}, NotImplementedError),
+    ({"$set": {"b": 5, "tags.$[element]": 9}}, NotImplementedError),
+    ({"$set": {"b": 5}, "$push": {"tags": {"$each": [1], "$slice": "2"}}}, WriteError),
+    ({"$set": {"b": 5}, "$push": {"tags": {"$each": [1], "$position": 1.5}}}, WriteError),
+    ({"$set": {"b": 5}, "$push": {"tags": {"$each": [1], "$sort": "asc"}}}, WriteError),
+    ({"$set": {"b": 5}, "$push": {"tags": {"$each": 1}}}, WriteError),
+    ({"$set": {"b": 5}, "$addToSet": {"tags": {"$each": [1], "$slice": 1}}}, WriteError),
+    ({"$set": {"b": 5}, "$inc": {"a": "1"}}, WriteError),
+    ({"$set": {"b": 5}, "$rename": {"a": 1}}, WriteError),
+    ({"$set": {"b": 5}, "$unset": "a"}, WriteError),
+])
+async def test_stateful_update_rejects_unsupported_paths_and_modifiers(update, error):
+    """Test that updates with positional paths or malformed modifiers are rejected before anything is applied"""
+    collection = MockClient(stateful=True)["testdb"]["users"]
+    await collection.create_index("b")
+    await collection.insert_one({"_id": 1, "a": 0, "tags": [2]})
+
+    with pytest.raises(error):
+        await collection.update_one({"_id": 1}, update)
+    assert await collection.find_one(1) == {"_id": 1, "a": 0, "tags": [2]}
+    assert await collection.count_documents({"b": None}) == 1
+
+
+@pytest.mark.asyncio
+async def test_stateful_update_restores_document_on_any_error(monkeypatch):
+    """Test that a document and its index entries are restored when an update fails with any exception"""
+    from wiremongo import update as update_module
+
+    collection = MockClient(stateful=True)["testdb"]["users"]
+    await collection.create_index("b")
+    await collection.insert_one({"_id": 1, "b": 0})
+
+    def failing_push(*args):
+        raise RuntimeError("push failed")
+
+    monkeypatch.setattr(update_module, "_push", failing_push)
+    with pytest.raises(RuntimeError):
+        await collection.update_one({"_id": 1}, {"$set": {"b": 5}, "$push": {"tags": 1}})
+    assert await collection.find_one(1) == {"_id": 1, "b": 0}
+    assert await collection.count_documents({"b": 5}) == 0
+    assert await collection.count_documents({"b": 0}) == 1
+
+
+
+@pytest.mark.parametrize("update", [
+    {"$set": {"a.b": 1, "list.5.x": 2, "new.deep": [1]}, "$unset": {"c": "", "list.0": ""}},
+    {"$rename": {"c": "z", "a.b": "a.y"}, "$inc": {"n": 2, "m": 1}, "$mul": {"list.1.v": 3}},
+    {"$push": {"tags": "u", "list": {"$each": [{"v": 0}], "$position": 0, "$sort": {"v": 1}, "$slice": 2}}},
+    {"$addToSet": {"tags": {"$each": ["t", "v"]}}, "$pull": {"list": {"v": 2}}, "$pop": {"empty": 1, "tags": -1}},
+    {"$min": {"n": -1}, "$max": {"a.b": 9}, "$currentDate": {"at": True}, "$setOnInsert": {"x": 1}},
+])
+def test_update_undo_log_restores_document(update):
+    """Test that reverting an update's undo log restores the document and its field order"""
+    from wiremongo.query import copy_document
+    from wiremongo.update import apply_update, replace_document, revert
+
+    document = {"_id": 1, "a": {"b": 0, "k": 1}, "c": 3, "n": 1, "list": [{"v": 2}, {"v": 1}], "tags": ["t"], "empty": []}
+    before = copy_document(document)
+    undo = []
+    assert apply_update(document, update, undo=undo) is True
+    assert document != before
+    revert(undo)
+    assert document == before and repr(document) == repr(before)
+
+    replace_document(document, {"c": 4}, undo)
+    revert(undo)
+    assert repr(document) == repr(before)
+
+@pytest.mark.asyncio
+async def test_stateful_find_one_and_update():
+    """Test returning a document from before or after its update"""
+    collection = MockClient(stateful=True)["testdb"]["counters"]
+    await collection.insert_many([{"_id": "a", "seq": 1}, {"_id": "b", "seq": 5}])
+
+    assert await collection.find_one_and_update({}, {"$inc": {"seq": 1}}, sort=[("seq", -1)]) == {"_id": "b", "seq": 5}
+    after = await collection.find_one_and_update({"_id": "b"}, {"$inc": {"seq": 1}}, {"_id": 0}, return_document=ReturnDocument.AFTER)
+    assert after == {"seq": 7}
+    assert await collection.find_one_and_update({"_id": "c"}, {"$inc": {"seq": 1}}) is None
+    assert await collection.find_one_and_update({"_id": "c"}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER) == {"_id": "c", "seq": 1}
+
+
+@pytest.mark.asyncio
+async def test_stateful_bulk_write():
+    """Test executing bulk write requests against a stateful collection"""
+    collection = MockClient(stateful=True)["testdb"]["users"]
+    result = await collection.bulk_write([
+        InsertOne({"_id": 1, "name": "John", "age": 30}),
+        InsertOne({"_id": 2, "name": "Jane", "age": 25}),
+        UpdateMany({"age": {"$gte": 25}}, {"$inc": {"age": 1}}),
+        UpdateOne({"name": "Joe"}, {"$set": {"age": 40}}, upsert=True),
+        ReplaceOne({"_id": 2}, {"name": "Jane", "retired": True}),
+        DeleteOne({"_id": 1}),
+        DeleteMany({"age": {"$gt": 100}}),
+    ])
+    assert isinstance(result, BulkWriteResult)
+    assert (result.inserted_count, result.matched_count, result.modified_count, result.deleted_count, result.upserted_count) == (2, 3, 3, 1, 1)
+    assert list(result.upserted_ids) == [3]
+    assert await collection.find({}, {"_id": 0}).to_list() == [{"name": "Jane", "retired": True}, {"name": "Joe", "age": 40}]
+
+    requests = [InsertOne({"_id": 2}), UpdateOne({"_id": 2}, {"$inc": {"name": 1}}), InsertOne({"_id": 4})]
+    with pytest.raises(BulkWriteError) as error:
+        await collection.bulk_write(requests)
+    assert error.value.details["nInserted"] == 0
+    assert [write_error["index"] for write_error in error.value.details["writeErrors"]] == [0]
+    with pytest.raises(BulkWriteError) as error:
+        await collection.bulk_write(requests, ordered=False)
+    assert error.value.details["nInserted"] == 1
+    assert [(write_error["index"], write_error["code"]) for write_error in error.value.details["writeErrors"]] == [(0, 11000), (1, 14)]
+
+    with pytest.raises(ValueError):
+        await collection.bulk_write([InsertOne({"_id": 5}), UpdateOne({}, {"name": "replaced"})])
+    assert await collection.count_documents({"_id": 5}) == 0
+
+
+@pytest.mark.asyncio
+async def test_stateful_bulk_write_large_batches():
+    """Test that large batches of bulk write requests are applied quickly"""
+    import time
+
+    collection = MockClient(stateful=True)["testdb"]["events"]
+    await collection.create_index("kind")
+    started = time.perf_counter()
+    await collection.bulk_write([InsertOne({"_id": i, "kind": i % 10}) for i in range(10_000)])
+    result = await collection.bulk_write([UpdateOne({"_id": i}, {"$set": {"seen": True}}) for i in range(10_000)], ordered=False)
+    assert result.modified_count == 10_000
+    assert time.perf_counter() - started < 5
+    assert await collection.count_documents({"kind": 3, "seen": True}) == 1_000
+
+
+@pytest.mark.asyncio
+async def test_stateful_collection_duplicate_ids():
+    """Test that inserting an existing _id raises DuplicateKeyError"""
+    collection = MockClient(stateful=True)["testdb"]["users"]
+    await collection.insert_one({"_id": 1})
+
+    with pytest.raises(DuplicateKeyError) as error:
+        await collection.insert_one({"_id": 1})
+    assert error.value.code == 11000
+    assert error.value.details["keyValue"] == {"_id": 1}
+
+    with pytest.raises(BulkWriteError) as error:
+        await collection.insert_many([{"_id": 2}, {"_id": 1}, {"_id": 3}], ordered=False)
+    assert error.value.details["nInserted"] == 2
+    assert [write_error["index"] for write_error in error.value.details["writeErrors"]] == [1]
+
+
+@pytest.mark.asyncio
+async def test_stateful_unique_indexes():
+    """Test that unique indexes reject inserts, updates and upserts with existing key values"""
+    collection = MockClient(stateful=True)["testdb"]["users"]
+    await collection.insert_many([{"_id": 1, "email": "a@x", "tenant": 1}, {"_id": 2, "email": "b@x", "tenant": 1}])
+    assert await collection.create_index([("tenant", 1), ("email", 1)], unique=True) == "tenant_1_email_1"
+
+    with pytest.raises(DuplicateKeyError) as error:
+        await collection.insert_one({"email": "a@x", "tenant": 1})
+    assert error.value.code == 11000
+    assert error.value.details["keyPattern"] == {"tenant": 1, "email": 1}
+    assert error.value.details["keyValue"] == {"tenant": 1, "email": "a@x"}
+    await collection.insert_one({"_id": 3, "email": "a@x", "tenant": 2})
+
+    with pytest.raises(DuplicateKeyError):
+        await collection.update_one({"_id": 2}, {"$set": {"email": "a@x"}, "$inc": {"version": 1}})
+    assert await collection.find_one(2) == {"_id": 2, "email": "b@x", "tenant": 1}
+    with pytest.raises(DuplicateKeyError):
+        await collection.update_one({"email": "a@x", "tenant": 3}, {"$set": {"tenant": 2}}, upsert=True)
+    with pytest.raises(BulkWriteError) as error:
+        await collection.insert_many([{"_id": 4, "email": "d@x", "tenant": 1}, {"_id": 5, "email": "d@x", "tenant": 1}])
+    assert error.value.details["writeErrors"][0]["keyValue"] == {"tenant": 1, "email": "d@x"}
+
+    await collection.update_one({"_id": 2}, {"$set": {"email": "e@x"}})
+    assert await collection.find({"tenant": 1, "email": "e@x"}).to_list() == [{"_id": 2, "email": "e@x", "tenant": 1}]
+    with pytest.raises(DuplicateKeyError):
+        await collection.create_index("tenant", unique=True)
+
+
+@pytest.mark.asyncio
+async def test_mocks_take_precedence_over_the_store(wiremongo: WireMongo):
+    """Test that unmatched calls fall through to the in-memory collection"""
+    wiremongo.mock(
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "Mocked"}).returns({"name": "Mocked", "mocked": True})
+    ).build()
+    collection = wiremongo.client["testdb"]["users"]
+
+    await collection.insert_one({"name": "Stored"})
+    assert await collection.find_one({"name": "Mocked"}) == {"name": "Mocked", "mocked": True}
+    assert (await collection.find_one({"name": "Stored"}))["name"] == "Stored"
+    assert await collection.find_one({"name": "Missing"}) is None
+    collection.find_one.assert_awaited()
+
+
+@pytest.mark.asyncio
+async def test_create_index_matches_collection_scan():
+    """Test that indexed queries return the same documents as a collection scan"""
+    import random
+
+    rng = random.Random(16)
+    client = MockClient(stateful=True)
+    indexed, scanned = client["testdb"]["indexed"], client["testdb"]["scanned"]
+    assert await indexed.create_index("age") == "age_1"
+    await indexed.create_index([("status", 1), ("age", -1)])
+
+    documents = [
+        {"_id": i, "age": rng.choice([rng.randint(0, 50), None, str(rng.randint(0, 9)), [rng.randint(0, 50), 60]]), "status": rng.choice(["a", "b"])}
+        for i in range(300)
+    ]
+    for document in documents:
+        if rng.random() < 0.1:
+            del document["age"]
+    await indexed.insert_many([dict(document) for document in documents])
+    await scanned.insert_many([dict(document) for document in documents])
+    for collection in (indexed, scanned):
+        await collection.update_many({"status": "b", "age": 7}, {"$set": {"age": 45}})
+        await collection.update_many({"status": "a", "age": {"$lt": 10}, "age.0": {"$exists": False}}, {"$inc": {"age": 100}, "$set": {"status": "c"}})
+        await collection.delete_many({"age": {"$in": [3, "3"]}})
+
+    filters = [
+        {"age": 10}, {"age": None}, {"age": "5"}, {"age": 60}, {"age": {"$gt": 20}}, {"age": {"$gte": 20, "$lt": 30}},
+        {"age": {"$lte": "5"}}, {"age": {"$in": [1, 2, "4", None]}}, {"age": {"$eq": 45}}, {"status": "a", "age": 12},
+        {"status": "b", "age": {"$gt": 40}}, {"status": {"$in": ["a"]}}, {"age": {"$gt": 10, "$ne": 15}},
+    ]
+    for filter in filters:
+        assert indexed.store._plan(filter) is not None
+        assert await indexed.find(filter).to_list() == await scanned.find(filter).to_list(), filter
+        assert await indexed.count_documents(filter) == await scanned.count_documents(filter)
+
+    await indexed.drop_indexes()
+    assert indexed.store._plan({"age": 10}) is None
+    assert indexed.store._plan({"_id": 5, "age": 1}) == [5]
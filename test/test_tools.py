@@ -88,4 +88,113 @@ async def test_read_filemappings_empty_directory():
             await read_filemappings(wiremongo)
             assert len(wiremongo.mocks) == 0
         finally:
-            os.chdir(original_cwd)
\ No newline at end of file
+            os.chdir(original_cwd)
+
+@pytest.mark.asyncio
+async def test_read_filemappings_from_explicit_directory(temp_mappings_dir):
+    """Test loading mappings from a configured directory and pattern"""
+    wiremongo = WireMongo()
+
+    await read_filemappings(wiremongo, mappings_dir=temp_mappings_dir, pattern="mapping1.json", max_workers=2)
+
+    assert len(wiremongo.mocks) == 1
+    result = await wiremongo.client["test_db"]["users"].find_one({"_id": "123"})
+    assert result["name"] == "John"
+
+
+@pytest.mark.asyncio
+async def test_read_filemappings_reuses_cache_file_between_sessions(temp_mappings_dir, monkeypatch):
+    """Test that unchanged files are served from the cache file and changed files are parsed again"""
+    from wiremongo import tools
+
+    cache_file = os.path.join(temp_mappings_dir, '..', 'mappings.cache')
+    monkeypatch.setattr(tools, "_mapping_cache", {})
+    await read_filemappings(WireMongo(), mappings_dir=temp_mappings_dir, cache_file=cache_file)
+    assert os.path.exists(cache_file)
+
+    # a new session starts with an empty in-memory cache and must not parse anything
+    monkeypatch.setattr(tools, "_mapping_cache", {})
+    def fail(*args, **kwargs):
+        raise AssertionError("unchanged mapping was parsed again")
+    monkeypatch.setattr(tools.json, "loads", fail)
+    wiremongo = WireMongo()
+    await read_filemappings(wiremongo, mappings_dir=temp_mappings_dir, cache_file=cache_file)
+    assert len(wiremongo.mocks) == 2
+    monkeypatch.undo()
+
+    # changing a file invalidates its cache entry
+    with open(os.path.join(temp_mappings_dir, 'mapping1.json'), 'w') as f:
+        json.dump({
+            "cmd": "find_one",
+            "with_database": "test_db",
+            "with_collection": "users",
+            "with_query": {"_id": "123"},
+            "returns": {"_id": "123", "name": "Johnny"}
+        }, f)
+    wiremongo = WireMongo()
+    await read_filemappings(wiremongo, mappings_dir=temp_mappings_dir, cache_file=cache_file)
+    result = await wiremongo.client["test_db"]["users"].find_one({"_id": "123"})
+    assert result["name"] == "Johnny"
+
+
+@pytest.mark.asyncio
+async def test_read_filemappings_bounds_the_mapping_cache(temp_mappings_dir, monkeypatch):
+    """Test that cache files only keep the loaded directory and the in-memory cache evicts other files"""
+    import pickle
+    from wiremongo import tools
+
+    monkeypatch.setattr(tools, "_mapping_cache", {})
+    monkeypatch.setattr(tools, "MAPPING_CACHE_SIZE", 1)
+    other_dir = os.path.join(temp_mappings_dir, '..', 'other')
+    os.makedirs(other_dir)
+    with open(os.path.join(other_dir, 'other.json'), 'w') as f:
+        json.dump({"cmd": "find_one", "with_database": "other_db", "with_collection": "users", "returns": None}, f)
+    cache_file = os.path.join(temp_mappings_dir, '..', 'mappings.cache')
+
+    await read_filemappings(WireMongo(), mappings_dir=temp_mappings_dir, cache_file=cache_file)
+    assert len(tools._mapping_cache) == 2
+    await read_filemappings(WireMongo(), mappings_dir=other_dir, cache_file=cache_file)
+    assert list(tools._mapping_cache) == [os.path.join(other_dir, 'other.json')]
+    with open(cache_file, "rb") as f:
+        assert list(pickle.load(f)) == [os.path.join(other_dir, 'other.json')]
+
+
+@pytest.mark.asyncio
+async def test_read_filemappings_from_bundle(temp_mappings_dir):
+    """Test loading mappings through a precompiled bundle that is recompiled once stale"""
+    from wiremongo.tools import MappingBundle, compile_mappings
+
+    bundle_path = os.path.join(temp_mappings_dir, '..', 'mappings.bundle')
+    bundle = compile_mappings(temp_mappings_dir, bundle_path)
+    assert len(bundle) == 2
+
+    wiremongo = WireMongo()
+    await read_filemappings(wiremongo, mappings_dir=temp_mappings_dir, bundle=bundle_path)
+    assert len(wiremongo.mocks) == 2
+    result = await wiremongo.client["test_db"]["users"].find_one({"_id": "123"})
+    assert result["name"] == "John"
+
+    # adding a mapping makes the bundle stale
+    with open(os.path.join(temp_mappings_dir, 'mapping3.json'), 'w') as f:
+        json.dump({"cmd": "count_documents", "with_database": "test_db", "with_collection": "orders", "returns": 3}, f)
+    wiremongo = WireMongo()
+    await read_filemappings(wiremongo, mappings_dir=temp_mappings_dir, bundle=bundle_path)
+    assert len(wiremongo.mocks) == 3
+    assert len(MappingBundle.load(bundle_path)) == 3
+
+
+def test_mapping_bundle_materializes_selected_mappings(temp_mappings_dir):
+    """Test that a bundle only materializes the mappings asked for, as fresh objects"""
+    from wiremongo import FindOneMock
+    from wiremongo.tools import compile_mappings
+
+    bundle = compile_mappings(temp_mappings_dir)
+
+    mocks = bundle.materialize(database="test_db", collection="users", cmd="find_one")
+    assert len(mocks) == 1
+    assert isinstance(mocks[0], FindOneMock)
+    assert mocks[0].query == {"_id": "123"}
+
+    mocks[0].query["_id"] = "changed"
+    assert bundle.materialize(cmd="find_one")[0].query == {"_id": "123"}
+    assert bundle.materialize(database="other_db") == []
@@ -52,6 +52,7 @@ async def test_find_operation(wiremongo: WireMongo):
         .with_collection("users")
         .with_query({"age": 30}, projection={"name": 1, "_id": 0})
         .returns([{"name": "John"}])
+        .priority(1)
     )
     wiremongo.build()
 
@@ -414,7 +415,25 @@ async def test_error_handling(wiremongo: WireMongo):
     with pytest.raises(AssertionError) as exc_info:
         async for _ in await wiremongo.client["testdb"]["users"].find({"unmatched": True}):
             pass
-    assert "No matching mock found for {'unmatched': True}" in str(exc_info.value)
+    assert "No matching mock found for find: args=({'unmatched': True},)" in str(exc_info.value)
+    assert exc_info.value.operation == "find"
+    assert exc_info.value.call_args == ({"unmatched": True},)
+
+
+@pytest.mark.asyncio
+async def test_default_handler_misses_report_candidates_of_their_target(wiremongo: WireMongo):
+    """Test that a call to an unmocked operation only reports the mocks registered for its target"""
+    wiremongo.mock(
+        FindOneMock().with_database("testdb").with_collection("users").with_query({"name": "John"}).returns(None),
+        FindOneMock().with_database("testdb").with_collection("orders").with_query({"total": 1}).returns(None),
+        InsertOneMock().with_database("testdb").with_collection("orders").with_document({"total": 1}).returns(None),
+    )
+    wiremongo.build()
+
+    with pytest.raises(AssertionError) as exc_info:
+        await wiremongo.client["testdb"]["users"].insert_one({"name": "John"})
+    assert exc_info.value.operation == "insert_one"
+    assert exc_info.value.candidates == []
 
 @pytest.mark.asyncio
 async def test_reset_functionality(wiremongo: WireMongo):
@@ -442,3 +461,95 @@ async def test_reset_functionality(wiremongo: WireMongo):
             pass
 
 
+
+@pytest.mark.asyncio
+async def test_incremental_build_only_wires_new_targets(wiremongo: WireMongo):
+    wiremongo.mock(
+        FindOneMock()
+        .with_database("testdb")
+        .with_collection("users")
+        .with_query({"name": "John"})
+        .returns({"name": "John"})
+    )
+    wiremongo.build()
+    users = wiremongo.client["testdb"]["users"]
+    find_one = users.find_one
+
+    # a new mock for an already wired target is picked up by the existing handler
+    wiremongo.mock(
+        FindOneMock()
+        .with_database("testdb")
+        .with_collection("users")
+        .with_query({"name": "Jane"})
+        .returns({"name": "Jane"}),
+        InsertOneMock()
+        .with_database("testdb")
+        .with_collection("orders")
+        .with_document({"item": "book"})
+        .returns({"inserted_id": 1})
+    )
+    assert wiremongo._pending == {("testdb", "orders", "insert_one")}
+    wiremongo.build()
+
+    assert users.find_one is find_one
+    assert wiremongo._pending == set()
+    assert await users.find_one({"name": "Jane"}) == {"name": "Jane"}
+    assert await wiremongo.client["testdb"]["orders"].insert_one({"item": "book"}) == {"inserted_id": 1}
+
+@pytest.mark.asyncio
+async def test_snapshot_and_restore(wiremongo: WireMongo):
+    wiremongo.mock(
+        FindOneMock()
+        .with_database("testdb")
+        .with_collection("users")
+        .with_query({"name": "John"})
+        .returns({"layer": "baseline"})
+    )
+    wiremongo.build()
+    baseline = wiremongo.snapshot()
+    users = wiremongo.client["testdb"]["users"]
+
+    for _ in range(2):
+        # layer test specific mocks on top of the baseline
+        wiremongo.mock(
+            FindOneMock()
+            .with_database("testdb")
+            .with_collection("users")
+            .with_query({"name": "John"})
+            .priority(1)
+            .returns({"layer": "test"}),
+            InsertOneMock()
+            .with_database("testdb")
+            .with_collection("orders")
+            .with_document({"item": "book"})
+            .returns({"inserted_id": 1})
+        ).build()
+        assert await users.find_one({"name": "John"}) == {"layer": "test"}
+        assert await wiremongo.client["testdb"]["orders"].insert_one({"item": "book"}) == {"inserted_id": 1}
+        assert len(wiremongo.mocks) == 3
+
+        wiremongo.restore(baseline)
+        assert len(wiremongo.mocks) == 1
+        assert await users.find_one({"name": "John"}) == {"layer": "baseline"}
+        with pytest.raises(AssertionError):
+            await wiremongo.client["testdb"]["orders"].insert_one({"item": "book"})
+
+
+@pytest.mark.asyncio
+async def test_restore_after_reset_rewires_snapshot(wiremongo: WireMongo):
+    wiremongo.mock(
+        FindOneMock()
+        .with_database("testdb")
+        .with_collection("users")
+        .with_query({"name": "John"})
+        .returns({"name": "John"})
+    )
+    wiremongo.build()
+    baseline = wiremongo.snapshot()
+
+    wiremongo.reset()
+    with pytest.raises(AssertionError):
+        await wiremongo.client["testdb"]["users"].find_one({"name": "John"})
+
+    wiremongo.restore(baseline)
+    assert await wiremongo.client["testdb"]["users"].find_one({"name": "John"}) == {"name": "John"}
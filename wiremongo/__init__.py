@@ -1,21 +1,40 @@
 import asyncio
-from typing import Any, Mapping, Optional, Union
-from unittest.mock import AsyncMock, MagicMock
-
+import bisect
+import heapq
+import re
+import time
+import weakref
+from array import array
+from collections import deque
+from collections.abc import AsyncIterable, Iterator
+from functools import partial
+from itertools import islice
+from types import FunctionType, MethodType
+from typing import Any, Callable, Mapping, Optional, Union
+from unittest.mock import AsyncMock, MagicMock, call
+
+from bson import ObjectId
 from pymongo import AsyncMongoClient
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import DuplicateKeyError, InvalidOperation
+
+from wiremongo.aggregation import run_pipeline
+from wiremongo.query import MISSING, TopK, compile_filter, copy_document, document_sort_key, has_operators, project, sort_spec, top_k
+from wiremongo.store import InMemoryCollection
 
 ASYNC_DATABASE_OPERATIONS = ["command", "create_collection", "drop_collection"]
 ASYNC_COLLECTION_OPERATIONS = ["find_one", "find_one_and_update", "insert_one", "insert_many", "update_one", "update_many", "delete_one", "delete_many", "count_documents", "distinct", "create_index", "bulk_write", "drop", "drop_indexes"]
 ASYNC_CURSOR_COLLECTION_OPERATIONS = ["find"]
 ASYNC_COROUTINE_CURSOR_OPERATIONS = ["aggregate"]
 ALL_SUPPORTED_OPERATIONS = ASYNC_COLLECTION_OPERATIONS + ASYNC_CURSOR_COLLECTION_OPERATIONS + ASYNC_COROUTINE_CURSOR_OPERATIONS + ASYNC_DATABASE_OPERATIONS
+DEFAULT_BATCH_SIZE = 101
+_COLLECTION_OPERATIONS = frozenset(ASYNC_COLLECTION_OPERATIONS + ASYNC_CURSOR_COLLECTION_OPERATIONS + ASYNC_COROUTINE_CURSOR_OPERATIONS)
 
 def from_filemapping[T: MongoMock](mapping: Mapping[str, Any]) -> T:
-    cls = globals().get(f"{''.join(word.capitalize() for word in mapping['cmd'].split('_'))}Mock")
-    if not cls:
-        raise KeyError(f"unknown wiremongo cmd `{mapping['cmd']}` Not implemented")
-    mock = cls()
+    return _build_mock(*_normalize_filemapping(mapping))
+
+def _normalize_filemapping(mapping: Mapping[str, Any]) -> tuple[str, list[tuple[str, list, dict]]]:
+    """Split a file mapping into its cmd and the builder calls as (method, args, kwargs)"""
+    calls = []
     for method, arguments in mapping.items():
         if method.startswith("with_") or method.startswith("returns"):
             if isinstance(arguments, dict) and "args" in arguments:
@@ -24,9 +43,39 @@ def from_filemapping[T: MongoMock](mapping: Mapping[str, Any]) -> T:
             else:
                 args = list(arguments) if isinstance(arguments, list) or isinstance(arguments, tuple) else [arguments]
                 kwargs = dict()
-            call_base_class_methods(cls, method, mock, *args, exclude_self=False, **kwargs)
+            calls.append((method, args, kwargs))
+    return mapping['cmd'], calls
+
+def _build_mock(cmd: str, calls: list[tuple[str, list, dict]]) -> "MongoMock":
+    """Create the mock for a cmd and apply normalized builder calls to it"""
+    cls = MOCK_CLASSES.get(cmd)
+    if not cls:
+        raise KeyError(f"unknown wiremongo cmd `{cmd}` Not implemented")
+    mock = cls()
+    for method, args, kwargs in calls:
+        for builder in _builders(cls, method):
+            builder(mock, *args, **kwargs)
     return mock
 
+_builder_tables: dict[type, dict[str, tuple[Callable, ...]]] = {}
+
+def _builders(cls: type, method_name: str) -> tuple[Callable, ...]:
+    """
+    Resolve the functions call_base_class_methods(cls, method_name, ..., exclude_self=False) would call,
+    once per class and method, skipping repeats of the same inherited function.
+    """
+    table = _builder_tables.setdefault(cls, {})
+    builders = table.get(method_name)
+    if builders is None:
+        functions = []
+        for base_cls in cls.mro():
+            if hasattr(base_cls, method_name):
+                method = getattr(base_cls, method_name)
+                if callable(method) and method not in functions:
+                    functions.append(method)
+        builders = table[method_name] = tuple(functions)
+    return builders
+
 class MockAsyncMongoClient(AsyncMock):
     def __init__(self, *args: Any, **kwargs: Any):
         super().__init__(spec=AsyncMongoClient, *args, **kwargs)
@@ -46,6 +95,10 @@ def async_partial(f, *args, **kwargs):
    return f2
 
 
+async def _noop(*args, **kwargs):
+    return None
+
+
 def call_base_class_methods(cls, method_name, instance, *args, exclude_self = True, **kwargs):
     """
     Call a specific method from all base classes of a given class.
@@ -64,16 +117,160 @@ def call_base_class_methods(cls, method_name, instance, *args, exclude_self = Tr
     return results
 
 class AsyncCursor:
-    """Async cursor implementation that mimics MongoDB cursor"""
+    """
+    Async cursor implementation that mimics MongoDB cursor
+
+    Results can be a list, a single document, a sync or async iterator such as a generator, or a
+    factory function returning any of these. Iterators are pulled from lazily, one document at a time.
+
+    The modifiers sort, skip, limit, batch_size and projection can be chained before iterating and are
+    applied lazily: limit stops pulling results once it is reached, and sort combined with limit only
+    keeps the first skip + limit documents in a heap instead of sorting all of them.
 
-    def __init__(self, results):
-        self.results = results if isinstance(results, list) else [results]
+    With a batch_size or a latency the cursor fetches documents in batches, the way a server answers
+    find and getMore, awaiting asyncio.sleep(latency) for every batch. Without a batch_size, batches
+    hold DEFAULT_BATCH_SIZE documents.
+    """
+
+    def __init__(self, results, batch_size: int = 0, latency: Optional[float] = None):
+        if isinstance(results, (FunctionType, MethodType, partial)):
+            results = results()
+        self._iterator = None
+        self._async = False
+        if isinstance(results, list):
+            self.results = results
+        elif isinstance(results, AsyncIterable):
+            self.results = None
+            self._iterator = aiter(results)
+            self._async = True
+        elif isinstance(results, Iterator):
+            self.results = None
+            self._iterator = results
+        else:
+            self.results = [results]
         self._index = 0
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+        self._batch_size = batch_size
+        self._latency = latency
+        self._projection = None
+        self._pipeline = None
+        self._buffer = None
+        self._started = False
+
+    def _check_options(self):
+        if self._started:
+            raise InvalidOperation("cannot set options after executing query")
+
+    def sort(self, key_or_list, direction=None):
+        """Sort by a field name and direction, a list of (field, direction) pairs or a mapping of them"""
+        self._check_options()
+        self._sort = sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int):
+        if not isinstance(skip, int):
+            raise TypeError("skip must be an integer")
+        if skip < 0:
+            raise ValueError("skip must be >= 0")
+        self._check_options()
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        """Limit the number of documents returned, 0 means no limit and a negative limit acts like its absolute value"""
+        if not isinstance(limit, int):
+            raise TypeError("limit must be an integer")
+        self._check_options()
+        self._limit = abs(limit)
+        return self
+
+    def batch_size(self, batch_size: int):
+        if not isinstance(batch_size, int):
+            raise TypeError("batch_size must be an integer")
+        if batch_size < 0:
+            raise ValueError("batch_size must be >= 0")
+        self._check_options()
+        self._batch_size = batch_size
+        return self
+
+    def projection(self, projection):
+        """Apply an inclusion or exclusion projection, given as a mapping or a list of field names"""
+        self._check_options()
+        self._projection = projection
+        return self
+
+    def _start(self):
+        self._started = True
+        if self._sort or self._skip or self._limit or self._projection:
+            self._pipeline = self._apply_modifiers()
+        if self._batch_size or self._latency is not None:
+            self._buffer = deque()
+
+    async def _sorted_results(self) -> list:
+        key = document_sort_key(self._sort)
+        k = self._skip + self._limit if self._limit else None
+        if self._async:
+            if k is None:
+                return sorted([document async for document in self._iterator], key=key)
+            selection = TopK(k, key)
+            async for document in self._iterator:
+                selection.push(document)
+            return selection.result()
+        source = self.results if self._iterator is None else self._iterator
+        return sorted(source, key=key) if k is None else top_k(source, k, key)
+
+    async def _apply_modifiers(self):
+        skip, limit, projection = self._skip, self._limit, self._projection
+        if self._sort or not self._async:
+            documents = await self._sorted_results() if self._sort else self.results if self._iterator is None else self._iterator
+            for document in islice(documents, skip, skip + limit if limit else None):
+                yield project(document, projection)
+            return
+        position = 0
+        async for document in self._iterator:
+            if position >= skip:
+                yield project(document, projection)
+            position += 1
+            if limit and position >= skip + limit:
+                return
 
     def __aiter__(self):
         return self
 
+    async def _fetch_batch(self):
+        """Simulate a getMore round trip, fetching the next batch of documents into the buffer"""
+        size = self._batch_size or DEFAULT_BATCH_SIZE
+        while len(self._buffer) < size:
+            try:
+                self._buffer.append(await self._next_document())
+            except StopAsyncIteration:
+                break
+        if self._buffer and self._latency is not None:
+            await asyncio.sleep(self._latency)
+
     async def __anext__(self):
+        if not self._started:
+            self._start()
+        if self._buffer is not None:
+            if not self._buffer:
+                await self._fetch_batch()
+                if not self._buffer:
+                    raise StopAsyncIteration
+            return self._buffer.popleft()
+        return await self._next_document()
+
+    async def _next_document(self):
+        if self._pipeline is not None:
+            return await anext(self._pipeline)
+        if self._iterator is not None:
+            if self._async:
+                return await anext(self._iterator)
+            try:
+                return next(self._iterator)
+            except StopIteration:
+                raise StopAsyncIteration from None
         if self._index >= len(self.results):
             raise StopAsyncIteration
         result = self.results[self._index]
@@ -81,63 +278,123 @@ class AsyncCursor:
         return result
 
     async def to_list(self, length=None):
-        return self.results[:length] if length is not None else self.results
+        """Return the remaining documents, at most length of them, consuming only what is returned"""
+        if not self._started:
+            self._start()
+        if self._iterator is None and self._pipeline is None and self._buffer is None:
+            end = len(self.results) if length is None else self._index + length
+            documents = self.results[self._index:end]
+            self._index += len(documents)
+            return documents
+        documents = []
+        if length is not None and length <= 0:
+            return documents
+        async for document in self:
+            documents.append(document)
+            if length is not None and len(documents) >= length:
+                break
+        return documents
 
 
 class MockCollection(MagicMock):
-    """Mock collection that supports async operations"""
+    """
+    Mock collection that supports async operations, created on first access
+
+    A stateful collection keeps its documents in an InMemoryCollection `store`, which implements the
+    operations that are not mocked.
+    """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, lean: bool = False, stateful: bool = False, lookup: Optional[Callable[[str], InMemoryCollection]] = None, **kwargs):
         super().__init__(*args, **kwargs)
         self.name = kwargs.get("name", "mock_collection")
-
+        self._lean = lean
+        self.store = InMemoryCollection(self.name, lookup) if stateful else None
+
+    def __getattr__(self, name):
+        if name in _COLLECTION_OPERATIONS and name not in self._mock_children:
+            operation = self._default_operation(name)
+            setattr(self, name, operation)
+            return operation
+        return super().__getattr__(name)
+
+    def store_operation(self, method: str) -> Optional[Callable]:
+        """The store's implementation of an operation, None if the collection is not stateful or the store lacks it"""
+        if self.store is None:
+            return None
+        if method in ASYNC_CURSOR_COLLECTION_OPERATIONS:
+            return self._store_find
+        if method in ASYNC_COROUTINE_CURSOR_OPERATIONS:
+            return self._store_aggregate
+        return getattr(self.store, method, None)
+
+    def _store_find(self, filter=None, projection=None, skip=0, limit=0, *args, sort=None, batch_size=0, **kwargs):
+        cursor = AsyncCursor(self.store.find(filter), batch_size)
+        if sort:
+            cursor.sort(sort)
+        if projection:
+            cursor.projection(projection)
+        return cursor.skip(skip).limit(limit)
+
+    async def _store_aggregate(self, pipeline, *args, batchSize=0, **kwargs):
+        return AsyncCursor(self.store.aggregate(pipeline), batchSize)
+
+    def _default_operation(self, method: str):
         # Special handling for cursor methods
         def default_cursor_method(*args, **kwargs):
-            raise AssertionError(f"No matching mock found for {method}")
-
-        for method in ASYNC_COLLECTION_OPERATIONS:
-            setattr(self, method, AsyncMock(side_effect=async_partial(default_cursor_method)))
+            raise NoMatchingMockError(method, args, kwargs, [])
 
-        for method in ASYNC_CURSOR_COLLECTION_OPERATIONS:
-            setattr(self, method, default_cursor_method)
+        default_cursor_method = self.store_operation(method) or default_cursor_method
 
-        for method in ASYNC_COROUTINE_CURSOR_OPERATIONS:
-            setattr(self, method, default_cursor_method)
+        if method in ASYNC_COLLECTION_OPERATIONS:
+            default_method = async_partial(default_cursor_method)
+            return default_method if self._lean else AsyncMock(side_effect=default_method)
+        return default_cursor_method
 
 
 class MockDatabase:
     """Mock database that returns MockCollection instances"""
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, lean: bool = False, stateful: bool = False, **kwargs):
         self.name = kwargs.get("name", "mock_db")
         self._collections = {}
+        self._lean = lean
+        self._stateful = stateful
 
-        # Make common database operations async
-        for method in ASYNC_DATABASE_OPERATIONS:
-            setattr(self, method, AsyncMock(return_value=None))
+    def __getattr__(self, name):
+        # Make common database operations async, created on first access
+        if name in ASYNC_DATABASE_OPERATIONS:
+            operation = _noop if self._lean else AsyncMock(return_value=None)
+            setattr(self, name, operation)
+            return operation
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
 
     def __getitem__(self, name):
         if name not in self._collections:
-            self._collections[name] = MockCollection(name=name)
+            self._collections[name] = MockCollection(name=name, lean=self._lean, stateful=self._stateful, lookup=self._store)
         return self._collections[name]
 
     def get_collection(self, name, *args, **kwargs):
         return self[name]
 
+    def _store(self, name: str) -> InMemoryCollection:
+        return self[name].store
+
 
 class MockClient:
     """Mock client that mimics pymongo.AsyncMongoClient"""
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, lean: bool = False, stateful: bool = False, **kwargs):
         self._databases = {}
+        self._lean = lean
+        self._stateful = stateful
         # Make common client operations async
-        self.close = AsyncMock(return_value=None)
-        self.server_info = AsyncMock(return_value=None)
-        self.list_databases = AsyncMock(return_value=None)
+        self.close = _noop if lean else AsyncMock(return_value=None)
+        self.server_info = _noop if lean else AsyncMock(return_value=None)
+        self.list_databases = _noop if lean else AsyncMock(return_value=None)
 
     def __getitem__(self, name):
         if name not in self._databases:
-            self._databases[name] = MockDatabase(name=name)
+            self._databases[name] = MockDatabase(name=name, lean=self._lean, stateful=self._stateful)
         return self._databases[name]
 
     def get_database(self, name, *args, **kwargs):
@@ -156,6 +413,191 @@ class MockClient:
         return awaitable()
 
 
+def _compile_matcher(expected: Any) -> Callable[[Any], bool]:
+    """
+    Compile an expected value into a predicate equivalent to MongoMock._compare_values(actual, expected).
+
+    Documents compile into a table of per-field predicates, and the ObjectId handling is resolved
+    once here instead of on every comparison.
+    """
+    if hasattr(expected, "_type_marker"):  # For ObjectId
+        expected_str = str(expected)
+
+        def match_bson(actual):
+            if hasattr(actual, "_type_marker"):
+                return str(actual) == expected_str
+            return actual == expected
+        return match_bson
+
+    if isinstance(expected, dict):
+        fields = {key: _compile_matcher(value) for key, value in expected.items()}
+
+        def match_document(actual):
+            if not isinstance(actual, dict):
+                return actual == expected
+            for key, value in actual.items():
+                matcher = fields.get(key)
+                if matcher is None:
+                    if key == "_id":  # an _id missing from the expected document is not compared
+                        continue
+                    return False
+                if not matcher(value):
+                    return False
+            return True
+        return match_document
+
+    def match_value(actual):
+        return actual == expected
+    return match_value
+
+
+def _compile_query(query: Any) -> Callable[[tuple], bool]:
+    """Compile a mock query into a predicate over the positional arguments of a call"""
+    if isinstance(query, tuple):
+        matchers = tuple(_compile_matcher(q) for q in query)
+        return lambda args: all(matcher(arg) for arg, matcher in zip(args, matchers))
+    matcher = _compile_matcher(query)
+    return lambda args: matcher(args[0])
+
+
+def _filter_fields(filter: Mapping[str, Any]) -> set[str]:
+    """Top level fields a filter refers to, also within its $and, $or and $nor clauses"""
+    fields = set()
+    for key, value in filter.items():
+        if key in ("$and", "$or", "$nor"):
+            for clause in value:
+                fields |= _filter_fields(clause)
+        elif not key.startswith("$"):
+            fields.add(key.split(".", 1)[0])
+    return fields
+
+
+def _compile_filter_argument(expected: Any) -> Optional[Callable[[Any], bool]]:
+    """
+    Compile an expected document using query operators into a predicate over the documents it selects, None otherwise.
+
+    Documents are contained like in literal matching: a document with a field the query does not refer to,
+    other than _id, does not match, and conditions on fields the document lacks are not evaluated.
+    """
+    if not has_operators(expected):
+        return None
+    clauses: dict[str, dict[str, Any]] = {}
+    logical = {}
+    for key, value in expected.items():
+        if key.startswith("$"):
+            logical[key] = value
+        else:
+            clauses.setdefault(key.split(".", 1)[0], {})[key] = value
+    try:
+        predicates = tuple((field, compile_filter(clause)) for field, clause in clauses.items())
+        combined = compile_filter(logical)
+        fields = _filter_fields(expected)
+    except (NotImplementedError, TypeError, ValueError, AttributeError, re.error):
+        return None
+
+    def match_document(actual):
+        # arguments using operators themselves are queries, not documents, and only match literally
+        if not isinstance(actual, dict) or has_operators(actual):
+            return False
+        for key in actual:
+            if key not in fields and key != "_id":
+                return False
+        return all(predicate(actual) for field, predicate in predicates if field in actual) and combined(actual)
+    return match_document
+
+
+def _compile_filter_query(query: Any) -> Optional[Callable[[tuple], bool]]:
+    """
+    Compile a mock query using operators, such as {"age": {"$gt": 30}}, into a predicate over call arguments
+    that also accepts the documents the operators select. None if the query uses no operators.
+    """
+    expected = query if isinstance(query, tuple) else (query,)
+    predicates = tuple(_compile_filter_argument(value) for value in expected)
+    if all(predicate is None for predicate in predicates):
+        return None
+    matchers = tuple(
+        _compile_matcher(value) if predicate is None else (lambda actual, matcher=_compile_matcher(value), predicate=predicate: matcher(actual) or predicate(actual))
+        for value, predicate in zip(expected, predicates)
+    )
+    return lambda args: all(matcher(arg) for arg, matcher in zip(args, matchers))
+
+
+def _field_status(expected: Any, actual: Any) -> str:
+    if actual is MISSING:
+        return "missing"
+    if expected is MISSING:
+        return "unexpected"
+    if _compile_matcher(expected)(actual):
+        return "match"
+    predicate = _compile_filter_argument({"value": expected})
+    return "match" if predicate is not None and predicate({"value": actual}) else "mismatch"
+
+
+def _query_diff(query: Any, args: tuple) -> dict[str, dict[str, Any]]:
+    """
+    Compare a mock query with the positional arguments of a call field by field.
+
+    Fields are reported as "match", "mismatch", "missing" from the call or "unexpected" by the mock,
+    prefixed by the argument position for queries over several arguments.
+    """
+    if query is None:
+        return {}
+    expected = query if isinstance(query, tuple) else (query,)
+    diff = {}
+    for position, value in enumerate(expected):
+        actual = args[position] if position < len(args) else MISSING
+        prefix = f"{position}." if len(expected) > 1 else ""
+        if isinstance(value, dict) and isinstance(actual, dict):
+            for field in {**value, **actual}:
+                if field == "_id" and field not in value:
+                    continue
+                expected_value, actual_value = value.get(field, MISSING), actual.get(field, MISSING)
+                diff[prefix + field] = {"expected": expected_value, "actual": actual_value, "status": _field_status(expected_value, actual_value)}
+        else:
+            diff[str(position) if prefix else "query"] = {"expected": value, "actual": actual, "status": _field_status(value, actual)}
+    return diff
+
+
+def _nearness(diff: dict[str, dict[str, Any]]) -> int:
+    """Rank of a candidate for a call by its query diff, the number of fields it matches"""
+    return sum(entry["status"] == "match" for entry in diff.values())
+
+
+class NoMatchingMockError(AssertionError):
+    """
+    Raised when no registered mock matches a call.
+
+    The message is only built when the error is formatted, and lists the `max_candidates` candidates whose
+    queries match most fields of the call. All candidates are kept in `candidates`, in dispatch order.
+    """
+
+    max_candidates = 10
+
+    def __init__(self, operation: Any, args: tuple, kwargs: dict, candidates: list["MongoMock"]):
+        super().__init__(operation, args, kwargs)
+        self.operation = operation
+        self.call_args = args
+        self.call_kwargs = kwargs
+        self.candidates = candidates
+        self._message = None
+
+    def nearest(self, count: Optional[int] = None) -> list["MongoMock"]:
+        """The count candidates nearest to the call, max_candidates by default"""
+        count = self.max_candidates if count is None else count
+        if len(self.candidates) <= count:
+            return list(self.candidates)
+        return heapq.nlargest(count, self.candidates, key=lambda mock: _nearness(_query_diff(mock.query, self.call_args)))
+
+    def __str__(self):
+        if self._message is None:
+            nearest = self.nearest()
+            message = f"No matching mock found for {self.operation}: args={self.call_args}, kwargs={self.call_kwargs} - Candidates are {nearest}"
+            if len(nearest) < len(self.candidates):
+                message += f" and {len(self.candidates) - len(nearest)} more, see NoMatchingMockError.candidates"
+            self._message = message
+        return self._message
+
+
 class MongoMock:
     """Base class for all mongo operation mocks"""
 
@@ -167,6 +609,25 @@ class MongoMock:
         self.query = None
         self.kwargs = {}
         self._priority = 0
+        # Weak references to the WireMongo instances the mock is registered with, told about priority changes
+        self._registries: tuple[weakref.ref, ...] = ()
+
+    @property
+    def query(self) -> Any:
+        return self._query
+
+    @query.setter
+    def query(self, query: Any):
+        self._query = query
+        self._matcher = None
+        self._filter_matcher = None
+
+    def _compile(self) -> Callable[[tuple], bool]:
+        """Compile the expected query once; in-place changes to the query afterwards are not picked up"""
+        if self._matcher is None:
+            self._matcher = _compile_query(self._query)
+            self._filter_matcher = _compile_filter_query(self._query)
+        return self._matcher
 
     def with_database(self, database: str) -> "MongoMock":
         self.database = database
@@ -189,16 +650,27 @@ class MongoMock:
 
     def priority(self, priority: int) -> "MongoMock":
         self._priority = priority
+        for reference in self._registries:
+            registry = reference()
+            if registry is not None:
+                registry._reprioritize(self)
         return self
 
     def matches(self, *args, **kwargs) -> bool:
-        """Check if the mock matches the given arguments"""
+        """
+        Check if the mock matches the given arguments
+
+        A query using operators, such as {"age": {"$gt": 30}}, also matches documents it selects.
+        """
+        return self._matches(args, kwargs, True)
+
+    def _matches(self, args: tuple, kwargs: dict, operators: bool) -> bool:
         if not args and not self.query:
             return True
         if args and self.query:
-            if isinstance(self.query, tuple):
-                return all(self._compare_values(arg, q) for arg, q in zip(args, self.query))
-            return self._compare_values(args[0], self.query)
+            if (self._matcher or self._compile())(args):
+                return True
+            return operators and self._filter_matcher is not None and self._filter_matcher(args)
         return all(self.kwargs.get(k) == v for k, v in kwargs.items() if k in self.kwargs)
 
     def _compare_values(self, val1, val2):
@@ -217,6 +689,10 @@ class MongoMock:
             raise self.result
         return self.result
 
+    def respond(self, *args, **kwargs):
+        """The response to a matched call, get_result() unless the mock computes it from the call's arguments"""
+        return self.get_result()
+
     def __repr__(self):
         return f"{self.operation.capitalize()}Mock(database={self.database}, collection={self.collection}, query={self.query}, kwargs={self.kwargs})"
 
@@ -224,6 +700,8 @@ class MongoMock:
 class FindMock(MongoMock):
     def __init__(self):
         super().__init__("find")
+        self.batch_size = 0
+        self.latency = None
 
     def with_query(self, query: dict, **kwargs) -> "FindMock":
         self.query = query
@@ -232,7 +710,13 @@ class FindMock(MongoMock):
 
     def get_result(self):
         result = super().get_result()
-        return AsyncCursor(result if result is not None else [])
+        return AsyncCursor(result if result is not None else [], self.batch_size, self.latency)
+
+    def with_batches(self, batch_size: int, latency: Optional[float] = None) -> "FindMock":
+        """Return results in batches of batch_size, each one delayed by latency seconds if given"""
+        self.batch_size = batch_size
+        self.latency = latency
+        return self
 
     def __repr__(self):
         return f"FindMock(query={self.query}, kwargs={self.kwargs})"
@@ -356,6 +840,10 @@ class CountDocumentsMock(MongoMock):
 class AggregateMock(MongoMock):
     def __init__(self):
         super().__init__("aggregate")
+        self.batch_size = 0
+        self.latency = None
+        self.documents = None
+        self.lookup = {}
 
     def with_pipeline(self, pipeline: list[dict], **kwargs) -> "AggregateMock":
         self.query = pipeline
@@ -364,7 +852,32 @@ class AggregateMock(MongoMock):
 
     async def get_result(self):
         result = super().get_result()
-        return AsyncCursor(result if result is not None else [])
+        return AsyncCursor(result if result is not None else [], self.batch_size, self.latency)
+
+    def with_batches(self, batch_size: int, latency: Optional[float] = None) -> "AggregateMock":
+        """Return results in batches of batch_size, each one delayed by latency seconds if given"""
+        self.batch_size = batch_size
+        self.latency = latency
+        return self
+
+    def with_documents(self, documents: Any, lookup: Optional[Mapping[str, list[dict]]] = None) -> "AggregateMock":
+        """
+        Execute the called pipeline against documents instead of returning a result.
+
+        documents may be a list, an iterator or a factory returning either, lookup maps the collection
+        names $lookup stages join with to their documents.
+        """
+        self.documents = documents
+        self.lookup = lookup or {}
+        return self
+
+    async def respond(self, pipeline: Optional[list[dict]] = None, *args, **kwargs):
+        if self.documents is None:
+            return await self.get_result()
+        documents = self.documents() if isinstance(self.documents, (FunctionType, MethodType, partial)) else self.documents
+        lookup = self.lookup
+        results = run_pipeline((copy_document(document) for document in documents), pipeline or [], lambda name: lookup.get(name, []))
+        return AsyncCursor(results, self.batch_size, self.latency)
 
     def __repr__(self):
         return f"AggregateMock(query={self.query}, kwargs={self.kwargs})"
@@ -409,12 +922,301 @@ class CreateIndexMock(MongoMock):
         return f"CreateIndexMock(query={self.query}, kwargs={self.kwargs})"
 
 
+# Mock class per file mapping cmd, see from_filemapping()
+MOCK_CLASSES: dict[str, type[MongoMock]] = {
+    "find": FindMock,
+    "find_one": FindOneMock,
+    "find_one_and_update": FindOneAndUpdateMock,
+    "insert_one": InsertOneMock,
+    "insert_many": InsertManyMock,
+    "update_one": UpdateOneMock,
+    "update_many": UpdateManyMock,
+    "delete_one": DeleteOneMock,
+    "delete_many": DeleteManyMock,
+    "count_documents": CountDocumentsMock,
+    "aggregate": AggregateMock,
+    "distinct": DistinctMock,
+    "bulk_write": BulkWriteMock,
+    "create_index": CreateIndexMock,
+}
+
+
+class CallRecord:
+    """
+    Lightweight call history of an operation installed in lean mode.
+
+    Calls are kept as plain (args, kwargs) tuples and only turned into `unittest.mock.call`
+    objects when inspected, while the assert_* helpers mirror those of `unittest.mock.Mock`.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: list[tuple[tuple, dict]] = []
+
+    def _record(self, args: tuple, kwargs: dict):
+        self._calls.append((args, kwargs))
+
+    @property
+    def call_args_list(self) -> list:
+        return [call(*args, **kwargs) for args, kwargs in self._calls]
+
+    @property
+    def call_args(self):
+        if not self._calls:
+            return None
+        args, kwargs = self._calls[-1]
+        return call(*args, **kwargs)
+
+    @property
+    def call_count(self) -> int:
+        return len(self._calls)
+
+    @property
+    def called(self) -> bool:
+        return bool(self._calls)
+
+    def reset_mock(self):
+        self._calls.clear()
+
+    def assert_called(self):
+        if not self._calls:
+            raise AssertionError(f"Expected '{self.name}' to have been called.")
+
+    def assert_called_once(self):
+        if len(self._calls) != 1:
+            raise AssertionError(f"Expected '{self.name}' to have been called once. Called {len(self._calls)} times.")
+
+    def assert_not_called(self):
+        if self._calls:
+            raise AssertionError(f"Expected '{self.name}' to not have been called. Called {len(self._calls)} times.")
+
+    def assert_called_with(self, *args, **kwargs):
+        expected = call(*args, **kwargs)
+        if self.call_args != expected:
+            raise AssertionError(f"expected call not found.\nExpected: {expected}\n  Actual: {self.call_args}")
+
+    def assert_called_once_with(self, *args, **kwargs):
+        self.assert_called_once()
+        self.assert_called_with(*args, **kwargs)
+
+    def assert_any_call(self, *args, **kwargs):
+        expected = call(*args, **kwargs)
+        if expected not in self.call_args_list:
+            raise AssertionError(f"{self.name}{expected} call not found")
+
+    def __repr__(self):
+        return f"CallRecord(name={self.name}, call_count={self.call_count})"
+
+
+def _timing_summary(times: array) -> dict[str, Any]:
+    """Cumulative time and nearest-rank percentiles in seconds"""
+    if not times:
+        return {"total": 0.0, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(times)
+    last = len(ordered) - 1
+    return {
+        "total": sum(ordered),
+        "p50": ordered[round(last * 0.5)],
+        "p90": ordered[round(last * 0.9)],
+        "p99": ordered[round(last * 0.99)],
+        "max": ordered[last],
+    }
+
+
+class OperationStats:
+    """
+    Call statistics of one (database, collection, operation) target, see `WireMongo.stats()`.
+
+    Timings are kept as compact arrays of seconds and only summarized when reported.
+    """
+
+    __slots__ = ("calls", "fallthroughs", "hits", "mocks", "match_times", "respond_times")
+
+    def __init__(self):
+        self.calls = 0
+        self.fallthroughs = 0
+        # hits by id() of the selected mock, the mocks are kept so that ids are not reused
+        self.hits: dict[int, int] = {}
+        self.mocks: dict[int, MongoMock] = {}
+        self.match_times = array("d")
+        self.respond_times = array("d")
+
+    def _record_match(self, mock: Optional[MongoMock], seconds: float):
+        self.calls += 1
+        self.match_times.append(seconds)
+        if mock is None:
+            self.fallthroughs += 1
+            return
+        key = id(mock)
+        if key in self.hits:
+            self.hits[key] += 1
+        else:
+            self.hits[key] = 1
+            self.mocks[key] = mock
+
+    def _record_fallthrough(self):
+        self.calls += 1
+        self.fallthroughs += 1
+
+    def clear(self):
+        self.calls = self.fallthroughs = 0
+        self.hits.clear()
+        self.mocks.clear()
+        del self.match_times[:]
+        del self.respond_times[:]
+
+    def report(self) -> dict[str, Any]:
+        hits = sorted(self.hits.items(), key=lambda item: -item[1])
+        return {
+            "calls": self.calls,
+            "hits": self.calls - self.fallthroughs,
+            "fallthroughs": self.fallthroughs,
+            "match_seconds": _timing_summary(self.match_times),
+            "respond_seconds": _timing_summary(self.respond_times),
+            "mocks": [{"mock": repr(self.mocks[key]), "hits": count} for key, count in hits],
+        }
+
+    def __repr__(self):
+        return f"OperationStats(calls={self.calls}, fallthroughs={self.fallthroughs})"
+
+
+def _dispatch_order(mock: MongoMock) -> int:
+    """Sort key placing higher priority mocks first"""
+    return -mock._priority
+
+
+_EXACT_TYPES = frozenset({str, int, float, bool, type(None), ObjectId})
+
+
+def _exact_fingerprint(query: Any) -> Optional[frozenset]:
+    """
+    Return a hashable fingerprint of an equality-only query on scalar fields, or None.
+
+    Two such queries match each other exactly when their fingerprints are equal, including
+    ObjectId fields, which compare equal when their string forms do.
+    """
+    if type(query) is not dict or not query:
+        return None
+    for value in query.values():
+        if type(value) not in _EXACT_TYPES or value != value:  # NaN never equals itself
+            return None
+    return frozenset(query.items())
+
+
+class _ExactIndex:
+    """
+    Hash index over the leading run of equality-only mocks of a dispatch-ordered bucket.
+
+    Only mocks sharing the field names of the run are indexed, and the run ends at the first mock
+    of any other shape. A hit is therefore always the mock a linear scan over the bucket would pick.
+    """
+
+    __slots__ = ("fields", "hits", "size")
+
+    def __init__(self, bucket: list[MongoMock]):
+        self.fields: Optional[frozenset] = None
+        self.hits: dict[frozenset, MongoMock] = {}
+        self.size = 0  # number of leading bucket entries covered by the run
+        for mock in bucket:
+            if not self._index(mock):
+                break
+
+    def _index(self, mock: MongoMock) -> bool:
+        if type(mock).matches is not MongoMock.matches:
+            return False
+        fingerprint = _exact_fingerprint(mock.query)
+        if fingerprint is None:
+            return False
+        fields = frozenset(mock.query)
+        if self.fields is None:
+            self.fields = fields
+        elif fields != self.fields:
+            return False
+        # mocks are indexed in bucket order, so the first mock of a fingerprint precedes the others
+        self.hits.setdefault(fingerprint, mock)
+        self.size += 1
+        return True
+
+    def copy(self) -> "_ExactIndex":
+        index = _ExactIndex.__new__(_ExactIndex)
+        index.fields = self.fields
+        index.hits = dict(self.hits)
+        index.size = self.size
+        return index
+
+    def add(self, position: int, mock: MongoMock) -> bool:
+        """Account for a mock inserted into the bucket at position, returns False if the index must be rebuilt"""
+        if position > self.size:
+            return True
+        if position < self.size:
+            # the mock precedes indexed mocks, which may share its fingerprint or end the run at it
+            return False
+        self._index(mock)
+        return True
+
+    def lookup(self, document: dict) -> Optional[MongoMock]:
+        if not self.hits or len(document) != len(self.fields):
+            return None
+        fingerprint = _exact_fingerprint(document)
+        return self.hits.get(fingerprint) if fingerprint is not None else None
+
+
+class WireMongoSnapshot:
+    """Registered mocks and wiring of a WireMongo instance at a point in time, see `WireMongo.snapshot()`"""
+
+    def __init__(self, mocks, registry, catch_all, exact, handled, pending, reprioritizations=0):
+        self.mocks = mocks
+        self.registry = registry
+        self.catch_all = catch_all
+        self.exact = exact
+        self.handled = handled
+        self.pending = pending
+        self.reprioritizations = reprioritizations
+
+    def __repr__(self):
+        return f"WireMongoSnapshot(mocks={len(self.mocks)}, targets={len(self.registry)})"
+
+
 class WireMongo:
     """Main class for mocking MongoDB operations"""
 
-    def __init__(self, client=None):
-        self.client = client or MockClient()
+    def __init__(self, client=None, lean: bool = False, record_calls: bool = False, stateful: bool = False, collect_stats: bool = False):
+        """
+        Parameters:
+        - client: The client to wire mocks into, a MockClient by default.
+        - lean: Install plain coroutine functions instead of AsyncMock wrappers, which is cheaper per call.
+        - record_calls: Record the calls of every installed operation, see `calls()`. Needs lean, ValueError otherwise.
+        - stateful: Keep documents in in-memory collections of the default MockClient. Calls no mock matches
+          are executed against them instead of failing.
+        - collect_stats: Count mock hits and fall-through calls and time matching and responding, see `stats()`.
+        """
+        if record_calls and not lean:
+            raise ValueError("record_calls needs lean=True, the AsyncMock instances of the default mode record calls themselves")
+        self.client = client or MockClient(lean=lean, stateful=stateful)
+        self._lean = lean
+        self._record_calls = record_calls
+        self._collect_stats = collect_stats
+        # Call statistics by (database, collection, operation), only kept with collect_stats
+        self._stats: dict[tuple[Optional[str], Optional[str], str], OperationStats] = {}
+        # Call records of lean mode operations, keyed by (database, collection, operation)
+        self._calls: dict[tuple[Optional[str], Optional[str], str], CallRecord] = {}
         self.mocks: list[MongoMock] = []
+        # Index of registered mocks by (database, collection, operation), catch-all None.None mocks by operation
+        self._registry: dict[tuple[Optional[str], Optional[str], str], list[MongoMock]] = {}
+        self._catch_all: dict[str, list[MongoMock]] = {}
+        # Hash indexes over equality-only mocks, built lazily per registry bucket
+        self._exact: dict[tuple[Optional[str], Optional[str], str], _ExactIndex] = {}
+        # Targets wired with a mock handler, and targets registered but not wired yet
+        self._handled: set[tuple[Optional[str], Optional[str], str]] = set()
+        self._pending: set[tuple[Optional[str], Optional[str], str]] = set()
+        # Copy-on-write bookkeeping for snapshots: containers are only mutated in place
+        # while they are owned by the current generation, otherwise they are copied first
+        self._generation = 0
+        self._mocks_owner = 0
+        self._bucket_owners: dict[tuple[Optional[str], Optional[str], str], int] = {}
+        self._catch_all_owners: dict[str, int] = {}
+        # Number of priority changes of registered mocks, snapshots taken before one are sorted again on restore
+        self._reprioritizations = 0
         self._original_methods = {}
         self._default_handlers = {}
         # Store collection objects per (database, collection) to avoid AsyncMock reuse issues
@@ -438,23 +1240,42 @@ class WireMongo:
             active_mocks[db][coll].append(repr(mock))
         return active_mocks
 
-    def find_candidates(self, database: str, collection: str, operation: str, *args, **kwargs) -> dict[str, Any]:
+    def find_candidates(self, database: str, collection: str, operation: str, *args, top_k: Optional[int] = None, **kwargs) -> dict[str, Any]:
         """
-        Finds all mocks registered for a specific call and reports if they match.
+        Finds all mocks registered for a specific call, catch-all mocks included, and reports if they match.
         Useful for debugging why a specific call isn't matching any mock.
+
+        Matching mocks are ranked first in dispatch order, so the selected mock leads, then the other mocks by
+        the number of query fields matching the call, ties in dispatch order. Only the top_k best are reported if given. Each candidate comes with a diff of its query
+        against the call, reporting every field as "match", "mismatch", "missing" or "unexpected", and whether
+        dispatch would select it.
         """
-        candidates = [m for m in self.mocks if m.operation == operation 
-                     and m.database == database 
-                     and m.collection == collection]
-        
+        candidates = self._candidates(database, collection, operation)
+        selected = self._select(database, collection, operation, args, kwargs)
+
+        ranked = []
+        for order, mock in enumerate(candidates):
+            diff = _query_diff(mock.query, args)
+            matches = mock.matches(*args, **kwargs)
+            score = _nearness(diff)
+            ranked.append(((not matches, 0 if matches else -score, order), mock, matches, score, diff))
+        ranked = heapq.nsmallest(top_k, ranked, key=lambda entry: entry[0]) if top_k is not None else sorted(ranked, key=lambda entry: entry[0])
+
         results = []
-        for mock in candidates:
+        for _, mock, matches, score, diff in ranked:
             results.append({
                 "mock": repr(mock),
                 "priority": mock._priority,
-                "matches": mock.matches(*args, **kwargs)
+                "matches": matches,
+                "selected": mock is selected,
+                "catch_all": mock.database is None and mock.collection is None,
+                "score": score,
+                "diff": {
+                    field: {key: None if value is MISSING else value for key, value in entry.items()}
+                    for field, entry in diff.items()
+                },
             })
-        
+
         return {
             "call": f"{database}.{collection}.{operation}(args={args}, kwargs={kwargs})",
             "total_candidates": len(candidates),
@@ -462,10 +1283,171 @@ class WireMongo:
         }
 
     def mock(self, *mocks: MongoMock) -> "WireMongo":
-        """Add mocks to be used"""
+        """Add mocks to be used
+
+        Buckets are kept in dispatch order. A registered mock whose priority changes moves behind the mocks
+        of its new priority, as if it was registered again.
+        """
+        if self._mocks_owner != self._generation:
+            self.mocks = list(self.mocks)
+            self._mocks_owner = self._generation
         self.mocks.extend(mocks)
+        for mock in mocks:
+            mock._compile()
+            if not any(reference() is self for reference in mock._registries):
+                mock._registries += (weakref.ref(self),)
+            key = (mock.database, mock.collection, mock.operation)
+            bucket = self._owned_bucket(key)
+            # bisect_right keeps registration order among mocks of equal priority
+            position = bisect.bisect_right(bucket, _dispatch_order(mock), key=_dispatch_order)
+            bucket.insert(position, mock)
+            if key not in self._handled:
+                self._pending.add(key)
+            index = self._exact.get(key)
+            if index is not None and not index.add(position, mock):
+                del self._exact[key]
+            if mock.database is None and mock.collection is None:
+                bisect.insort(self._owned_catch_all(mock.operation), mock, key=_dispatch_order)
         return self
 
+    def _reprioritize(self, mock: MongoMock):
+        """Move a registered mock whose priority changed to its new place in dispatch order"""
+        self._reprioritizations += 1
+        key = (mock.database, mock.collection, mock.operation)
+        if any(registered is mock for registered in self._registry.get(key, ())):
+            bucket = self._owned_bucket(key)
+            bucket.remove(mock)
+            bisect.insort_right(bucket, mock, key=_dispatch_order)
+            self._exact.pop(key, None)
+        if any(registered is mock for registered in self._catch_all.get(mock.operation, ())):
+            bucket = self._owned_catch_all(mock.operation)
+            bucket.remove(mock)
+            bisect.insort_right(bucket, mock, key=_dispatch_order)
+
+    def _owned_bucket(self, key: tuple[Optional[str], Optional[str], str]) -> list[MongoMock]:
+        """Return the registry bucket for key, copied first if it is shared with a snapshot"""
+        bucket = self._registry.get(key)
+        if bucket is None:
+            bucket = self._registry[key] = []
+        elif self._bucket_owners.get(key) != self._generation:
+            bucket = self._registry[key] = list(bucket)
+            index = self._exact.get(key)
+            if index is not None:
+                self._exact[key] = index.copy()
+        self._bucket_owners[key] = self._generation
+        return bucket
+
+    def _owned_catch_all(self, operation: str) -> list[MongoMock]:
+        """Return the catch-all bucket for operation, copied first if it is shared with a snapshot"""
+        bucket = self._catch_all.get(operation)
+        if bucket is None:
+            bucket = self._catch_all[operation] = []
+        elif self._catch_all_owners.get(operation) != self._generation:
+            bucket = self._catch_all[operation] = list(bucket)
+        self._catch_all_owners[operation] = self._generation
+        return bucket
+
+    def snapshot(self) -> "WireMongoSnapshot":
+        """
+        Capture the registered mocks and wiring, to be rolled back to with `restore()`.
+
+        Registry buckets are shared with the snapshot and only copied once they are written to.
+        Documents held by in-memory stores are not part of a snapshot.
+        """
+        snapshot = WireMongoSnapshot(
+            mocks=self.mocks,
+            registry=dict(self._registry),
+            catch_all=dict(self._catch_all),
+            exact=dict(self._exact),
+            handled=frozenset(self._handled),
+            pending=frozenset(self._pending),
+            reprioritizations=self._reprioritizations,
+        )
+        self._generation += 1
+        return snapshot
+
+    def restore(self, snapshot: "WireMongoSnapshot") -> "WireMongo":
+        """Roll the registered mocks and wiring back to a snapshot, which can be restored again later"""
+        self._generation += 1
+        self.mocks = snapshot.mocks
+        self._registry = dict(snapshot.registry)
+        self._catch_all = dict(snapshot.catch_all)
+        self._exact = dict(snapshot.exact)
+        if snapshot.reprioritizations != self._reprioritizations:
+            # priorities of mocks changed since the snapshot, its buckets are no longer in dispatch order
+            self._registry = {key: sorted(bucket, key=_dispatch_order) for key, bucket in self._registry.items()}
+            self._catch_all = {operation: sorted(bucket, key=_dispatch_order) for operation, bucket in self._catch_all.items()}
+            self._exact = {}
+
+        # Targets wired after the snapshot fall back to their default handlers
+        for key in self._handled - snapshot.handled:
+            db, coll, op = key
+            if key in self._default_handlers:
+                setattr(self._get_collection(db, coll), op, self._wrap(key, self._default_handlers[key]))
+        # Targets whose handlers were removed since, e.g. by reset(), are wired again
+        self._handled &= snapshot.handled
+        self._pending = set(snapshot.handled - self._handled)
+        if self._pending:
+            self.build()
+        self._pending = set(snapshot.pending)
+        return self
+
+    def _iter_candidates(self, database: Optional[str], collection: Optional[str], operation: str) -> Iterator[MongoMock]:
+        """
+        Yield the mocks for a call in dispatch order: highest priority first, specific mocks before
+        catch-all None.None mocks of the same priority, then registration order.
+        """
+        specific = self._registry.get((database, collection, operation), ())
+        if database is None and collection is None:
+            # the catch-all bucket is the specific bucket itself
+            return iter(specific)
+        catch_all = self._catch_all.get(operation)
+        if not catch_all:
+            return iter(specific)
+        if not specific:
+            return iter(catch_all)
+        # merge is stable, so specific mocks win ties against catch-alls
+        return heapq.merge(specific, catch_all, key=_dispatch_order)
+
+    def _candidates(self, database: Optional[str], collection: Optional[str], operation: str) -> list[MongoMock]:
+        """Return the mocks registered for a call in dispatch order."""
+        return list(self._iter_candidates(database, collection, operation))
+
+    def _exact_hit(self, database: Optional[str], collection: Optional[str], operation: str, document: dict) -> Optional[MongoMock]:
+        """Resolve an equality-only call through the hash index of its bucket"""
+        key = (database, collection, operation)
+        bucket = self._registry.get(key)
+        if not bucket:
+            return None
+        index = self._exact.get(key)
+        if index is None:
+            index = self._exact[key] = _ExactIndex(bucket)
+        hit = index.lookup(document)
+        if hit is not None and not (database is None and collection is None):
+            catch_all = self._catch_all.get(operation)
+            if catch_all and catch_all[0]._priority > hit._priority:
+                return None
+        return hit
+
+    def _select(self, database: Optional[str], collection: Optional[str], operation: str, args: tuple, kwargs: dict) -> Optional[MongoMock]:
+        """
+        Return the first mock in dispatch order that matches the call, if any.
+
+        A mock matches if its query equals the call's arguments or its query operators select them, so
+        priorities decide between literal and operator matches like between any other mocks.
+        """
+        if args and type(args[0]) is dict:
+            hit = self._exact_hit(database, collection, operation, args[0])
+            if hit is not None:
+                return hit
+        for mock in self._iter_candidates(database, collection, operation):
+            if type(mock).matches is not MongoMock.matches:
+                if mock.matches(*args, **kwargs):
+                    return mock
+            elif mock._matches(args, kwargs, True):
+                return mock
+        return None
+
     def _ensure_collection_has_async_methods(self, collection):
         """Ensure a collection mock has async methods for all supported operations."""
         # Always set async methods, don't check hasattr as MagicMock always returns something
@@ -520,10 +1502,115 @@ class WireMongo:
                 
         return self._collection_cache[key]
 
+    def calls(self, database: Optional[str], collection: Optional[str], operation: str) -> CallRecord:
+        """
+        Return the call record of an operation installed in lean mode.
+
+        Without `record_calls`, recording of the operation starts with this call.
+        """
+        if not self._lean:
+            raise ValueError("call records are only kept in lean mode, inspect the installed AsyncMock instead")
+        key = (database, collection, operation)
+        if key not in self._calls:
+            self._calls[key] = CallRecord(f"{database}.{collection}.{operation}")
+        return self._calls[key]
+
+    def _operation_stats(self, database: Optional[str], collection: Optional[str], operation: str) -> OperationStats:
+        key = (database, collection, operation)
+        if key not in self._stats:
+            self._stats[key] = OperationStats()
+        return self._stats[key]
+
+    def stats(self) -> dict[str, dict[str, dict[str, Any]]]:
+        """
+        Returns the call statistics collected with `collect_stats`, see `reset_stats()`.
+        Format: { "database_name": { "collection_name": { "operation": {"calls": ..., "hits": ..., "fallthroughs": ...,
+        "match_seconds": {...}, "respond_seconds": {...}, "mocks": [{"mock": "OperationMock(...)", "hits": ...}]} } } }
+
+        Fall-through calls are the calls no mock matched. Responding covers producing the result of a mock,
+        cursors are timed until they are returned, not while they are iterated.
+        """
+        if not self._collect_stats:
+            raise ValueError("stats are only collected with WireMongo(collect_stats=True)")
+        report = {}
+        for (db, coll, op), stats in self._stats.items():
+            if stats.calls:
+                report.setdefault(db or "any_db", {}).setdefault(coll or "any_collection", {})[op] = stats.report()
+        return report
+
+    def reset_stats(self):
+        """Start collecting call statistics from scratch, `reset()` does so as well"""
+        for stats in self._stats.values():
+            stats.clear()
+
+    def _counting_fallthroughs(self, key: tuple[Optional[str], Optional[str], str], handler: Callable) -> Callable:
+        """Wrap the default handler of a target without mocks, so that its calls are counted as fall-through calls"""
+        stats = self._operation_stats(*key)
+        if key[2] in ASYNC_COROUTINE_CURSOR_OPERATIONS:
+            async def counting_coroutine_handler(*args, **kwargs):
+                stats._record_fallthrough()
+                return await handler(*args, **kwargs)
+            return counting_coroutine_handler
+
+        def counting_handler(*args, **kwargs):
+            stats._record_fallthrough()
+            return handler(*args, **kwargs)
+        return counting_handler
+
+    def _wrap(self, key: tuple[Optional[str], Optional[str], str], handler: Callable) -> Callable:
+        """
+        Wrap a handler into the callable installed on a collection.
+
+        `handler` is a coroutine function for coroutine cursor operations and a plain function otherwise.
+        """
+        operation = key[2]
+        if not self._lean:
+            if operation in ASYNC_CURSOR_COLLECTION_OPERATIONS:
+                return handler
+            if operation in ASYNC_COROUTINE_CURSOR_OPERATIONS:
+                return AsyncMock(side_effect=handler)
+            return AsyncMock(side_effect=async_partial(handler))
+
+        if self._record_calls:
+            self.calls(*key)
+        calls = self._calls
+
+        if operation in ASYNC_CURSOR_COLLECTION_OPERATIONS:
+            def cursor_operation(*args, **kwargs):
+                record = calls.get(key)
+                if record is not None:
+                    record._record(args, kwargs)
+                return handler(*args, **kwargs)
+            return cursor_operation
+        if operation in ASYNC_COROUTINE_CURSOR_OPERATIONS:
+            async def coroutine_cursor_operation(*args, **kwargs):
+                record = calls.get(key)
+                if record is not None:
+                    record._record(args, kwargs)
+                return await handler(*args, **kwargs)
+            return coroutine_cursor_operation
+
+        async def async_operation(*args, **kwargs):
+            record = calls.get(key)
+            if record is not None:
+                record._record(args, kwargs)
+            return handler(*args, **kwargs)
+        return async_operation
+
+    @staticmethod
+    def _store_operation(collection, operation: str) -> Optional[Callable]:
+        """The in-memory implementation of an operation for stateful collections, None otherwise"""
+        return collection.store_operation(operation) if isinstance(collection, MockCollection) else None
+
     def build(self):
-        """Build the mock setup"""
-        # Set up default handlers for all collections that have mocks
-        collections = {(mock.database, mock.collection) for mock in self.mocks} if self.mocks else {("mock_db", "mock_collection")}
+        """
+        Build the mock setup
+
+        Handlers look mocks up in the registry on every call, so only the (database, collection, operation)
+        targets registered since the last build need to be wired.
+        """
+        # Set up default handlers for all collections that got new mocks
+        collections = {(db, coll) for db, coll, _ in self._pending} if self._registry else {("mock_db", "mock_collection")}
 
         for db, coll in collections:
             collection = self._get_collection(db, coll)
@@ -535,77 +1622,81 @@ class WireMongo:
                 db_name = db
                 coll_name = coll
                 
-                # Capture operation in closure by using default parameter
-                def create_default_handler(op=op, *args, **kwargs):
-                    raise AssertionError(f"No matching mock found for {op} args={args} kwargs={kwargs} - Candidates are {self.mocks}")
+                # Capture operation in closure by using default parameter, a miss only reports the mocks of its target
+                def create_default_handler(*args, op=op, db_name=db_name, coll_name=coll_name, **kwargs):
+                    raise NoMatchingMockError(op, args, kwargs, self._candidates(db_name, coll_name, op))
 
                 key = (db_name, coll_name, op)
                 if key not in self._original_methods:
                     self._original_methods[key] = getattr(collection, op, None)
 
-                    if op in ASYNC_CURSOR_COLLECTION_OPERATIONS:
-                        new_mock = default_handler = create_default_handler
+                    store_operation = self._store_operation(collection, op)
+                    if store_operation is not None:
+                        default_handler = store_operation
                     elif op in ASYNC_COROUTINE_CURSOR_OPERATIONS:
                         # Capture operation value using default parameter to avoid closure issue
-                        async def async_default_handler(op=op, *args, **kwargs):
-                            raise AssertionError(f"No matching mock found for {op} args={args} kwargs={kwargs} - Candidates are {self.mocks}")
+                        async def async_default_handler(*args, op=op, db_name=db_name, coll_name=coll_name, **kwargs):
+                            raise NoMatchingMockError(op, args, kwargs, self._candidates(db_name, coll_name, op))
                         default_handler = async_default_handler
-                        new_mock = AsyncMock(side_effect=default_handler)
                     else:
-                        default_handler = async_partial(create_default_handler)
-                        new_mock = AsyncMock(side_effect=default_handler)
+                        default_handler = create_default_handler
+                    if self._collect_stats:
+                        default_handler = self._counting_fallthroughs(key, default_handler)
                     self._default_handlers[key] = default_handler
-                    setattr(collection, op, new_mock)
+                    setattr(collection, op, self._wrap(key, default_handler))
 
         # Helper function to create handlers - defined outside loop to avoid closure issues
-        def create_handler(operation: str, database: str, collection_name: str):
+        def create_handler(operation: str, database: str, collection_name: str, fallback: Optional[Callable]):
             """Create a handler function for a specific operation, database, and collection."""
+            stats = self._operation_stats(database, collection_name, operation) if self._collect_stats else None
             if operation in ASYNC_COROUTINE_CURSOR_OPERATIONS:
                 async def handler(*args, **kwargs):
-                    # Look for specific mocks for this database/collection
-                    candidates = [m for m in self.mocks if m.operation == operation and m.database == database and m.collection == collection_name]
-                    # Also include catch-all None.None mocks as fallback
-                    catch_all = [m for m in self.mocks if m.operation == operation and m.database is None and m.collection is None]
-                    candidates.extend(catch_all)
-                    matching_mocks = [(i, m) for i, m in enumerate(candidates) if m.matches(*args, **kwargs)]
-                    if not matching_mocks:
-                        raise AssertionError(f"No matching mock found for {operation}: args={args}, kwargs={kwargs} - Candidates are {candidates}")
-                    idx, selected_mock = max(matching_mocks, key=lambda x: x[1]._priority)
-                    return await selected_mock.get_result()
+                    started = time.perf_counter() if stats is not None else 0.0
+                    # Specific mocks for this database/collection, followed by catch-all None.None mocks as fallback
+                    selected_mock = self._select(database, collection_name, operation, args, kwargs)
+                    if stats is not None:
+                        selected = time.perf_counter()
+                        stats._record_match(selected_mock, selected - started)
+                    if selected_mock is None:
+                        if fallback is not None:
+                            return await fallback(*args, **kwargs)
+                        raise NoMatchingMockError(operation, args, kwargs, self._candidates(database, collection_name, operation))
+                    if stats is None:
+                        return await selected_mock.respond(*args, **kwargs)
+                    try:
+                        return await selected_mock.respond(*args, **kwargs)
+                    finally:
+                        stats.respond_times.append(time.perf_counter() - selected)
                 return handler
             else:
                 def handler(*args, **kwargs):
-                    # Look for specific mocks for this database/collection
-                    candidates = [m for m in self.mocks if m.operation == operation and m.database == database and m.collection == collection_name]
-                    # Also include catch-all None.None mocks as fallback
-                    catch_all = [m for m in self.mocks if m.operation == operation and m.database is None and m.collection is None]
-                    candidates.extend(catch_all)
-                    matching_mocks = [(i, m) for i, m in enumerate(candidates) if m.matches(*args, **kwargs)]
-                    if not matching_mocks:
-                        raise AssertionError(f"No matching mock found for {operation}: args={args}, kwargs={kwargs} - Candidates are {candidates}")
-                    idx, selected_mock = max(matching_mocks, key=lambda x: x[1]._priority)
-                    return selected_mock.get_result()
+                    started = time.perf_counter() if stats is not None else 0.0
+                    # Specific mocks for this database/collection, followed by catch-all None.None mocks as fallback
+                    selected_mock = self._select(database, collection_name, operation, args, kwargs)
+                    if stats is not None:
+                        selected = time.perf_counter()
+                        stats._record_match(selected_mock, selected - started)
+                    if selected_mock is None:
+                        if fallback is not None:
+                            return fallback(*args, **kwargs)
+                        raise NoMatchingMockError(operation, args, kwargs, self._candidates(database, collection_name, operation))
+                    if stats is None:
+                        return selected_mock.respond(*args, **kwargs)
+                    try:
+                        return selected_mock.respond(*args, **kwargs)
+                    finally:
+                        stats.respond_times.append(time.perf_counter() - selected)
                 return handler
 
         # Set up specific mock handlers - one per (database, collection, operation)
-        handled_operations = set()
-        for i, mock in enumerate(self.mocks):
-            key = (mock.database, mock.collection, mock.operation)
-            if key in handled_operations:
-                continue
-            handled_operations.add(key)
-            
-            collection = self._get_collection(mock.database, mock.collection)
+        for db, coll, operation in self._pending:
+            collection = self._get_collection(db, coll)
 
             # Create new mock with the handler - pass values explicitly to avoid closure issues
-            handler_func = create_handler(mock.operation, mock.database, mock.collection)
-            if mock.operation in ASYNC_COROUTINE_CURSOR_OPERATIONS:
-                new_mock = AsyncMock(side_effect=handler_func)
-            elif mock.operation in ASYNC_CURSOR_COLLECTION_OPERATIONS:
-                new_mock = handler_func
-            else:
-                new_mock = AsyncMock(side_effect=async_partial(handler_func))
-            setattr(collection, mock.operation, new_mock)
+            handler_func = create_handler(operation, db, coll, self._store_operation(collection, operation))
+            setattr(collection, operation, self._wrap((db, coll, operation), handler_func))
+            self._handled.add((db, coll, operation))
+        self._pending.clear()
         
         # Set up client access ONCE at the end, after all collections are cached
         if not isinstance(self.client, MockClient) and hasattr(self.client, '_wiremongo_dbs'):
@@ -645,20 +1736,25 @@ class WireMongo:
 
     def reset(self):
         """Clear all mocks and restore original methods"""
+        # Cleared first: with record_calls, wrapping the default handlers below starts new records
+        self._calls.clear()
         # Restore original methods
         for key, method in self._original_methods.items():
             db, coll, op = key
             if method is not None:
                 collection = self._get_collection(db, coll)
-                if op in ASYNC_CURSOR_COLLECTION_OPERATIONS:
-                    new_mock = self._default_handlers[key]
-                elif op in ASYNC_COROUTINE_CURSOR_OPERATIONS:
-                    new_mock = AsyncMock(side_effect=self._default_handlers[key])
-                else:
-                    new_mock = AsyncMock(side_effect=async_partial(self._default_handlers[key]))
-                setattr(collection, op, new_mock)
+                setattr(collection, op, self._wrap(key, self._default_handlers[key]))
 
         self._original_methods.clear()
         self._default_handlers.clear()
         self._collection_cache.clear()
-        self.mocks.clear()
\ No newline at end of file
+        self._registry.clear()
+        self._catch_all.clear()
+        self._exact.clear()
+        self._handled.clear()
+        self._pending.clear()
+        self.reset_stats()
+        self._bucket_owners.clear()
+        self._catch_all_owners.clear()
+        self.mocks = []
+        self._mocks_owner = self._generation
\ No newline at end of file
@@ -0,0 +1,339 @@
+from collections.abc import Mapping
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from wiremongo.query import (
+    MISSING, compile_filter, copy_document, document_sort_key, get_path, hashable, project, sort_key, sort_spec, top_k,
+)
+
+Expression = Callable[[Any], Any]
+Lookup = Callable[[str], Iterable[Mapping[str, Any]]]
+
+
+def _truthy(value: Any) -> bool:
+    """Truthiness of aggregation expressions: only false, null, zero and missing values are false"""
+    return value is not MISSING and value is not None and value is not False and not (isinstance(value, (int, float)) and value == 0)
+
+
+def _null(value: Any) -> bool:
+    return value is None or value is MISSING
+
+
+def _arithmetic(operator: Callable[[Any, Any], Any]) -> Callable[[list], Any]:
+    def evaluate(values):
+        if any(_null(value) for value in values):
+            return None
+        result = values[0]
+        for value in values[1:]:
+            result = operator(result, value)
+        return result
+    return evaluate
+
+
+def _compare(operator: Callable[[tuple, tuple], bool]) -> Callable[[list], bool]:
+    return lambda values: operator(sort_key(values[0]), sort_key(values[1]))
+
+
+_OPERATORS: dict[str, Callable[[list], Any]] = {
+    "$add": _arithmetic(lambda a, b: a + b),
+    "$subtract": _arithmetic(lambda a, b: a - b),
+    "$multiply": _arithmetic(lambda a, b: a * b),
+    "$divide": _arithmetic(lambda a, b: a / b),
+    "$mod": _arithmetic(lambda a, b: a % b),
+    "$concat": lambda values: None if any(_null(value) for value in values) else "".join(values),
+    "$toUpper": lambda values: "" if _null(values[0]) else str(values[0]).upper(),
+    "$toLower": lambda values: "" if _null(values[0]) else str(values[0]).lower(),
+    "$size": lambda values: len(values[0]),
+    "$in": lambda values: any(hashable(values[0]) == hashable(item) for item in values[1]),
+    "$ifNull": lambda values: next((value for value in values[:-1] if not _null(value)), values[-1]),
+    "$and": lambda values: all(_truthy(value) for value in values),
+    "$or": lambda values: any(_truthy(value) for value in values),
+    "$not": lambda values: not _truthy(values[0]),
+    "$eq": _compare(lambda a, b: a == b),
+    "$ne": _compare(lambda a, b: a != b),
+    "$gt": _compare(lambda a, b: a > b),
+    "$gte": _compare(lambda a, b: a >= b),
+    "$lt": _compare(lambda a, b: a < b),
+    "$lte": _compare(lambda a, b: a <= b),
+}
+
+
+def compile_expression(expression: Any) -> Expression:
+    """Compile an aggregation expression into a function of the current document"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        if expression in ("$$ROOT", "$$CURRENT"):
+            return lambda document: document
+        if expression == "$$REMOVE":
+            return lambda document: MISSING
+        if expression.startswith("$$"):
+            raise NotImplementedError(f"aggregation variable {expression} is not supported")
+        path = expression[1:]
+        return lambda document: get_path(document, path)
+    if isinstance(expression, list):
+        items = [compile_expression(item) for item in expression]
+        return lambda document: [item(document) for item in items]
+    if not isinstance(expression, Mapping):
+        return lambda document: expression
+    if len(expression) == 1:
+        operator, arguments = next(iter(expression.items()))
+        if operator == "$literal":
+            return lambda document: arguments
+        if operator == "$cond":
+            if isinstance(arguments, Mapping):
+                arguments = [arguments["if"], arguments["then"], arguments["else"]]
+            condition, then, otherwise = (compile_expression(argument) for argument in arguments)
+            return lambda document: then(document) if _truthy(condition(document)) else otherwise(document)
+        if operator.startswith("$"):
+            if operator not in _OPERATORS:
+                raise NotImplementedError(f"aggregation operator {operator} is not supported")
+            evaluate = _OPERATORS[operator]
+            items = [compile_expression(argument) for argument in (arguments if isinstance(arguments, list) else [arguments])]
+            return lambda document: evaluate([item(document) for item in items])
+    fields = {key: compile_expression(value) for key, value in expression.items()}
+
+    def evaluate_document(document):
+        result = {}
+        for key, field in fields.items():
+            value = field(document)
+            if value is not MISSING:
+                result[key] = value
+        return result
+    return evaluate_document
+
+
+def _with_path(document: Mapping[str, Any], parts: list[str], value: Any) -> dict:
+    """A copy of document with the dotted path set, embedded documents on the path are copied as well"""
+    result = dict(document)
+    head = parts[0]
+    if len(parts) == 1:
+        if value is MISSING:
+            result.pop(head, None)
+        else:
+            result[head] = value
+    else:
+        embedded = result.get(head)
+        result[head] = _with_path(embedded if isinstance(embedded, Mapping) else {}, parts[1:], value)
+    return result
+
+
+def _match(documents: Iterator, spec: Mapping[str, Any]) -> Iterator:
+    predicate = compile_filter(spec)
+    return (document for document in documents if predicate(document))
+
+
+def _add_fields(documents: Iterator, spec: Mapping[str, Any]) -> Iterator:
+    fields = [(path.split("."), compile_expression(expression)) for path, expression in spec.items()]
+    for document in documents:
+        result = document
+        for parts, field in fields:
+            result = _with_path(result, parts, field(document))
+        yield result
+
+
+def _project(documents: Iterator, spec: Mapping[str, Any]) -> Iterator:
+    flags = {path: value for path, value in spec.items() if isinstance(value, (bool, int, float))}
+    computed = [(path.split("."), compile_expression(value)) for path, value in spec.items() if path not in flags]
+    included = {path: 1 for path, value in flags.items() if value and path != "_id"}
+    if not computed and not included:
+        yield from (project(document, flags) for document in documents)
+        return
+    include_id = bool(flags.get("_id", True))
+    for document in documents:
+        result = project(document, {**included, "_id": int(include_id)}) if included else {}
+        if not included and include_id and "_id" in document:
+            result["_id"] = document["_id"]
+        for parts, field in computed:
+            result = _with_path(result, parts, field(document))
+        yield result
+
+
+def _unwind(documents: Iterator, spec: Any) -> Iterator:
+    if isinstance(spec, str):
+        spec = {"path": spec}
+    parts = spec["path"].lstrip("$").split(".")
+    index_parts = spec["includeArrayIndex"].split(".") if spec.get("includeArrayIndex") else None
+    preserve = spec.get("preserveNullAndEmptyArrays", False)
+    for document in documents:
+        value = get_path(document, ".".join(parts))
+        if isinstance(value, list) and value:
+            for index, item in enumerate(value):
+                result = _with_path(document, parts, item)
+                yield result if index_parts is None else _with_path(result, index_parts, index)
+        elif isinstance(value, list) or _null(value):
+            if preserve:
+                yield document if index_parts is None else _with_path(document, index_parts, None)
+        else:
+            yield document if index_parts is None else _with_path(document, index_parts, None)
+
+
+class _Accumulator:
+    """State of one accumulator of one group"""
+
+    __slots__ = ("value", "count", "seen")
+
+    def __init__(self):
+        self.value = MISSING
+        self.count = 0
+        self.seen = None
+
+
+def _accumulate(operator: str, state: _Accumulator, value: Any):
+    if operator == "$sum" or operator == "$avg":
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            state.value = value if state.value is MISSING else state.value + value
+            state.count += 1
+    elif operator == "$min" or operator == "$max":
+        if _null(value):
+            return
+        if state.value is MISSING:
+            state.value = value
+        elif sort_key(value) < sort_key(state.value) if operator == "$min" else sort_key(value) > sort_key(state.value):
+            state.value = value
+    elif operator == "$first":
+        if state.count == 0:
+            state.value = None if value is MISSING else value
+            state.count = 1
+    elif operator == "$last":
+        state.value = None if value is MISSING else value
+    elif operator == "$push":
+        if state.value is MISSING:
+            state.value = []
+        if value is not MISSING:
+            state.value.append(value)
+    elif operator == "$addToSet":
+        if state.value is MISSING:
+            state.value, state.seen = [], set()
+        if value is not MISSING and hashable(value) not in state.seen:
+            state.seen.add(hashable(value))
+            state.value.append(value)
+    elif operator == "$count":
+        state.value = 1 if state.value is MISSING else state.value + 1
+
+
+def _result(operator: str, state: _Accumulator) -> Any:
+    if operator == "$sum":
+        return 0 if state.value is MISSING else state.value
+    if operator == "$avg":
+        return None if not state.count else state.value / state.count
+    if operator in ("$push", "$addToSet"):
+        return [] if state.value is MISSING else state.value
+    return None if state.value is MISSING else state.value
+
+
+_ACCUMULATORS = frozenset(("$sum", "$avg", "$min", "$max", "$first", "$last", "$push", "$addToSet", "$count"))
+
+
+def _group(documents: Iterator, spec: Mapping[str, Any]) -> Iterator:
+    """Hash aggregation, groups are emitted in the order they were first seen"""
+    key_expression = compile_expression(spec["_id"])
+    accumulators = []
+    for field, accumulator in spec.items():
+        if field == "_id":
+            continue
+        operator, argument = next(iter(accumulator.items()))
+        if operator not in _ACCUMULATORS:
+            raise NotImplementedError(f"accumulator {operator} is not supported")
+        accumulators.append((field, operator, compile_expression(argument)))
+    groups: dict[Any, tuple[Any, list[_Accumulator]]] = {}
+    for document in documents:
+        key = key_expression(document)
+        key = None if key is MISSING else key
+        group = groups.get(hashable(key))
+        if group is None:
+            group = groups[hashable(key)] = (key, [_Accumulator() for _ in accumulators])
+        for (_, operator, argument), state in zip(accumulators, group[1]):
+            _accumulate(operator, state, argument(document))
+    for key, states in groups.values():
+        result = {"_id": key}
+        for (field, operator, _), state in zip(accumulators, states):
+            result[field] = _result(operator, state)
+        yield result
+
+
+def _sort(documents: Iterator, spec: Any, limit: Optional[int]) -> Iterator:
+    key = document_sort_key(sort_spec(spec))
+    yield from sorted(documents, key=key) if limit is None else top_k(documents, limit, key)
+
+
+def _count(documents: Iterator, field: str) -> Iterator:
+    count = sum(1 for _ in documents)
+    if count:
+        yield {field: count}
+
+
+def _lookup(documents: Iterator, spec: Mapping[str, Any], lookup: Optional[Lookup]) -> Iterator:
+    """Hash join, the foreign collection is read once and indexed by foreignField"""
+    if "pipeline" in spec:
+        raise NotImplementedError("$lookup with a pipeline is not supported")
+    if lookup is None:
+        raise ValueError(f"$lookup needs the documents of collection {spec['from']}")
+    local_field, foreign_field, target = spec["localField"], spec["foreignField"], spec["as"].split(".")
+    foreign: dict[Any, list] = {}
+    for foreign_document in lookup(spec["from"]):
+        value = get_path(foreign_document, foreign_field)
+        keys = {hashable(None if value is MISSING else value)}
+        if isinstance(value, list):
+            keys.update(hashable(item) for item in value)
+        for key in keys:
+            foreign.setdefault(key, []).append(foreign_document)
+    for document in documents:
+        value = get_path(document, local_field)
+        values = value if isinstance(value, list) and value else [None if value is MISSING else value]
+        joined, seen = [], set()
+        for item in values:
+            for foreign_document in foreign.get(hashable(item), ()):
+                if id(foreign_document) not in seen:
+                    seen.add(id(foreign_document))
+                    joined.append(copy_document(foreign_document))
+        yield _with_path(document, target, joined)
+
+
+def run_pipeline(documents: Iterable[Mapping[str, Any]], pipeline: list[Mapping[str, Any]], lookup: Optional[Lookup] = None) -> Iterator:
+    """
+    Run an aggregation pipeline over documents as a chain of generators.
+
+    $match, $project, $addFields, $unwind, $skip and $limit stream documents through, so a $limit stops
+    pulling documents once it is reached. $sort directly followed by $limit keeps only the top documents.
+    $group uses hash aggregation and $lookup a hash join over the documents `lookup(name)` returns.
+    """
+    stream: Iterator = iter(documents)
+    stages = list(pipeline)
+    position = 0
+    while position < len(stages):
+        stage = stages[position]
+        if len(stage) != 1:
+            raise ValueError(f"a pipeline stage must have exactly one field: {stage}")
+        name, spec = next(iter(stage.items()))
+        if name == "$match":
+            stream = _match(stream, spec)
+        elif name == "$project":
+            stream = _project(stream, spec)
+        elif name in ("$addFields", "$set"):
+            stream = _add_fields(stream, spec)
+        elif name == "$unset":
+            stream = _project(stream, {field: 0 for field in ([spec] if isinstance(spec, str) else spec)})
+        elif name == "$sort":
+            following = stages[position + 1] if position + 1 < len(stages) else {}
+            limit = following.get("$limit")
+            stream = _sort(stream, spec, limit)
+            if limit is not None:
+                position += 1
+        elif name == "$skip":
+            stream = islice(stream, spec, None)
+        elif name == "$limit":
+            stream = islice(stream, spec)
+        elif name == "$unwind":
+            stream = _unwind(stream, spec)
+        elif name == "$group":
+            stream = _group(stream, spec)
+        elif name == "$count":
+            stream = _count(stream, spec)
+        elif name == "$lookup":
+            stream = _lookup(stream, spec, lookup)
+        elif name == "$replaceRoot":
+            new_root = compile_expression(spec["newRoot"])
+            stream = (new_root(document) for document in stream)
+        else:
+            raise NotImplementedError(f"aggregation stage {name} is not supported")
+        position += 1
+    return stream
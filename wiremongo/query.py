@@ -0,0 +1,639 @@
+import heapq
+import re
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from itertools import count
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.regex import Regex
+from bson.timestamp import Timestamp
+
+ASCENDING = 1
+DESCENDING = -1
+
+
+class _Missing:
+    """Marker for fields absent from a document"""
+
+    def __repr__(self):
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+def get_path(document: Any, path: str) -> Any:
+    """
+    Resolve a dotted path in a document, returns MISSING if any part of it is absent.
+
+    Numeric parts index into arrays, other parts applied to an array collect the field from every
+    embedded document, as MongoDB does.
+    """
+    value = document
+    for part in path.split("."):
+        if isinstance(value, Mapping):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list):
+            if part.isdigit():
+                index = int(part)
+                value = value[index] if index < len(value) else MISSING
+            else:
+                values = [get_path(item, part) for item in value if isinstance(item, Mapping)]
+                value = [item for item in values if item is not MISSING] or MISSING
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def sort_key(value: Any) -> tuple:
+    """Key ordering values the way MongoDB compares them across BSON types"""
+    if value is None or value is MISSING:
+        return (2,)
+    if isinstance(value, bool):
+        return (9, value)
+    if isinstance(value, (int, float)):
+        return (3, value)
+    if isinstance(value, Decimal128):
+        return (3, value.to_decimal())
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, Mapping):
+        return (5, tuple((key, sort_key(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (6, tuple(sort_key(item) for item in value))
+    if isinstance(value, bytes):
+        return (7, value)
+    if isinstance(value, ObjectId):
+        return (8, value.binary)
+    if isinstance(value, datetime):
+        return (10, value if value.tzinfo else value.replace(tzinfo=timezone.utc))
+    if isinstance(value, Timestamp):
+        return (11, value.time, value.inc)
+    if isinstance(value, (Regex, re.Pattern)):
+        return (12, value.pattern)
+    if isinstance(value, MinKey):
+        return (0,)
+    if isinstance(value, MaxKey):
+        return (13,)
+    return (14, str(value))
+
+
+def _field_sort_key(value: Any, direction: int) -> tuple:
+    """Sort key of a field value, arrays sort by their smallest element ascending and their largest descending"""
+    if isinstance(value, list):
+        if not value:
+            return (1,)
+        keys = [sort_key(item) for item in value]
+        return min(keys) if direction == ASCENDING else max(keys)
+    return sort_key(value)
+
+
+class _Descending:
+    """Inverts the ordering of a sort key"""
+
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+SortSpec = list[tuple[str, int]]
+
+
+def sort_spec(key_or_list: Union[str, Mapping[str, int], Iterable[tuple[str, int]]], direction: Optional[int] = None) -> SortSpec:
+    """Normalize the sort arguments pymongo accepts into a list of (field, direction) pairs"""
+    if isinstance(key_or_list, str):
+        return [(key_or_list, ASCENDING if direction is None else direction)]
+    if isinstance(key_or_list, Mapping):
+        return list(key_or_list.items())
+    return [(item, ASCENDING) if isinstance(item, str) else tuple(item) for item in key_or_list]
+
+
+def document_sort_key(spec: SortSpec) -> Callable[[Any], tuple]:
+    """Key function sorting documents by a sort spec"""
+    def key(document):
+        keys = []
+        for path, direction in spec:
+            field_key = _field_sort_key(get_path(document, path), direction)
+            keys.append(field_key if direction == ASCENDING else _Descending(field_key))
+        return tuple(keys)
+    return key
+
+
+def top_k(documents: Iterable[Any], k: int, key: Callable[[Any], Any]) -> list[Any]:
+    """The first k documents in key order, stable, keeping only k documents in memory"""
+    return heapq.nsmallest(k, documents, key=key)
+
+
+class TopK:
+    """Incremental stable top-k selection for documents arriving one at a time"""
+
+    def __init__(self, k: int, key: Callable[[Any], Any]):
+        self.k = k
+        self.key = key
+        self._heap: list[tuple[_Descending, Any]] = []
+        self._counter = count()
+
+    def push(self, document: Any):
+        # the heap root is the largest (key, arrival) pair kept, evicted when a smaller one arrives
+        entry = (_Descending((self.key(document), next(self._counter))), document)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif self._heap and entry[0].key < self._heap[0][0].key:
+            heapq.heapreplace(self._heap, entry)
+
+    def result(self) -> list[Any]:
+        return [document for _, document in sorted(self._heap, key=lambda entry: entry[0].key)]
+
+
+def _include(source: Mapping, target: dict, parts: list[str]):
+    head = parts[0]
+    if head not in source:
+        return
+    if len(parts) == 1:
+        target[head] = source[head]
+        return
+    value = source[head]
+    if isinstance(value, Mapping):
+        _include(value, target.setdefault(head, {}), parts[1:])
+    elif isinstance(value, list):
+        existing = target.setdefault(head, [{} for item in value if isinstance(item, Mapping)])
+        for item, projected in zip((item for item in value if isinstance(item, Mapping)), existing):
+            _include(item, projected, parts[1:])
+
+
+def _exclude(document: Mapping, parts: list[str]) -> dict:
+    result = dict(document)
+    head = parts[0]
+    if head not in result:
+        return result
+    if len(parts) == 1:
+        del result[head]
+    elif isinstance(result[head], Mapping):
+        result[head] = _exclude(result[head], parts[1:])
+    elif isinstance(result[head], list):
+        result[head] = [_exclude(item, parts[1:]) if isinstance(item, Mapping) else item for item in result[head]]
+    return result
+
+
+def project(document: Mapping, projection: Union[Mapping[str, Any], Iterable[str], None]) -> Mapping:
+    """Apply an inclusion or exclusion projection to a document, _id is included unless excluded explicitly"""
+    if not projection:
+        return document
+    if not isinstance(projection, Mapping):
+        projection = {field: 1 for field in projection}
+    include_id = bool(projection.get("_id", True))
+    fields = {path: value for path, value in projection.items() if path != "_id"}
+    if any(fields.values()):
+        result = {"_id": document["_id"]} if include_id and "_id" in document else {}
+        for path, value in fields.items():
+            if value:
+                _include(document, result, path.split("."))
+        return result
+    result = dict(document)
+    for path in fields:
+        result = _exclude(result, path.split("."))
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def copy_document(value: Any) -> Any:
+    """Copy the dicts and lists of a document, immutable leaf values are shared"""
+    if isinstance(value, dict):
+        return {key: copy_document(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_document(item) for item in value]
+    return value
+
+
+def set_path(document: dict, path: str, value: Any):
+    """Set a dotted path in a document, creating embedded documents on the way"""
+    *parents, last = path.split(".")
+    target = document
+    for part in parents:
+        if isinstance(target, list):
+            target = target[int(part)]
+        else:
+            target = target.setdefault(part, {})
+    if isinstance(target, list):
+        target[int(last)] = value
+    else:
+        target[last] = value
+
+
+def hashable(value: Any) -> Any:
+    """Hashable key for a value of any BSON type, equal values give equal keys and booleans differ from numbers"""
+    if isinstance(value, bool):
+        return (bool, value)
+    if isinstance(value, Mapping):
+        return tuple((key, hashable(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return (list, tuple(hashable(item) for item in value))
+    if isinstance(value, Regex):
+        return (Regex, value.pattern, value.flags)
+    return value
+
+
+def values_equal(value: Any, expected: Any) -> bool:
+    """Equality of two BSON values, booleans never equal numbers"""
+    return value == expected and isinstance(value, bool) is isinstance(expected, bool)
+
+
+def _path_values(value: Any, parts: list[str]) -> Iterator[Any]:
+    """Values at a path for matching, traversing arrays of embedded documents implicitly, MISSING where absent"""
+    if not parts:
+        yield value
+        return
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, Mapping):
+        yield from _path_values(value.get(head, MISSING), rest)
+    elif isinstance(value, list):
+        if head.isdigit():
+            index = int(head)
+            yield from _path_values(value[index] if index < len(value) else MISSING, rest)
+        for item in value:
+            if isinstance(item, Mapping):
+                yield from _path_values(item, parts)
+    else:
+        yield MISSING
+
+
+def path_values(document: Any, path: str) -> list:
+    """All values a filter on path looks at, MISSING where a traversed embedded document lacks the field"""
+    return list(_path_values(document, path.split(".")))
+
+
+def _getter(path: str) -> Callable[[Any], list]:
+    if "." not in path:
+        return lambda document: [document.get(path, MISSING)]
+    parts = path.split(".")
+    return lambda document: list(_path_values(document, parts))
+
+
+ValuesTest = Callable[[list], bool]
+
+
+def _elementwise(test: Callable[[Any], bool]) -> ValuesTest:
+    """Test the values at a path and the elements of the arrays among them"""
+    def values_test(values):
+        for value in values:
+            if test(value):
+                return True
+            if isinstance(value, list):
+                for item in value:
+                    if test(item):
+                        return True
+        return False
+    return values_test
+
+
+def _regex(pattern: Any, options: str = "") -> re.Pattern:
+    if isinstance(pattern, re.Pattern) and not options:
+        return pattern
+    if isinstance(pattern, Regex):
+        pattern = pattern.try_compile()
+    flags = pattern.flags if isinstance(pattern, re.Pattern) else 0
+    for option in options:
+        flags |= {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL, "x": re.VERBOSE}.get(option, 0)
+    return re.compile(pattern.pattern if isinstance(pattern, re.Pattern) else pattern, flags)
+
+
+def _regex_test(pattern: Any, options: str = "") -> Callable[[Any], bool]:
+    compiled = _regex(pattern, options)
+    return lambda value: isinstance(value, str) and compiled.search(value) is not None
+
+
+def _equality_test(expected: Any) -> ValuesTest:
+    """A field equals a value if it or any of its array elements does, null also matches missing fields"""
+    if isinstance(expected, (re.Pattern, Regex)):
+        return _elementwise(_regex_test(expected))
+    if expected is None:
+        return _elementwise(lambda value: value is None or value is MISSING)
+    return _elementwise(lambda value: values_equal(value, expected))
+
+
+def _in_test(expected: list) -> ValuesTest:
+    patterns = [_regex_test(value) for value in expected if isinstance(value, (re.Pattern, Regex))]
+    keys = {hashable(value) for value in expected if not isinstance(value, (re.Pattern, Regex))}
+    matches_missing = hashable(None) in keys
+
+    def test(value):
+        if value is MISSING:
+            return matches_missing
+        try:
+            if hashable(value) in keys:
+                return True
+        except TypeError:
+            pass
+        return any(pattern(value) for pattern in patterns)
+    return _elementwise(test)
+
+
+_COMPARISONS = {
+    "$gt": lambda key, expected: key > expected,
+    "$gte": lambda key, expected: key >= expected,
+    "$lt": lambda key, expected: key < expected,
+    "$lte": lambda key, expected: key <= expected,
+}
+RANGE_OPERATORS = frozenset(_COMPARISONS)
+
+
+def _comparison_test(operator: str, expected: Any) -> ValuesTest:
+    """Compare with a value of the same BSON type"""
+    compare = _COMPARISONS[operator]
+    expected_key = sort_key(expected)
+    rank = expected_key[0]
+
+    def test(value):
+        key = sort_key(value)
+        return key[0] == rank and compare(key, expected_key)
+    return _elementwise(test)
+
+
+_TYPES = {
+    "double": (1, lambda value: isinstance(value, float)),
+    "string": (2, lambda value: isinstance(value, str)),
+    "object": (3, lambda value: isinstance(value, Mapping)),
+    "array": (4, lambda value: isinstance(value, list)),
+    "binData": (5, lambda value: isinstance(value, bytes)),
+    "objectId": (7, lambda value: isinstance(value, ObjectId)),
+    "bool": (8, lambda value: isinstance(value, bool)),
+    "date": (9, lambda value: isinstance(value, datetime)),
+    "null": (10, lambda value: value is None),
+    "regex": (11, lambda value: isinstance(value, (re.Pattern, Regex))),
+    "int": (16, lambda value: isinstance(value, int) and not isinstance(value, bool) and -2 ** 31 <= value < 2 ** 31),
+    "timestamp": (17, lambda value: isinstance(value, Timestamp)),
+    "long": (18, lambda value: isinstance(value, int) and not isinstance(value, bool) and not -2 ** 31 <= value < 2 ** 31),
+    "decimal": (19, lambda value: isinstance(value, Decimal128)),
+    "minKey": (-1, lambda value: isinstance(value, MinKey)),
+    "maxKey": (127, lambda value: isinstance(value, MaxKey)),
+}
+_TYPES["number"] = (None, lambda value: any(_TYPES[alias][1](value) for alias in ("double", "int", "long", "decimal")))
+_TYPE_CHECKS = {code: check for code, check in _TYPES.values() if code is not None}
+
+
+def _type_test(expected: Any) -> ValuesTest:
+    checks = []
+    for alias in expected if isinstance(expected, list) else [expected]:
+        check = _TYPES[alias][1] if isinstance(alias, str) else _TYPE_CHECKS.get(alias)
+        if check is None:
+            raise NotImplementedError(f"$type {alias} is not supported")
+        checks.append(check)
+    return _elementwise(lambda value: value is not MISSING and any(check(value) for check in checks))
+
+
+def _elem_match(matches: Callable[[Any], bool]) -> ValuesTest:
+    return lambda values: any(isinstance(value, list) and any(matches(item) for item in value) for value in values)
+
+
+def _elem_match_test(expected: Mapping[str, Any]) -> ValuesTest:
+    values = []
+    if is_operator_expression(expected):
+        _expression_shape(expected, values)
+    else:
+        _filter_shape(expected, values)
+    return _elem_match_template(expected)(iter(values))
+
+
+def _all_test(expected: list) -> ValuesTest:
+    if not expected:
+        return lambda values: False
+    tests = [
+        _elem_match_test(value["$elemMatch"]) if isinstance(value, Mapping) and "$elemMatch" in value else _equality_test(value)
+        for value in expected
+    ]
+    return lambda values: all(test(values) for test in tests)
+
+
+def _negate(test: ValuesTest) -> ValuesTest:
+    return lambda values: not test(values)
+
+
+def _operator_test(operator: str, expected: Any, expression: Mapping[str, Any]) -> Optional[ValuesTest]:
+    if operator == "$eq":
+        return _equality_test(expected)
+    if operator == "$ne":
+        return _negate(_equality_test(expected))
+    if operator in _COMPARISONS:
+        return _comparison_test(operator, expected)
+    if operator == "$in":
+        return _in_test(expected)
+    if operator == "$nin":
+        return _negate(_in_test(expected))
+    if operator == "$exists":
+        return lambda values: any(value is not MISSING for value in values) is bool(expected)
+    if operator == "$type":
+        return _type_test(expected)
+    if operator == "$size":
+        return lambda values: any(isinstance(value, list) and len(value) == expected for value in values)
+    if operator == "$all":
+        return _all_test(expected)
+    if operator == "$elemMatch":
+        return _elem_match_test(expected)
+    if operator == "$regex":
+        return _elementwise(_regex_test(expected, expression.get("$options", "")))
+    if operator == "$options":
+        if "$regex" not in expression:
+            raise ValueError("$options needs a $regex")
+        return None
+    if operator == "$mod":
+        divisor, remainder = expected
+        return _elementwise(lambda value: isinstance(value, (int, float)) and not isinstance(value, bool) and int(value) % divisor == remainder)
+    if operator == "$not":
+        # operator expressions under $not are part of the filter's shape, see _expression_template()
+        if not isinstance(expected, (re.Pattern, Regex)):
+            raise ValueError("$not needs a regex or an operator expression")
+        return _negate(_elementwise(_regex_test(expected)))
+    raise NotImplementedError(f"query operator {operator} is not supported")
+
+
+def is_operator_expression(value: Any) -> bool:
+    """Whether a filter value is an operator expression such as {"$gt": 1} rather than a value to equal"""
+    return isinstance(value, Mapping) and bool(value) and all(isinstance(key, str) and key.startswith("$") for key in value)
+
+
+def has_operators(filter: Any) -> bool:
+    """Whether a filter uses query operators, either top level ones like $or or operator expressions on fields"""
+    return isinstance(filter, Mapping) and any(
+        isinstance(key, str) and key.startswith("$") or is_operator_expression(value) for key, value in filter.items()
+    )
+
+
+def _all(predicates: list[Callable[[Any], bool]]) -> Callable[[Any], bool]:
+    if not predicates:
+        return lambda document: True
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda document: all(predicate(document) for predicate in predicates)
+
+
+def _logical(operator: str, clauses: list[Callable[[Any], bool]]) -> Callable[[Any], bool]:
+    if operator == "$and":
+        return _all(clauses)
+    if operator == "$or":
+        return lambda document: any(clause(document) for clause in clauses)
+    return lambda document: not any(clause(document) for clause in clauses)
+
+
+# A compiled filter shape, binds the values of a filter of that shape, in shape order, to a predicate or test
+Template = Callable[[Iterator[Any]], Any]
+
+
+def _filter_shape(filter: Mapping[str, Any], values: list) -> tuple:
+    """The field paths and operators of a filter, its values are appended to values in the order templates bind them"""
+    shape = []
+    for key, expected in filter.items():
+        if key in ("$and", "$or", "$nor"):
+            shape.append((key, tuple(_filter_shape(clause, values) for clause in expected)))
+        elif key.startswith("$"):
+            shape.append(key)
+        elif is_operator_expression(expected):
+            shape.append((key, _expression_shape(expected, values)))
+        else:
+            shape.append(key)
+            values.append(expected)
+    return tuple(shape)
+
+
+def _expression_shape(expression: Mapping[str, Any], values: list) -> tuple:
+    shape = []
+    for operator, expected in expression.items():
+        if operator == "$not" and is_operator_expression(expected):
+            shape.append((operator, _expression_shape(expected, values)))
+        elif operator == "$elemMatch" and isinstance(expected, Mapping):
+            if is_operator_expression(expected):
+                shape.append((operator, True, _expression_shape(expected, values)))
+            else:
+                shape.append((operator, False, _filter_shape(expected, values)))
+        else:
+            shape.append(operator)
+            values.append(expected)
+    return tuple(shape)
+
+
+def _field_template(path: str) -> Template:
+    getter = _getter(path)
+
+    def bind(values):
+        expected = next(values)
+        if "." not in path and not isinstance(expected, (Mapping, list, re.Pattern, Regex)) and expected is not None:
+            # plain equality on a top level field, by far the most common case
+            def equals(document):
+                value = document.get(path, MISSING)
+                if isinstance(value, list):
+                    return any(values_equal(item, expected) for item in value)
+                return values_equal(value, expected)
+            return equals
+        test = _equality_test(expected)
+        return lambda document: test(getter(document))
+    return bind
+
+
+def _operators_field_template(path: str, expression: Mapping[str, Any]) -> Template:
+    getter = _getter(path)
+    template = _expression_template(expression)
+
+    def bind(values):
+        test = template(values)
+        return lambda document: test(getter(document))
+    return bind
+
+
+def _expression_template(expression: Mapping[str, Any]) -> Template:
+    nested = {}
+    for operator, expected in expression.items():
+        if operator == "$not" and is_operator_expression(expected):
+            nested[operator] = _expression_template(expected)
+        elif operator == "$elemMatch" and isinstance(expected, Mapping):
+            nested[operator] = _elem_match_template(expected)
+    operators = list(expression)
+
+    def bind(values):
+        bound = {operator: nested[operator](values) if operator in nested else next(values) for operator in operators}
+        tests = []
+        for operator, expected in bound.items():
+            if operator not in nested:
+                test = _operator_test(operator, expected, bound)
+            else:
+                test = _negate(expected) if operator == "$not" else expected
+            if test is not None:
+                tests.append(test)
+        if len(tests) == 1:
+            return tests[0]
+        return lambda values: all(test(values) for test in tests)
+    return bind
+
+
+def _elem_match_template(expected: Mapping[str, Any]) -> Template:
+    if is_operator_expression(expected):
+        item_template = _expression_template(expected)
+
+        def bind(values):
+            item_test = item_template(values)
+            return _elem_match(lambda item: item_test([item]))
+        return bind
+    document_template = _filter_template(expected)
+
+    def bind(values):
+        document_predicate = document_template(values)
+        return _elem_match(lambda item: isinstance(item, Mapping) and document_predicate(item))
+    return bind
+
+
+def _filter_template(filter: Mapping[str, Any]) -> Template:
+    templates = []
+    for key, expected in filter.items():
+        if key in ("$and", "$or", "$nor"):
+            clauses = [_filter_template(clause) for clause in expected]
+            templates.append(lambda values, key=key, clauses=clauses: _logical(key, [clause(values) for clause in clauses]))
+        elif key == "$comment":
+            continue
+        elif key.startswith("$"):
+            raise NotImplementedError(f"query operator {key} is not supported")
+        elif is_operator_expression(expected):
+            templates.append(_operators_field_template(key, expected))
+        else:
+            templates.append(_field_template(key))
+    return lambda values: _all([template(values) for template in templates])
+
+
+_FILTER_CACHE_SIZE = 1024
+# Compiled templates by the shape of their filter, evicted oldest first
+_filter_cache: dict[tuple, Template] = {}
+
+
+def compile_filter(filter: Optional[Mapping[str, Any]]) -> Callable[[Any], bool]:
+    """
+    Compile a query filter into a predicate over documents.
+
+    Supports comparison, logical, element, array, regex and $mod operators on dotted paths, which traverse
+    arrays of embedded documents. A field matches a value if it or any of its array elements equals the
+    value, comparison operators only match values of the same BSON type. Filters are compiled once per
+    shape, their field paths and operators, and the values of a filter are bound to the compiled shape.
+    """
+    if not filter:
+        return _all([])
+    values = []
+    shape = _filter_shape(filter, values)
+    template = _filter_cache.get(shape)
+    if template is not None:
+        return template(iter(values))
+    template = _filter_template(filter)
+    predicate = template(iter(values))
+    if len(_filter_cache) >= _FILTER_CACHE_SIZE:
+        del _filter_cache[next(iter(_filter_cache))]
+    _filter_cache[shape] = template
+    return predicate
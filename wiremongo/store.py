@@ -0,0 +1,489 @@
+import bisect
+import re
+from collections.abc import Mapping
+from itertools import islice, product
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from bson import ObjectId
+from bson.regex import Regex
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+from wiremongo.aggregation import run_pipeline
+from wiremongo.query import (
+    MISSING, RANGE_OPERATORS, SortSpec, compile_filter, copy_document, document_sort_key, get_path, hashable, is_operator_expression,
+    path_values, project, sort_key, sort_spec,
+)
+from wiremongo.update import (
+    UndoLog, apply_update, replace_document, revert, updated_fields, upsert_document, upsert_replacement, validate_replacement,
+    validate_update,
+)
+
+
+def _as_filter(filter: Any) -> Optional[Mapping[str, Any]]:
+    # find_one and friends accept a bare _id instead of a filter
+    return filter if filter is None or isinstance(filter, Mapping) else {"_id": filter}
+
+
+def _is_equality(value: Any) -> bool:
+    return not is_operator_expression(value) and not isinstance(value, (re.Pattern, Regex))
+
+
+def _bulk_write_details() -> dict:
+    return {
+        "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0,
+        "nRemoved": 0, "upserted": [],
+    }
+
+
+def _request_op(request: Any) -> Any:
+    """The op of a bulk write request as the server reports it in write errors"""
+    if isinstance(request, InsertOne):
+        return request._doc
+    if isinstance(request, (DeleteOne, DeleteMany)):
+        return {"q": request._filter, "limit": int(isinstance(request, DeleteOne))}
+    return {"q": request._filter, "u": request._doc, "multi": isinstance(request, UpdateMany), "upsert": bool(request._upsert)}
+
+
+def _write_error(error: WriteError, index: int, op: Any) -> dict:
+    """The writeErrors entry of a bulk write for a failed operation"""
+    return {"code": error.code, "errmsg": str(error), **(error.details or {}), "index": index, "op": op}
+
+
+class Index:
+    """
+    Secondary index over the fields of a key pattern.
+
+    Documents are kept in a hash table by the values of all fields, and in a list sorted by the value of
+    the first field for range lookups with bisect. Arrays are indexed by each of their elements and as a
+    whole, missing fields as null. Entries carry the insertion sequence of their document, so lookups
+    return documents in natural order.
+
+    Once an array was indexed, range lookups only use one bound: each bound may be satisfied by another
+    element of the array.
+
+    Unique indexes find duplicate keys with the same hash table.
+    """
+
+    def __init__(self, name: str, keys: SortSpec, unique: bool = False):
+        self.name = name
+        self.keys = keys
+        self.unique = unique
+        self.fields = [field for field, _ in keys]
+        self._hash: dict[tuple, dict[Any, int]] = {}
+        self._sorted: list[tuple[tuple, int]] = []
+        self._sorted_ids: list[Any] = []
+        self.multikey = False
+
+    def _field_values(self, document: Mapping, field: str) -> list:
+        values = []
+        found = path_values(document, field)
+        if len(found) > 1:
+            self.multikey = True
+        for value in found:
+            if value is MISSING:
+                values.append(None)
+            elif isinstance(value, list) and value:
+                self.multikey = True
+                values.extend(value)
+                values.append(value)
+            else:
+                values.append(value)
+        return values
+
+    def _hash_keys(self, document: Mapping) -> set[tuple]:
+        values = (self._field_values(document, field) for field in self.fields)
+        return {tuple(hashable(value) for value in combination) for combination in product(*values)}
+
+    def _sort_keys(self, document: Mapping) -> set[tuple]:
+        return {sort_key(value) for value in self._field_values(document, self.fields[0])}
+
+    def build(self, entries: Iterable[tuple[Any, int, Mapping]]):
+        """Index existing documents given as (key, sequence, document), sorting once"""
+        pairs = []
+        for key, sequence, document in entries:
+            for hash_key in self._hash_keys(document):
+                self._hash.setdefault(hash_key, {})[key] = sequence
+            pairs.extend(((value_key, sequence), key) for value_key in self._sort_keys(document))
+        pairs.sort(key=lambda pair: pair[0])
+        self._sorted = [entry for entry, _ in pairs]
+        self._sorted_ids = [key for _, key in pairs]
+
+    def add(self, key: Any, sequence: int, document: Mapping):
+        for hash_key in self._hash_keys(document):
+            self._hash.setdefault(hash_key, {})[key] = sequence
+        for value_key in self._sort_keys(document):
+            position = bisect.bisect_left(self._sorted, (value_key, sequence))
+            self._sorted.insert(position, (value_key, sequence))
+            self._sorted_ids.insert(position, key)
+
+    def remove(self, key: Any, sequence: int, document: Mapping):
+        for hash_key in self._hash_keys(document):
+            entries = self._hash.get(hash_key)
+            if entries is not None:
+                entries.pop(key, None)
+                if not entries:
+                    del self._hash[hash_key]
+        for value_key in self._sort_keys(document):
+            position = bisect.bisect_left(self._sorted, (value_key, sequence))
+            if position < len(self._sorted) and self._sorted[position] == (value_key, sequence):
+                del self._sorted[position]
+                del self._sorted_ids[position]
+
+    def conflict(self, key: Any, document: Mapping) -> Optional[dict]:
+        """The key value another document than key already has in the index, None if there is none"""
+        for combination in product(*(self._field_values(document, field) for field in self.fields)):
+            entries = self._hash.get(tuple(hashable(value) for value in combination))
+            if entries and (len(entries) > 1 or key not in entries):
+                return dict(zip(self.fields, combination))
+        return None
+
+    def lookup(self, values: list) -> dict[Any, int]:
+        """Documents whose fields equal values, as {key: sequence}"""
+        return self._hash.get(tuple(hashable(value) for value in values), {})
+
+    def lookup_range(self, operators: Mapping[str, Any]) -> Optional[dict[Any, int]]:
+        """Documents whose first field satisfies $eq, $in and range operators, None if none of them is given"""
+        if "$in" in operators or "$eq" in operators:
+            values = operators["$in"] if "$in" in operators else [operators["$eq"]]
+            if not all(_is_equality(value) for value in values):
+                return None
+            candidates = {}
+            for value in values:
+                candidates.update(self._hash_first(value))
+            return candidates
+        bounds = [(operator, sort_key(value)) for operator, value in operators.items() if operator in RANGE_OPERATORS]
+        if not bounds:
+            return None
+        if self.multikey:
+            bounds = bounds[:1]
+        low, high = 0, len(self._sorted)
+        for operator, value_key in bounds:
+            rank = value_key[0]
+            low = max(low, bisect.bisect_left(self._sorted, ((rank,),)))
+            high = min(high, bisect.bisect_left(self._sorted, ((rank + 1,),)))
+            if operator == "$gt":
+                low = max(low, bisect.bisect_left(self._sorted, (value_key, float("inf"))))
+            elif operator == "$gte":
+                low = max(low, bisect.bisect_left(self._sorted, (value_key,)))
+            elif operator == "$lt":
+                high = min(high, bisect.bisect_left(self._sorted, (value_key,)))
+            else:
+                high = min(high, bisect.bisect_left(self._sorted, (value_key, float("inf"))))
+        return {self._sorted_ids[position]: self._sorted[position][1] for position in range(low, high)}
+
+    def _hash_first(self, value: Any) -> dict[Any, int]:
+        if len(self.fields) == 1:
+            return self.lookup([value])
+        value_key = sort_key(value)
+        low = bisect.bisect_left(self._sorted, (value_key,))
+        high = bisect.bisect_left(self._sorted, (value_key, float("inf")))
+        return {self._sorted_ids[position]: self._sorted[position][1] for position in range(low, high)}
+
+
+class InMemoryCollection:
+    """
+    Documents of a collection kept in memory in insertion order, by _id.
+
+    Operations take the arguments of their pymongo counterparts and return pymongo result objects.
+    Documents are copied on the way in and out, so callers never share state with the store.
+    """
+
+    def __init__(self, name: str = "mock_collection", lookup: Optional[Callable[[str], "InMemoryCollection"]] = None):
+        """lookup resolves the names of other collections in the same database, for $lookup stages"""
+        self.name = name
+        self._lookup = lookup
+        self._documents: dict[Any, dict] = {}
+        # Insertion sequence of every document, index lookups return documents in this order
+        self._sequence: dict[Any, int] = {}
+        self._next_sequence = 0
+        self._indexes: dict[str, Index] = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def _duplicate_key_error(self, key_pattern: dict, key_value: dict, index_name: str) -> DuplicateKeyError:
+        dup_key = ", ".join(f"{field}: {value!r}" for field, value in key_value.items())
+        message = f"E11000 duplicate key error collection: {self.name} index: {index_name} dup key: {{ {dup_key} }}"
+        details = {"index": 0, "code": 11000, "errmsg": message, "keyPattern": key_pattern, "keyValue": key_value}
+        return DuplicateKeyError(message, 11000, details)
+
+    def _insert(self, document: dict) -> Any:
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        key = hashable(document["_id"])
+        if key in self._documents:
+            raise self._duplicate_key_error({"_id": 1}, {"_id": document["_id"]}, "_id_")
+        stored = copy_document(document)
+        self._check_unique(key, stored, self._indexes.values())
+        self._documents[key] = stored
+        sequence = self._sequence[key] = self._next_sequence
+        self._next_sequence += 1
+        for index in self._indexes.values():
+            index.add(key, sequence, stored)
+        return document["_id"]
+
+    def _check_unique(self, key: Any, document: Mapping, indexes: Iterable[Index]):
+        for index in indexes:
+            if index.unique:
+                key_value = index.conflict(key, document)
+                if key_value is not None:
+                    raise self._duplicate_key_error(dict(index.keys), key_value, index.name)
+
+    def _plan(self, filter: Optional[Mapping[str, Any]]) -> Optional[list[Any]]:
+        """Keys of the candidate documents for filter found by an index in natural order, None if no index applies"""
+        if not filter:
+            return None
+        if "_id" in filter and _is_equality(filter["_id"]):
+            # the documents themselves are the _id index
+            key = hashable(filter["_id"])
+            return [key] if key in self._documents else []
+        if not self._indexes:
+            return None
+        candidates = None
+        for index in self._indexes.values():
+            values = [filter.get(field, MISSING) for field in index.fields]
+            if all(value is not MISSING and _is_equality(value) for value in values):
+                candidates = index.lookup(values)
+                break
+        else:
+            for index in self._indexes.values():
+                value = filter.get(index.fields[0], MISSING)
+                if is_operator_expression(value):
+                    candidates = index.lookup_range(value)
+                    if candidates is not None:
+                        break
+        if candidates is None:
+            return None
+        return sorted(candidates, key=candidates.__getitem__)
+
+    def _matching(self, filter: Optional[Mapping[str, Any]]) -> Iterator[dict]:
+        """Stored documents matching filter in insertion order, not copied"""
+        filter = _as_filter(filter)
+        predicate = compile_filter(filter)
+        keys = self._plan(filter)
+        documents = list(self._documents.values()) if keys is None else [self._documents[key] for key in keys]
+        return (document for document in documents if predicate(document))
+
+    def _first(self, filter: Optional[Mapping[str, Any]], sort: Any = None) -> Optional[dict]:
+        documents = self._matching(filter)
+        if sort:
+            return min(documents, key=document_sort_key(sort_spec(sort)), default=None)
+        return next(documents, None)
+
+    def insert_one(self, document: dict, *args, **kwargs) -> InsertOneResult:
+        return InsertOneResult(self._insert(document), True)
+
+    def insert_many(self, documents: list[dict], ordered: bool = True, *args, **kwargs) -> InsertManyResult:
+        inserted_ids = []
+        errors = []
+        for index, document in enumerate(documents):
+            try:
+                inserted_ids.append(self._insert(document))
+            except WriteError as error:
+                errors.append(_write_error(error, index, document))
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({**_bulk_write_details(), "writeErrors": errors, "nInserted": len(inserted_ids)})
+        return InsertManyResult(inserted_ids, True)
+
+    def find(self, filter: Optional[Mapping[str, Any]] = None, *args, **kwargs) -> Iterator[dict]:
+        """Lazily copied documents matching filter, modifiers such as sort and projection are left to the cursor"""
+        return (copy_document(document) for document in self._matching(filter))
+
+    def find_one(self, filter: Any = None, projection: Any = None, *args, sort: Any = None, **kwargs) -> Optional[dict]:
+        document = self._first(filter, sort)
+        return None if document is None else project(copy_document(document), projection)
+
+    def count_documents(self, filter: Mapping[str, Any], skip: int = 0, limit: int = 0, **kwargs) -> int:
+        count = sum(1 for _ in self._matching(filter))
+        count = max(count - skip, 0)
+        return min(count, limit) if limit else count
+
+    def distinct(self, key: str, filter: Optional[Mapping[str, Any]] = None, **kwargs) -> list:
+        values = {}
+        for document in self._matching(filter):
+            value = get_path(document, key)
+            if value is MISSING:
+                continue
+            for item in value if isinstance(value, list) else (value,):
+                values.setdefault(hashable(item), item)
+        return list(values.values())
+
+    def _update_documents(self, documents: Iterable[dict], apply: Callable[[dict, UndoLog], bool], fields: Optional[set[str]] = None) -> Iterator[bool]:
+        """
+        Change stored documents in place with apply, yields whether each document changed.
+
+        fields are the top level fields apply may change, all of them if None, and only the indexes over them
+        are maintained. apply records its changes in an undo log, and a document whose change fails is reverted
+        with it, so every change is applied to a document completely or not at all.
+        """
+        indexes = [
+            index for index in self._indexes.values()
+            if fields is None or any(field.split(".", 1)[0] in fields for field in index.fields)
+        ]
+        unique = any(index.unique for index in indexes)
+        for document in documents:
+            undo: UndoLog = []
+            key = hashable(document["_id"])
+            sequence = self._sequence[key]
+            for index in indexes:
+                index.remove(key, sequence, document)
+            try:
+                modified = apply(document, undo)
+                if unique:
+                    self._check_unique(key, document, indexes)
+            except Exception:
+                revert(undo)
+                raise
+            finally:
+                for index in indexes:
+                    index.add(key, sequence, document)
+            yield modified
+
+    def _update(self, filter: Any, update: Mapping[str, Any], upsert: bool, multi: bool) -> tuple[int, int, Any]:
+        """Apply update to the matching documents, returns the matched and modified counts and the upserted _id"""
+        validate_update(update)
+        documents = list(islice(self._matching(filter), None if multi else 1))
+        if not documents and upsert:
+            return 0, 0, self._insert(upsert_document(_as_filter(filter), update))
+        return len(documents), sum(self._update_documents(documents, lambda document, undo: apply_update(document, update, undo=undo), updated_fields(update))), None
+
+    def _replace(self, filter: Any, replacement: Mapping[str, Any], upsert: bool) -> tuple[int, int, Any]:
+        """Replace the first matching document, returns the matched and modified counts and the upserted _id"""
+        validate_replacement(replacement)
+        documents = list(islice(self._matching(filter), 1))
+        if not documents and upsert:
+            return 0, 0, self._insert(upsert_replacement(_as_filter(filter), replacement))
+        return len(documents), sum(self._update_documents(documents, lambda document, undo: replace_document(document, replacement, undo))), None
+
+    @staticmethod
+    def _update_result(matched: int, modified: int, upserted_id: Any) -> UpdateResult:
+        raw_result = {"n": matched, "nModified": modified, "ok": 1.0, "updatedExisting": matched > 0}
+        if upserted_id is not None:
+            raw_result["upserted"] = upserted_id
+            raw_result["n"] = 1
+        return UpdateResult(raw_result, True)
+
+    def update_one(self, filter: Mapping[str, Any], update: Mapping[str, Any], upsert: bool = False, *args, **kwargs) -> UpdateResult:
+        return self._update_result(*self._update(filter, update, upsert, multi=False))
+
+    def update_many(self, filter: Mapping[str, Any], update: Mapping[str, Any], upsert: bool = False, *args, **kwargs) -> UpdateResult:
+        return self._update_result(*self._update(filter, update, upsert, multi=True))
+
+    def replace_one(self, filter: Mapping[str, Any], replacement: Mapping[str, Any], upsert: bool = False, *args, **kwargs) -> UpdateResult:
+        return self._update_result(*self._replace(filter, replacement, upsert))
+
+    def find_one_and_update(self, filter: Any, update: Mapping[str, Any], projection: Any = None, sort: Any = None, upsert: bool = False,
+                            return_document: bool = ReturnDocument.BEFORE, *args, **kwargs) -> Optional[dict]:
+        """Update the first matching document, returns a copy of it from before or after the update"""
+        validate_update(update)
+        document = self._first(filter, sort)
+        if document is None:
+            if not upsert:
+                return None
+            key = hashable(self._insert(upsert_document(_as_filter(filter), update)))
+            return project(copy_document(self._documents[key]), projection) if return_document else None
+        before = copy_document(document)
+        next(self._update_documents([document], lambda stored, undo: apply_update(stored, update, undo=undo), updated_fields(update)))
+        return project(copy_document(document) if return_document else before, projection)
+
+    def _delete(self, filter: Mapping[str, Any], multi: bool) -> DeleteResult:
+        keys = []
+        for document in self._matching(filter):
+            keys.append(hashable(document["_id"]))
+            if not multi:
+                break
+        for key in keys:
+            document = self._documents.pop(key)
+            sequence = self._sequence.pop(key)
+            for index in self._indexes.values():
+                index.remove(key, sequence, document)
+        return DeleteResult({"n": len(keys), "ok": 1.0}, True)
+
+    def delete_one(self, filter: Mapping[str, Any], *args, **kwargs) -> DeleteResult:
+        return self._delete(filter, multi=False)
+
+    def delete_many(self, filter: Mapping[str, Any], *args, **kwargs) -> DeleteResult:
+        return self._delete(filter, multi=True)
+
+    def bulk_write(self, requests: list[Any], ordered: bool = True, *args, **kwargs) -> BulkWriteResult:
+        """
+        Execute InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne and DeleteMany requests in one pass.
+
+        Requests are validated before the first one is applied, like pymongo does. An ordered bulk write stops at
+        the first write error, an unordered one collects them, BulkWriteError reports them with the counts so far.
+        """
+        for request in requests:
+            if isinstance(request, (UpdateOne, UpdateMany)):
+                try:
+                    validate_update(request._doc)
+                except WriteError:
+                    # rejected by the server, reported as a write error of the request when it is executed
+                    pass
+            elif isinstance(request, ReplaceOne):
+                validate_replacement(request._doc)
+            elif not isinstance(request, (InsertOne, DeleteOne, DeleteMany)):
+                raise TypeError(f"{request!r} is not a valid request")
+
+        details = _bulk_write_details()
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    details["nInserted"] += 1
+                    continue
+                if isinstance(request, (DeleteOne, DeleteMany)):
+                    details["nRemoved"] += self._delete(request._filter, multi=isinstance(request, DeleteMany)).deleted_count
+                    continue
+                if isinstance(request, ReplaceOne):
+                    matched, modified, upserted_id = self._replace(request._filter, request._doc, request._upsert)
+                else:
+                    matched, modified, upserted_id = self._update(request._filter, request._doc, request._upsert, isinstance(request, UpdateMany))
+                details["nMatched"] += matched
+                details["nModified"] += modified
+                if upserted_id is not None:
+                    details["nUpserted"] += 1
+                    details["upserted"].append({"index": index, "_id": upserted_id})
+            except WriteError as error:
+                details["writeErrors"].append(_write_error(error, index, _request_op(request)))
+                if ordered:
+                    break
+        if details["writeErrors"]:
+            raise BulkWriteError(details)
+        return BulkWriteResult(details, True)
+
+    def aggregate(self, pipeline: list[Mapping[str, Any]], *args, **kwargs) -> Iterator[dict]:
+        """Run a pipeline over copies of the documents, a leading $match selects documents through the indexes"""
+        pipeline = list(pipeline)
+        documents = self.find(pipeline.pop(0)["$match"]) if pipeline and "$match" in pipeline[0] else self.find()
+        lookup = (lambda name: self._lookup(name)._documents.values()) if self._lookup else None
+        return run_pipeline(documents, pipeline, lookup)
+
+    def create_index(self, keys: Any, *args, name: Optional[str] = None, unique: bool = False, **kwargs) -> str:
+        """
+        Build an index over the key pattern used by queries with equality and range filters, returns its name.
+
+        A unique index rejects documents with the key value of another document with DuplicateKeyError,
+        including the documents already stored.
+        """
+        spec = sort_spec(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in spec)
+        if name not in self._indexes:
+            index = Index(name, spec, unique)
+            index.build((key, self._sequence[key], document) for key, document in self._documents.items())
+            if unique:
+                for key, document in self._documents.items():
+                    self._check_unique(key, document, (index,))
+            self._indexes[name] = index
+        return name
+
+    def drop_indexes(self, *args, **kwargs):
+        self._indexes.clear()
+
+    def drop(self, *args, **kwargs):
+        self._documents.clear()
+        self._sequence.clear()
+        self._indexes.clear()
@@ -1,14 +1,223 @@
+import asyncio
 import glob
 import json
 import os
-from wiremongo import from_filemapping, WireMongo
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Mapping, Optional
 
+from wiremongo import from_filemapping, MongoMock, WireMongo, _build_mock, _normalize_filemapping
+from wiremongo.query import copy_document
 
-async def read_filemappings(wiremongo: WireMongo):
-    project_root = os.getcwd()
-    resources_dir = os.path.join(project_root, 'tests', 'resources', 'mappings')
-    mocks = list()
-    for file_path in glob.glob(os.path.join(resources_dir, '*.json')):
-        with open(file_path, "r") as file:
-            mocks.append(from_filemapping(json.load(file)))
-    wiremongo.mock(*mocks).build()
+BUNDLE_VERSION = 2
+
+MAPPING_CACHE_SIZE = 10_000
+
+# Parsed mappings by file path, stored pickled together with the (mtime, size) stamp of the file
+# so that every load hands out fresh objects and changed files are parsed again. Holds at most
+# MAPPING_CACHE_SIZE files besides those of the latest load, the oldest entries are evicted first.
+_mapping_cache: dict[str, tuple[tuple[int, int], bytes]] = {}
+
+
+def _stamp(file_path: str) -> tuple[int, int]:
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _read_mapping(file_path: str, cache: dict[str, tuple[tuple[int, int], bytes]]) -> tuple[Mapping[str, Any], bool]:
+    """Read a single mapping file through the cache, returns the mapping and whether it had to be parsed"""
+    stamp = _stamp(file_path)
+    cached = cache.get(file_path)
+    if cached is not None and cached[0] == stamp:
+        return pickle.loads(cached[1]), False
+    with open(file_path, "rb") as file:
+        mapping = json.loads(file.read())
+    cache[file_path] = (stamp, pickle.dumps(mapping, pickle.HIGHEST_PROTOCOL))
+    return mapping, True
+
+
+def _evict_mappings(cache: dict[str, tuple[tuple[int, int], bytes]], keep: list[str]):
+    """Evict the oldest entries beyond MAPPING_CACHE_SIZE, except those of the files in keep"""
+    excess = len(cache) - max(MAPPING_CACHE_SIZE, len(keep))
+    if excess <= 0:
+        return
+    kept = set(keep)
+    for file_path in [file_path for file_path in cache if file_path not in kept][:excess]:
+        del cache[file_path]
+
+
+def _load_cache_file(cache_file: str) -> dict[str, tuple[tuple[int, int], bytes]]:
+    try:
+        with open(cache_file, "rb") as file:
+            cache = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _write_pickle_file(file_path: str, data: dict):
+    temp_file = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_file, "wb") as file:
+        pickle.dump(data, file, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, file_path)
+
+
+class MappingBundle:
+    """
+    Precompiled mapping files, see `compile_mappings()`.
+
+    Every mapping is kept as its cmd and normalized builder calls, so loading a bundle skips parsing JSON,
+    and materializing a mock skips normalizing its mapping. All mappings are read when the bundle is loaded.
+    An index by (database, collection, cmd) allows materializing a subset of the mappings.
+    """
+
+    def __init__(self, sources: dict[str, tuple[int, int]], specs: list[tuple[str, list[tuple[str, list, dict]]]], index: dict[tuple[Optional[str], Optional[str], str], list[int]]):
+        self.sources = sources
+        self.specs = specs
+        self.index = index
+
+    @classmethod
+    def load(cls, bundle_path: str) -> "MappingBundle":
+        """Load a bundle with a single read, raises ValueError for bundles of another format version"""
+        with open(bundle_path, "rb") as file:
+            data = pickle.loads(file.read())
+        if not isinstance(data, dict) or data.get("version") != BUNDLE_VERSION:
+            raise ValueError(f"{bundle_path} is not a wiremongo mapping bundle of version {BUNDLE_VERSION}")
+        return cls(data["sources"], data["specs"], data["index"])
+
+    def save(self, bundle_path: str):
+        data = {"version": BUNDLE_VERSION, "sources": self.sources, "specs": self.specs, "index": self.index}
+        _write_pickle_file(bundle_path, data)
+
+    def is_fresh(self, file_paths: list[str]) -> bool:
+        """Check that the bundle was compiled from exactly these files in their current state"""
+        if len(file_paths) != len(self.sources):
+            return False
+        try:
+            return all(self.sources.get(file_path) == _stamp(file_path) for file_path in file_paths)
+        except OSError:
+            return False
+
+    def materialize(self, database: Optional[str] = None, collection: Optional[str] = None, cmd: Optional[str] = None) -> list[MongoMock]:
+        """
+        Create mocks for the mappings matching the given database, collection and cmd, all of them by default.
+
+        Every mock gets its own copies of the mapping's values.
+        """
+        if database is None and collection is None and cmd is None:
+            positions = range(len(self.specs))
+        else:
+            positions = sorted(
+                position
+                for (db, coll, command), entries in self.index.items()
+                if (database is None or db == database) and (collection is None or coll == collection) and (cmd is None or command == cmd)
+                for position in entries
+            )
+        mocks = []
+        for position in positions:
+            cmd, calls = self.specs[position]
+            mocks.append(_build_mock(cmd, [(method, copy_document(args), copy_document(kwargs)) for method, args, kwargs in calls]))
+        return mocks
+
+    def __len__(self):
+        return len(self.specs)
+
+
+def _spec_target(cmd: str, calls: list[tuple[str, list, dict]]) -> tuple[Optional[str], Optional[str], str]:
+    targets = {method: args[0] for method, args, _ in calls if method in ("with_database", "with_collection") and args}
+    return targets.get("with_database"), targets.get("with_collection"), cmd
+
+
+def compile_mappings(mappings_dir: str, bundle_path: Optional[str] = None, pattern: str = "*.json") -> MappingBundle:
+    """
+    Compile the mapping files of a directory into a MappingBundle, written to bundle_path if given.
+
+    Mappings keep the sorted path order `read_filemappings()` registers them in.
+    """
+    file_paths = sorted(glob.glob(os.path.join(mappings_dir, pattern)))
+    sources = {}
+    specs = []
+    index: dict[tuple[Optional[str], Optional[str], str], list[int]] = {}
+    for position, file_path in enumerate(file_paths):
+        sources[file_path] = _stamp(file_path)
+        with open(file_path, "rb") as file:
+            cmd, calls = _normalize_filemapping(json.loads(file.read()))
+        specs.append((cmd, calls))
+        index.setdefault(_spec_target(cmd, calls), []).append(position)
+    bundle = MappingBundle(sources, specs, index)
+    if bundle_path:
+        bundle.save(bundle_path)
+    return bundle
+
+
+def _load_bundle(bundle_path: str, resources_dir: str, pattern: str) -> MappingBundle:
+    """Load a bundle if it is still fresh, otherwise compile it again from the mapping files"""
+    file_paths = sorted(glob.glob(os.path.join(resources_dir, pattern)))
+    try:
+        bundle = MappingBundle.load(bundle_path)
+        if bundle.is_fresh(file_paths):
+            return bundle
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+    return compile_mappings(resources_dir, bundle_path, pattern)
+
+
+async def read_filemappings(
+        wiremongo: WireMongo,
+        mappings_dir: Optional[str] = None,
+        pattern: str = "*.json",
+        max_workers: Optional[int] = None,
+        cache_file: Optional[str] = None,
+        bundle: Optional[str] = None):
+    """
+    Load mock mappings from JSON files and register them with wiremongo.
+
+    Parameters:
+    - wiremongo: The WireMongo instance to register the mocks with.
+    - mappings_dir: Directory holding the mappings, `tests/resources/mappings` below the working directory by default.
+    - pattern: Glob pattern selecting the mapping files within mappings_dir.
+    - max_workers: Number of threads reading files concurrently, the ThreadPoolExecutor default if None.
+    - cache_file: Optional file persisting parsed mappings between sessions, unchanged files are not parsed again.
+      It only keeps the mappings of the files loaded by this call.
+    - bundle: Optional path of a bundle compiled by `compile_mappings()`. It is loaded with a single read while
+      it is fresh, and compiled again from the mapping files otherwise. Takes precedence over cache_file.
+
+    Files are registered in sorted path order.
+    """
+    resources_dir = mappings_dir or os.path.join(os.getcwd(), 'tests', 'resources', 'mappings')
+    if bundle:
+        mapping_bundle = await asyncio.to_thread(_load_bundle, bundle, resources_dir, pattern)
+        wiremongo.mock(*mapping_bundle.materialize()).build()
+        return
+
+    cache = _mapping_cache
+    file_paths = sorted(await asyncio.to_thread(glob.glob, os.path.join(resources_dir, pattern)))
+    persisted = {}
+    if cache_file:
+        persisted = await asyncio.to_thread(_load_cache_file, cache_file)
+        for file_path in file_paths:
+            if file_path in persisted:
+                cache.setdefault(file_path, persisted[file_path])
+
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = await asyncio.gather(*(loop.run_in_executor(executor, _read_mapping, file_path, cache) for file_path in file_paths))
+    _evict_mappings(cache, file_paths)
+
+    if cache_file and (any(parsed for _, parsed in results) or persisted.keys() != set(file_paths)):
+        entries = {file_path: cache[file_path] for file_path in file_paths}
+        await asyncio.to_thread(_write_pickle_file, cache_file, entries)
+
+    wiremongo.mock(*(from_filemapping(mapping) for mapping, _ in results)).build()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile wiremongo JSON mappings into a single bundle file")
+    parser.add_argument("mappings_dir", help="directory holding the JSON mapping files")
+    parser.add_argument("bundle_path", help="path of the bundle file to write")
+    parser.add_argument("--pattern", default="*.json", help="glob pattern selecting the mapping files")
+    arguments = parser.parse_args()
+    compiled = compile_mappings(arguments.mappings_dir, arguments.bundle_path, arguments.pattern)
+    print(f"compiled {len(compiled)} mappings into {arguments.bundle_path}")
@@ -0,0 +1,407 @@
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from bson.timestamp import Timestamp
+from pymongo.errors import WriteError
+
+from wiremongo.query import MISSING, compile_filter, copy_document, document_sort_key, hashable, is_operator_expression, sort_key, values_equal
+
+UPDATE_OPERATORS = frozenset((
+    "$set", "$unset", "$inc", "$mul", "$min", "$max", "$push", "$addToSet", "$pull", "$pop", "$rename", "$setOnInsert", "$currentDate",
+))
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _validate_path(path: Any):
+    if not isinstance(path, str) or not path:
+        raise WriteError(f"An empty update path is not valid: {path!r}", 56)
+    for part in path.split("."):
+        if not part:
+            raise WriteError(f"The update path '{path}' contains an empty field name, which is not allowed.", 56)
+        if part.startswith("$"):
+            raise NotImplementedError(f"positional update paths such as '{path}' are not supported")
+
+
+def _validate_push(operator: str, path: str, value: Any):
+    if not (isinstance(value, Mapping) and "$each" in value):
+        return
+    allowed = {"$each", "$position", "$sort", "$slice"} if operator == "$push" else {"$each"}
+    for modifier in value:
+        if modifier not in allowed:
+            raise WriteError(f"Unrecognized clause in {operator}: {modifier}", 2)
+    if not isinstance(value["$each"], list):
+        raise WriteError(f"The argument to $each in {operator} must be an array but it was of type: {type(value['$each']).__name__}", 2)
+    for modifier in ("$position", "$slice"):
+        if modifier in value and not _is_int(value[modifier]):
+            raise WriteError(f"The value for {modifier} must be an integer value but was given type: {type(value[modifier]).__name__}", 2)
+    if "$sort" in value:
+        order = value["$sort"]
+        directions = order.values() if isinstance(order, Mapping) and order else [order]
+        if not all(direction in (1, -1) and not isinstance(direction, bool) for direction in directions):
+            raise WriteError(f"The $sort is invalid: use 1/-1 to sort the whole element, or {{field:1/-1}} to sort embedded fields: {path}", 2)
+
+
+def validate_update(update: Any):
+    """
+    Reject replacement documents, unsupported operators and malformed operands the way pymongo and the server do.
+
+    Everything that can be checked without the document is checked here, before an update changes anything.
+    """
+    if not isinstance(update, Mapping) or not update:
+        raise ValueError("update must be a non-empty document of update operators")
+    for operator, changes in update.items():
+        if not operator.startswith("$"):
+            raise ValueError("update only works with $ operators")
+        if operator not in UPDATE_OPERATORS:
+            raise NotImplementedError(f"update operator {operator} is not supported")
+        if not isinstance(changes, Mapping):
+            raise WriteError(f"Modifiers operate on fields but we found type {type(changes).__name__} instead.", 9)
+        for path, value in changes.items():
+            _validate_path(path)
+            if operator == "$rename":
+                if not isinstance(value, str):
+                    raise WriteError(f"The 'to' field for $rename must be a string: {path}: {value!r}", 2)
+                _validate_path(value)
+            elif operator in ("$inc", "$mul"):
+                _number(value, operator, path)
+            elif operator == "$pop" and value not in (1, -1):
+                raise WriteError(f"$pop expects 1 or -1, found: {value!r}", 9)
+            elif operator in ("$push", "$addToSet"):
+                _validate_push(operator, path, value)
+
+
+def validate_replacement(replacement: Any):
+    """Reject replacement documents with update operators like pymongo does"""
+    if not isinstance(replacement, Mapping):
+        raise TypeError("replacement must be an instance of dict")
+    if any(field.startswith("$") for field in replacement):
+        raise ValueError("replacement can not include $ operators")
+
+
+def updated_fields(update: Mapping[str, Any]) -> set[str]:
+    """Top level fields an update may change"""
+    fields = set()
+    for operator, changes in update.items():
+        for path, value in changes.items():
+            fields.add(path.split(".", 1)[0])
+            if operator == "$rename":
+                fields.add(value.split(".", 1)[0])
+    return fields
+
+
+# Actions undoing the changes of an update, in the order the changes were made, see revert()
+UndoLog = list[Callable[[], None]]
+
+
+def revert(undo: UndoLog):
+    """Undo the changes recorded by apply_update() or replace_document(), the last one first"""
+    while undo:
+        undo.pop()()
+
+
+def _parent(document: dict, parts: list[str], create: bool, undo: Optional[UndoLog] = None) -> Any:
+    """The container holding the last part of a path, None if it does not exist and create is False"""
+    target = document
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            if not part.isdigit():
+                raise WriteError(f"Cannot create field '{part}' in element {{{parts[0]}: {target!r}}}", 28)
+            index = int(part)
+            if index >= len(target) and not create:
+                return None
+            if create and (index >= len(target) or target[index] is None):
+                _put(target, part, {}, undo)
+            target = target[index]
+        elif isinstance(target, dict):
+            if part not in target:
+                if not create:
+                    return None
+                _put(target, part, {}, undo)
+            target = target[part]
+        else:
+            if create:
+                raise WriteError(f"Cannot create field '{part}' in element {{{parts[0]}: {target!r}}}", 28)
+            return None
+    if not isinstance(target, (dict, list)):
+        if create:
+            raise WriteError(f"Cannot create field '{parts[-1]}' in element {target!r}", 28)
+        return None
+    return target
+
+
+def _get(container: Any, key: str) -> Any:
+    if isinstance(container, list):
+        index = int(key) if key.isdigit() else len(container)
+        return container[index] if index < len(container) else MISSING
+    return container.get(key, MISSING)
+
+
+def _put(container: Any, key: str, value: Any, undo: Optional[UndoLog] = None):
+    if isinstance(container, list):
+        index = int(key)
+        if undo is not None:
+            _record_item(container, index, undo)
+        container.extend([None] * (index + 1 - len(container)))
+        container[index] = value
+    else:
+        if undo is not None:
+            old = container.get(key, MISSING)
+            undo.append(lambda: _restore_field(container, key, old))
+        container[key] = value
+
+
+def _record_item(container: list, index: int, undo: UndoLog):
+    length = len(container)
+    if index >= length:
+        undo.append(lambda: container.__delitem__(slice(length, None)))
+        return
+    old = container[index]
+    undo.append(lambda: container.__setitem__(index, old))
+
+
+def _restore_field(container: dict, key: str, old: Any):
+    if old is MISSING:
+        del container[key]
+    else:
+        container[key] = old
+
+
+def _replace_fields(document: dict, fields: dict):
+    document.clear()
+    document.update(fields)
+
+
+def _delete(container: dict, key: str, undo: Optional[UndoLog]):
+    if undo is not None:
+        position = list(container).index(key)
+        old = container[key]
+        undo.append(lambda: _reinsert(container, key, old, position))
+    del container[key]
+
+
+def _reinsert(container: dict, key: str, value: Any, position: int):
+    """Put a deleted field back at its position, which keeps the field order of the document"""
+    following = [(field, container.pop(field)) for field in list(container)[position:]]
+    container[key] = value
+    container.update(following)
+
+
+def _record_array(current: list, undo: Optional[UndoLog], appends: bool):
+    """Record how to undo an in place change of an array: its length if the change only appends, else its items"""
+    if undo is None:
+        return
+    if appends:
+        length = len(current)
+        undo.append(lambda: current.__delitem__(slice(length, None)))
+    else:
+        items = list(current)
+        undo.append(lambda: current.__setitem__(slice(None), items))
+
+
+def _same(old: Any, new: Any) -> bool:
+    return old is not MISSING and values_equal(old, new) and type(old) is type(new)
+
+
+def _number(value: Any, operator: str, path: str):
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise WriteError(f"Cannot apply {operator} to a value of non-numeric type. {{{path}: {value!r}}}", 14)
+
+
+def _current_date(spec: Any) -> Any:
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    if isinstance(spec, Mapping) and spec.get("$type") == "timestamp":
+        return Timestamp(int(now.replace(tzinfo=timezone.utc).timestamp()), 1)
+    return now
+
+
+def _pull_matcher(condition: Any):
+    if is_operator_expression(condition):
+        predicate = compile_filter({"value": condition})
+        return lambda item: predicate({"value": item})
+    if isinstance(condition, Mapping):
+        predicate = compile_filter(condition)
+        return lambda item: isinstance(item, Mapping) and predicate(item)
+    return lambda item: values_equal(item, condition)
+
+
+def _push(current: list, spec: Any, path: str, undo: Optional[UndoLog] = None) -> bool:
+    if not (isinstance(spec, Mapping) and "$each" in spec):
+        _record_array(current, undo, True)
+        current.append(copy_document(spec))
+        return True
+    items = [copy_document(item) for item in spec["$each"]]
+    _record_array(current, undo, spec.keys() == {"$each"})
+    position = spec.get("$position")
+    if position is None:
+        current.extend(items)
+    else:
+        current[position:position] = items
+    if "$sort" in spec:
+        order = spec["$sort"]
+        if isinstance(order, Mapping):
+            current.sort(key=document_sort_key(list(order.items())))
+        else:
+            current.sort(key=sort_key, reverse=order < 0)
+    if "$slice" in spec:
+        limit = spec["$slice"]
+        current[:] = current[:limit] if limit >= 0 else current[limit:]
+    return bool(items) or "$sort" in spec or "$slice" in spec
+
+
+def _apply(document: dict, operator: str, path: str, value: Any, is_insert: bool, undo: Optional[UndoLog] = None) -> bool:
+    parts = path.split(".")
+    if parts[0] == "_id" and operator != "$setOnInsert":
+        unchanged = operator == "$set" and len(parts) == 1 and (_same(document.get("_id", MISSING), value) or is_insert and "_id" not in document)
+        if not unchanged:
+            raise WriteError("Performing an update on the path '_id' would modify the immutable field '_id'", 66)
+    creates = operator not in ("$unset", "$pull", "$pop", "$rename")
+    container = _parent(document, parts, creates, undo)
+    if container is None:
+        return False
+    key = parts[-1]
+    current = _get(container, key)
+
+    if operator in ("$set", "$setOnInsert", "$currentDate"):
+        if operator == "$setOnInsert" and not is_insert:
+            return False
+        new = _current_date(value) if operator == "$currentDate" else copy_document(value)
+        if _same(current, new):
+            return False
+        _put(container, key, new, undo)
+        return True
+    if operator == "$unset":
+        if current is MISSING:
+            return False
+        if isinstance(container, list):
+            _put(container, key, None, undo)
+        else:
+            _delete(container, key, undo)
+        return True
+    if operator in ("$inc", "$mul"):
+        _number(value, operator, path)
+        if current is MISSING:
+            _put(container, key, value if operator == "$inc" else value * 0, undo)
+            return True
+        _number(current, operator, path)
+        new = current + value if operator == "$inc" else current * value
+        _put(container, key, new, undo)
+        return not _same(current, new)
+    if operator in ("$min", "$max"):
+        if current is not MISSING:
+            smaller = sort_key(value) < sort_key(current)
+            if smaller != (operator == "$min") or sort_key(value) == sort_key(current):
+                return False
+        _put(container, key, copy_document(value), undo)
+        return True
+    if operator == "$rename":
+        if current is MISSING:
+            return False
+        _delete(container, key, undo)
+        target_parts = value.split(".")
+        _put(_parent(document, target_parts, True, undo), target_parts[-1], current, undo)
+        return True
+
+    # array operators
+    if current is MISSING:
+        if operator in ("$pull", "$pop"):
+            return False
+        current = []
+        _put(container, key, current, undo)
+    elif not isinstance(current, list):
+        raise WriteError(f"The field '{path}' must be an array but is of type {type(current).__name__}", 2)
+    if operator == "$push":
+        return _push(current, value, path, undo)
+    if operator == "$addToSet":
+        items = value["$each"] if isinstance(value, Mapping) and "$each" in value else [value]
+        present = {hashable(item) for item in current}
+        _record_array(current, undo, True)
+        modified = False
+        for item in items:
+            if hashable(item) not in present:
+                present.add(hashable(item))
+                current.append(copy_document(item))
+                modified = True
+        return modified
+    if operator == "$pull":
+        matches = _pull_matcher(value)
+        kept = [item for item in current if not matches(item)]
+        if len(kept) == len(current):
+            return False
+        _record_array(current, undo, False)
+        current[:] = kept
+        return True
+    if not current:
+        return False
+    index = 0 if value == -1 else len(current) - 1
+    if undo is not None:
+        removed = current[index]
+        undo.append(lambda: current.insert(index, removed))
+    del current[index]
+    return True
+
+
+def apply_update(document: dict, update: Mapping[str, Any], is_insert: bool = False, undo: Optional[UndoLog] = None) -> bool:
+    """
+    Apply update operators to a document in place, returns whether the document changed.
+
+    Only the values an update writes are copied. $setOnInsert only applies when is_insert is set,
+    that is when an upsert inserts the document. Every change is recorded in undo if given, keeping
+    only the values it overwrites, so revert(undo) restores the document after a failure.
+    """
+    validate_update(update)
+    modified = False
+    for operator, changes in update.items():
+        for path, value in changes.items():
+            modified |= _apply(document, operator, path, value, is_insert, undo)
+    return modified
+
+
+def upsert_document(filter: Optional[Mapping[str, Any]], update: Mapping[str, Any]) -> dict:
+    """The document an upsert inserts: the equality fields of the filter with the update applied"""
+    document = {}
+    for path, value in (filter or {}).items():
+        if path == "$and":
+            for clause in value:
+                document.update(upsert_document(clause, {}))
+            continue
+        if path.startswith("$"):
+            continue
+        if is_operator_expression(value):
+            if "$eq" not in value:
+                continue
+            value = value["$eq"]
+        container = _parent(document, path.split("."), True)
+        _put(container, path.split(".")[-1], copy_document(value))
+    if update:
+        apply_update(document, update, is_insert=True)
+    return document
+
+
+def replace_document(document: dict, replacement: Mapping[str, Any], undo: Optional[UndoLog] = None) -> bool:
+    """Replace the fields of a document in place keeping its _id, returns whether the document changed, see apply_update() for undo"""
+    if "_id" in replacement and not _same(document["_id"], replacement["_id"]):
+        raise WriteError("After applying the update, the (immutable) field '_id' was found to have been altered", 66)
+    replaced = {"_id": document["_id"]}
+    replaced.update((field, copy_document(value)) for field, value in replacement.items() if field != "_id")
+    if replaced == document:
+        return False
+    if undo is not None:
+        previous = dict(document)
+        undo.append(lambda: _replace_fields(document, previous))
+    document.clear()
+    document.update(replaced)
+    return True
+
+
+def upsert_replacement(filter: Optional[Mapping[str, Any]], replacement: Mapping[str, Any]) -> dict:
+    """The document a replacing upsert inserts: the replacement, with the _id of the filter if it has one"""
+    document = copy_document(dict(replacement))
+    _id = (filter or {}).get("_id", MISSING)
+    if "_id" not in document and _id is not MISSING and not is_operator_expression(_id):
+        document = {"_id": copy_document(_id), **document}
+    return document